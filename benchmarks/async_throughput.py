@@ -0,0 +1,74 @@
+"""Throughput of concurrent requests to the hot routes on a single worker.
+
+Runs the app in a single event loop (like one uvicorn worker) and fires
+'--concurrency' clients at GET /transaction/, GET /user/{username}/ and
+POST /transaction/{username} at the same time.
+
+Usage (against the database configured via DUNDIE_* variables):
+
+    uv run python benchmarks/async_throughput.py --requests 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+from time import perf_counter
+
+from httpx import ASGITransport, AsyncClient
+from sqlmodel import Session
+
+from common import get_or_create_user, grow_history, token_for
+from dundie_api.db import engine
+from dundie_api.main import app
+
+# Rotas exercitadas pelo benchmark, de forma alternada.
+ROUTES = [
+    ("GET", "/transaction/?size=50", None),
+    ("GET", "/user/bench-holder/?show_balance=true", None),
+    ("POST", "/transaction/bench-holder", {"value": 1}),
+]
+
+
+# Cada cliente executa as rotas em sequência até atingir o total de requisições.
+async def worker(client: AsyncClient, counter: list[int], total: int) -> None:
+    while counter[0] < total:
+        method, url, body = ROUTES[counter[0] % len(ROUTES)]
+        counter[0] += 1
+        response = await client.request(method, url, json=body)
+        response.raise_for_status()
+
+
+async def run(total: int, concurrency: int) -> float:
+    token = token_for("bench-admin")
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://bench",
+        headers={"Authorization": f"Bearer {token}"},
+    ) as client:
+        counter = [0]
+        start = perf_counter()
+        await asyncio.gather(
+            *[worker(client, counter, total) for _ in range(concurrency)]
+        )
+        return total / (perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--history", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        sender = get_or_create_user(session, "bench-admin", "management")
+        user = get_or_create_user(session, "bench-holder", "sales")
+        grow_history(session, user, sender, args.history)
+
+    print(f"{'concurrency':>12} {'req/s':>10}")
+    for concurrency in args.concurrency:
+        throughput = asyncio.run(run(args.requests, concurrency))
+        print(f"{concurrency:>12} {throughput:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
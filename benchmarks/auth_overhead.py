@@ -0,0 +1,44 @@
+"""Authentication overhead per request with and without the verified-token cache.
+
+Usage (against the database configured via DUNDIE_* variables):
+
+    uv run python benchmarks/auth_overhead.py --rounds 5000
+"""
+
+import argparse
+
+from sqlmodel import Session
+
+from common import client_for, get_or_create_user, measure, token_for
+from dundie_api.auth import get_current_user
+from dundie_api.cache import token_cache
+from dundie_api.db import engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=5_000)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        get_or_create_user(session, "bench-holder", "sales")
+
+    token = token_for("bench-holder")
+    client = client_for("bench-holder")
+
+    print(f"{'token cache':>12} {'scenario':>10} {'median ms':>10} {'p95 ms':>10}")
+    for enabled in (False, True):
+        token_cache.enabled = enabled
+        token_cache.clear()
+        # Apenas a autenticação, o cache de usuários fica aquecido nos dois casos.
+        median, p95 = measure(lambda: get_current_user(token=token), args.rounds)
+        print(f"{str(enabled):>12} {'auth':>10} {median:>10.4f} {p95:>10.4f}")
+        # Requisição completa a uma rota autenticada.
+        median, p95 = measure(
+            lambda: client.get("/user/bench-holder/"), args.rounds // 10
+        )
+        print(f"{str(enabled):>12} {'request':>10} {median:>10.4f} {p95:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Per-transfer latency of add_transaction as the history grows.
+
+Usage (against the database configured via DUNDIE_* variables):
+
+    uv run python benchmarks/balance_latency.py --sizes 10 1000 100000 1000000
+"""
+
+import argparse
+
+from sqlmodel import Session
+
+from common import get_or_create_user, grow_history, measure
+from dundie_api.db import engine
+from dundie_api.tasks.transaction import add_transaction
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 1_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        sender = get_or_create_user(session, "bench-admin", "management")
+        user = get_or_create_user(session, "bench-holder", "sales")
+
+        print(f"{'history':>10} {'median ms':>10} {'p95 ms':>10}")
+        for size in sorted(args.sizes):
+            grow_history(session, user, sender, size)
+
+            median, p95 = measure(
+                lambda: add_transaction(
+                    user=user, from_user=sender, value=1, session=session
+                ),
+                args.rounds,
+            )
+            print(f"{size:>10} {median:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Helpers shared by the benchmark scripts."""
+
+import statistics
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, func, insert, select, text
+
+from dundie_api.auth import create_access_token, token_claims
+from dundie_api.cache import password_version
+from dundie_api.db import engine
+from dundie_api.main import app
+from dundie_api.models import Transaction, User
+from dundie_api.security import get_password_hash
+
+# Tamanho de cada lote de inserção usado para popular o histórico.
+CHUNK = 10_000
+
+
+# Busca ou cria um usuário usado apenas pelos benchmarks.
+def get_or_create_user(session: Session, username: str, dept: str) -> User:
+    user = session.exec(select(User).where(User.username == username)).first()
+    if user:
+        return user
+    user = User(
+        name=username,
+        username=username,
+        email=f"{username}@bench.dm.com",
+        dept=dept,
+        currency="USD",
+        password=get_password_hash(username),
+    )
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    return user
+
+
+# Completa o histórico do usuário até atingir 'size' transações recebidas,
+# inserindo em lotes diretamente na tabela, sem passar pelo cálculo de saldo.
+# Cada transação recebe uma data diferente para simular um histórico real.
+def grow_history(session: Session, user: User, sender: User, size: int) -> None:
+    current = session.scalar(
+        select(func.count()).where(Transaction.user_id == user.id)  # type: ignore
+    )
+    missing = size - (current or 0)
+    start = datetime.now(timezone.utc) - timedelta(seconds=missing)
+    while missing > 0:
+        batch = min(missing, CHUNK)
+        session.execute(
+            insert(Transaction),
+            [
+                {
+                    "user_id": user.id,
+                    "from_id": sender.id,
+                    "value": index % 100 + 1,
+                    "date": start + timedelta(seconds=index),
+                }
+                for index in range(batch)
+            ],
+        )
+        session.commit()
+        start += timedelta(seconds=batch)
+        missing -= batch
+
+
+# Cria um token de acesso para o usuário informado, com a versão da sua senha atual.
+def token_for(username: str) -> str:
+    with Session(engine) as session:
+        user = session.exec(select(User).where(User.username == username)).one()
+    claims = token_claims(user.username, password_version(user.password))
+    return create_access_token(data={**claims, "fresh": True})
+
+
+# Cria um cliente de testes da API autenticado com o usuário informado.
+def client_for(username: str) -> TestClient:
+    client = TestClient(app)
+    token = token_for(username)
+    client.headers["Authorization"] = f"Bearer {token}"
+    return client
+
+
+# Executa 'func' várias vezes e retorna a mediana e o percentil 95 em milissegundos.
+def measure(func, rounds: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(rounds):
+        start = perf_counter()
+        func()
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]
+
+
+# Retorna o plano de execução de uma query no PostgreSQL ou no SQLite.
+def explain(session: Session, query) -> str:
+    dialect = session.get_bind().dialect
+    sql = query.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    if dialect.name == "postgresql":
+        return "\n".join(row[0] for row in session.execute(text(f"EXPLAIN {sql}")))
+    rows = session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+    return "\n".join(row[-1] for row in rows)
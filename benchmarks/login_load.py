@@ -0,0 +1,83 @@
+"""Latency of GET /user/ while POST /token is being hammered on the same worker.
+
+Runs the app in a single event loop (like one uvicorn worker) and compares the
+/user/ latency alone with the latency while concurrent logins verify Argon2
+hashes.
+
+Usage (against the database configured via DUNDIE_* variables):
+
+    uv run python benchmarks/login_load.py --requests 200 --logins 8
+"""
+
+import argparse
+import asyncio
+import statistics
+from time import perf_counter
+
+from httpx import ASGITransport, AsyncClient
+from sqlmodel import Session
+
+from common import get_or_create_user, token_for
+from dundie_api.db import engine
+from dundie_api.main import app
+
+
+# Mede a latência de 'requests' chamadas sequenciais a GET /user/.
+async def list_users(client: AsyncClient, requests: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(requests):
+        start = perf_counter()
+        response = await client.get("/user/")
+        response.raise_for_status()
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]
+
+
+# Realiza logins continuamente até o evento 'stop' ser sinalizado.
+async def hammer_login(client: AsyncClient, stop: asyncio.Event) -> int:
+    logins = 0
+    while not stop.is_set():
+        response = await client.post(
+            "/token", data={"username": "bench-holder", "password": "bench-holder"}
+        )
+        response.raise_for_status()
+        logins += 1
+    return logins
+
+
+async def run(requests: int, concurrency: int) -> None:
+    token = token_for("bench-holder")
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://bench",
+        headers={"Authorization": f"Bearer {token}"},
+    ) as client:
+        median, p95 = await list_users(client, requests)
+        print(f"{'idle':>12} {median:>10.2f} {p95:>10.2f} {'-':>8}")
+
+        stop = asyncio.Event()
+        logins = [
+            asyncio.create_task(hammer_login(client, stop)) for _ in range(concurrency)
+        ]
+        median, p95 = await list_users(client, requests)
+        stop.set()
+        total = sum(await asyncio.gather(*logins))
+        print(f"{'/token load':>12} {median:>10.2f} {p95:>10.2f} {total:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--logins", type=int, default=8)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        get_or_create_user(session, "bench-holder", "sales")
+
+    print(f"{'scenario':>12} {'median ms':>10} {'p95 ms':>10} {'logins':>8}")
+    asyncio.run(run(args.requests, args.logins))
+
+
+if __name__ == "__main__":
+    main()
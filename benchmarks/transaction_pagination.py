@@ -0,0 +1,57 @@
+"""Latency of GET /transaction/ on the first and on a deep page.
+
+Compares offset pagination (page/size, with COUNT) and cursor pagination.
+
+Usage (against the database configured via DUNDIE_* variables):
+
+    uv run python benchmarks/transaction_pagination.py --deep-page 10000
+"""
+
+import argparse
+
+from sqlmodel import Session, select
+
+from common import client_for, get_or_create_user, grow_history, measure
+from dundie_api.db import engine
+from dundie_api.models import Transaction
+from dundie_api.pagination import encode_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deep-page", type=int, default=10_000)
+    parser.add_argument("--size", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        admin = get_or_create_user(session, "bench-admin", "management")
+        holder = get_or_create_user(session, "bench-holder", "sales")
+        grow_history(session, holder, admin, args.deep_page * args.size)
+
+        # Cursor equivalente ao início da página profunda, gerado a partir do último
+        # registro da página anterior, como um cliente faria ao percorrer as páginas.
+        offset = (args.deep_page - 1) * args.size - 1
+        last_id = session.scalar(
+            select(Transaction.id).order_by(Transaction.id).offset(offset).limit(1)  # type: ignore
+        )
+
+    client = client_for("bench-admin")
+    cases = {
+        "page 1 (offset)": {"page": 1},
+        f"page {args.deep_page} (offset)": {"page": args.deep_page},
+        "page 1 (cursor)": {"pagination": "cursor"},
+        f"page {args.deep_page} (cursor)": {"cursor": encode_cursor("id", [last_id])},
+    }
+
+    print(f"{'case':>24} {'median ms':>10} {'p95 ms':>10}")
+    for name, params in cases.items():
+        params = {"size": args.size, **params}
+        median, p95 = measure(
+            lambda: client.get("/transaction/", params=params), args.rounds
+        )
+        print(f"{name:>24} {median:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Latency and query plan of sorted deep pages of GET /transaction/.
+
+For every whitelisted order_by key, reports the latency of a deep offset
+page and whether the database had to sort the whole ledger to answer it.
+
+Usage (against the database configured via DUNDIE_* variables):
+
+    uv run python benchmarks/transaction_sorting.py --deep-page 10000
+"""
+
+import argparse
+import re
+
+from sqlmodel import Session
+
+from common import client_for, explain, get_or_create_user, grow_history, measure
+from dundie_api.db import engine
+from dundie_api.models import User
+from dundie_api.routes.transaction import TRANSACTION_ORDERING, _transactions_query
+
+
+# Verifica se o plano de execução possui uma etapa de ordenação de todas as linhas.
+def has_full_sort(plan: str) -> bool:
+    return "TEMP B-TREE" in plan or bool(
+        re.search(r"^\s*(->\s*)?Sort\b", plan, re.MULTILINE)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deep-page", type=int, default=10_000)
+    parser.add_argument("--size", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        admin = get_or_create_user(session, "bench-admin", "management")
+        holder = get_or_create_user(session, "bench-holder", "sales")
+        grow_history(session, holder, admin, args.deep_page * args.size)
+
+    client = client_for("bench-admin")
+    keys = [key for name in TRANSACTION_ORDERING for key in (name, f"-{name}")]
+
+    print(f"{'order_by':>10} {'median ms':>10} {'p95 ms':>10} {'full sort':>10}")
+    for order_by in keys:
+        params = {"order_by": order_by, "page": args.deep_page, "size": args.size}
+        median, p95 = measure(
+            lambda: client.get("/transaction/", params=params), args.rounds
+        )
+
+        # Mesma query executada pela rota, como um super usuário sem filtros.
+        columns = TRANSACTION_ORDERING[order_by.removeprefix("-")]
+        descending = order_by.startswith("-")
+        query = (
+            _transactions_query(User(id=0, dept="management"))
+            .order_by(*[c.desc() if descending else c.asc() for c in columns])
+            .offset((args.deep_page - 1) * args.size)
+            .limit(args.size)
+        )
+        with Session(engine) as session:
+            full_sort = has_full_sort(explain(session, query))
+
+        print(f"{order_by:>10} {median:>10.2f} {p95:>10.2f} {str(full_sort):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""transaction indexes
+
+Revision ID: c3f1a2b4d5e6
+Revises: 883295019f6c
+Create Date: 2026-10-17 10:12:31.118204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c3f1a2b4d5e6"
+down_revision: Union[str, Sequence[str], None] = "883295019f6c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Índices compostos da tabela 'transaction' e suas colunas.
+INDEXES = {
+    "ix_transaction_user_id_date_id": ["user_id", "date", "id"],
+    "ix_transaction_from_id_date_id": ["from_id", "date", "id"],
+    "ix_transaction_date_id": ["date", "id"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 'CREATE INDEX CONCURRENTLY' não bloqueia a escrita na tabela enquanto o índice é
+    # criado, mas não pode ser executado dentro de uma transação, por isso o uso do
+    # 'autocommit_block'.
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(
+                name,
+                "transaction",
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(
+                name,
+                table_name="transaction",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
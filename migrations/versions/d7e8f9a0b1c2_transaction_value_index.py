@@ -0,0 +1,43 @@
+"""transaction value index
+
+Revision ID: d7e8f9a0b1c2
+Revises: c3f1a2b4d5e6
+Create Date: 2026-10-17 11:40:05.602913
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d7e8f9a0b1c2"
+down_revision: Union[str, Sequence[str], None] = "c3f1a2b4d5e6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Índice usado pela ordenação por valor ('order_by=value'), criado sem bloquear
+    # a escrita na tabela.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_transaction_value_id",
+            "transaction",
+            ["value", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_transaction_value_id",
+            table_name="transaction",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
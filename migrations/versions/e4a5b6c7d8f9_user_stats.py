@@ -0,0 +1,74 @@
+"""user stats
+
+Revision ID: e4a5b6c7d8f9
+Revises: d7e8f9a0b1c2
+Create Date: 2026-10-17 15:02:47.301552
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e4a5b6c7d8f9"
+down_revision: Union[str, Sequence[str], None] = "d7e8f9a0b1c2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "user_stats",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("received_count", sa.Integer(), nullable=False),
+        sa.Column("received_total", sa.Integer(), nullable=False),
+        sa.Column("sent_count", sa.Integer(), nullable=False),
+        sa.Column("sent_total", sa.Integer(), nullable=False),
+        sa.Column("first_transaction_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_transaction_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+
+    # Popula o resumo de todos os usuários a partir do histórico de transações, com
+    # uma única query agrupada (mesma lógica do comando 'dundie rebuild-stats').
+    op.execute(
+        """
+        INSERT INTO user_stats (
+            user_id, received_count, received_total, sent_count, sent_total,
+            first_transaction_at, last_transaction_at, updated_at
+        )
+        SELECT
+            u.id,
+            COALESCE(SUM(m.received_count), 0),
+            COALESCE(SUM(m.received_total), 0),
+            COALESCE(SUM(m.sent_count), 0),
+            COALESCE(SUM(m.sent_total), 0),
+            MIN(m.date),
+            MAX(m.date),
+            NOW()
+        FROM "user" AS u
+        LEFT JOIN (
+            SELECT user_id, 1 AS received_count, value AS received_total,
+                   0 AS sent_count, 0 AS sent_total, date
+            FROM transaction
+            UNION ALL
+            SELECT from_id, 0, 0, 1, value, date
+            FROM transaction
+        ) AS m ON m.user_id = u.id
+        GROUP BY u.id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("user_stats")
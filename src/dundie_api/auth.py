@@ -22,23 +22,43 @@ from pydantic import BaseModel
 # Biblioteca para gerar e validar JWT (PyJWT)
 import jwt
 
-# Classe para representar um erro de validação de um token.
-from jwt import PyJWTError
+# Classe para representar um erro de validação de um token e as suas subclasses usadas
+# para identificar o motivo da falha.
+from jwt import (
+    DecodeError,
+    ExpiredSignatureError,
+    InvalidSignatureError,
+    PyJWTError,
+)
 
 # Variável de configurações da API.
 from dundie_api.config import settings
 
-# Função para verificar a senha.
-from dundie_api.security import verify_password
+# Funções para verificar a senha e atualizar o seu hash sem bloquear o event loop.
+from dundie_api.security import (
+    async_get_password_hash,
+    async_verify_password,
+    check_needs_rehash,
+)
 
 # Model 'User".
 from dundie_api.models import User
 
-# Engine para conexão ao banco de dados.
-from dundie_api.db import engine
+# Engine assíncrona para conexão ao banco de dados.
+from dundie_api.db import async_engine
 
 # Objetos para fazer querys no banco de dados.
-from sqlmodel import select, Session
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Medição do tempo de autenticação da requisição atual.
+from dundie_api.timing import request_metrics, timed
+
+# Cache da identidade dos usuários autenticados, compartilhado entre as requisições.
+from dundie_api.cache import UserIdentity, password_version, token_cache, user_cache
+
+# Contador de tokens rejeitados, exposto em '/metrics'.
+from dundie_api.metrics import jwt_failures
 
 # Chave secreta e algoritmo usado para gerar o JWT.
 SECRET_KEY = settings.security.secret_key  # pyright: ignore[reportOptionalMemberAccess, reportAttributeAccessIssue]
@@ -111,10 +131,17 @@ def create_access_token(
 create_refresh_token = partial(create_access_token, scope="refresh_token")
 
 
+# Função que retorna os dados do usuário incluídos nos tokens: o 'username' e a versão
+# da senha ('pv'), dessa forma, os tokens emitidos antes de uma alteração de senha
+# deixam de ser aceitos.
+def token_claims(username: str, version: str) -> dict:
+    return {"sub": username, "pv": version}
+
+
 # Função para autenticar um usuário.
 # Recebe uma função 'get_user' para selecionar o usuário do banco de dados e
 # recebe o 'username' e a senha ('password') do usuário.
-def authenticate_user(
+async def authenticate_user(
     get_user: Callable,
     username: str,
     password: str,
@@ -122,7 +149,7 @@ def authenticate_user(
     """Verify if user exists and password is correct."""
 
     # Seleciona o usuário no banco de dados através de seu username.
-    user = get_user(username)
+    user = await get_user(username)
 
     # Se não encontrar nenhum usuário, retorna falso, indicando que o
     # usuário em questão não existe.
@@ -131,27 +158,154 @@ def authenticate_user(
 
     # Valida a senha passada para ver se bate com a que está no banco de dados.
     # TODO: VerifyMismatchError
-    if not verify_password(plain_password=password, hashed_password=user.password):
+    # A verificação é executada no pool de hashes, fora do event loop.
+    if not await async_verify_password(
+        plain_password=password, hashed_password=user.password
+    ):
         return False
 
+    # Se o hash foi criado com parâmetros do Argon2 diferentes dos atuais, cria um novo
+    # hash com a senha que acabou de ser verificada e o armazena no banco de dados.
+    if check_needs_rehash(user.password):
+        user.password = await async_get_password_hash(password)
+        await update_password_hash(user)
+
     # Caso todas as validações forem verdadeiras retorna o usuário e seus dados.
     return user
 
 
+# Função que armazena o novo hash da senha do usuário e o remove do cache, já que a
+# versão da senha foi alterada.
+async def update_password_hash(user: User) -> None:
+    query = (
+        update(User)
+        .where(User.id == user.id)  # pyright: ignore[reportArgumentType]
+        .values(password=user.password)
+    )
+    async with AsyncSession(async_engine) as session:
+        await session.exec(query)  # type: ignore
+        await session.commit()
+    user_cache.invalidate(user.username)
+
+
 # Função para selecionar um usuário no banco de dados.
-def get_user(username: str | None) -> User | None:
+async def get_user(username: str | None) -> User | None:
     # TODO: move to utils module or User model.
     # Monta a query para selecionar o usuário através de seu 'username'.
     query = select(User).where(User.username == username)
-    # Abre uma sessão de conexão com o banco de dados.
-    with Session(engine) as session:
+    # Abre uma sessão assíncrona de conexão com o banco de dados.
+    async with AsyncSession(async_engine) as session:
         # Retorna o primeiro usuário encontrado no banco de dados.
-        return session.exec(query).first()
+        return (await session.exec(query)).first()
+
+
+# Função que decodifica e verifica o token, retornando o seu payload ou None caso o
+# token seja inválido. Os payloads já verificados são reaproveitados do cache até o
+# token expirar.
+def decode_token(token: str) -> dict | None:
+    if (payload := token_cache.get(token)) is not None:
+        return payload
+    try:
+        # Decodifica o token, retornando o payload.
+        # É necessário a chave secreta e o algoritmo usado anteriormente.
+        payload = jwt.decode(
+            token,
+            SECRET_KEY,  # pyright: ignore[reportArgumentType]
+            algorithms=[ALGORITHM],  # pyright: ignore[reportArgumentType]
+        )
+    # Caso a decodificação do token falhar, essa exceção é capturada.
+    except PyJWTError as error:
+        jwt_failures.labels(reason=_failure_reason(error)).inc()
+        return None
+    token_cache.set(token, payload)
+    return payload
+
+
+# Função que retorna o motivo da falha ao decodificar um token, usado como rótulo.
+def _failure_reason(error: PyJWTError) -> str:
+    if isinstance(error, ExpiredSignatureError):
+        return "expired"
+    if isinstance(error, InvalidSignatureError):
+        return "signature"
+    if isinstance(error, DecodeError):
+        return "malformed"
+    return "invalid"
+
+
+# Função que decodifica o token e busca o usuário dono dele no banco de dados.
+# Retorna o payload e o usuário, ou None caso o token ou o usuário sejam inválidos.
+async def _authenticate_token(token: str) -> tuple[dict, User] | None:
+    payload = decode_token(token)
+    if payload is None:
+        return None
+
+    # Seleciona o 'username' do usuário, caso esteja vazio o token é inválido.
+    username: str = payload.get("sub")
+    if username is None:
+        jwt_failures.labels(reason="missing_subject").inc()
+        return None
+
+    # Cria uma instância da classe 'Payload' do Pydantic para representar
+    # os dados do token.
+    token_data = Payload(username=username)
+
+    # Busca a identidade do usuário no cache ou no banco de dados.
+    identity = await get_user_identity(token_data.username)  # pyright: ignore[reportArgumentType]
+    if identity is None:
+        jwt_failures.labels(reason="unknown_user").inc()
+        return None
+
+    # Rejeita os tokens emitidos com uma versão da senha diferente da atual, ou seja,
+    # antes da última alteração de senha do usuário.
+    if payload.get("pv") != identity.password_version:
+        jwt_failures.labels(reason="password_changed").inc()
+        return None
+
+    # Cria um usuário transitório (não associado a nenhuma sessão) apenas com os dados
+    # da identidade, suficiente para as validações de permissão das rotas.
+    user = User(
+        id=identity.id,
+        username=identity.username,
+        name=identity.name,
+        dept=identity.dept,
+    )
+    return payload, user
+
+
+# Função que retorna a identidade de um usuário a partir do cache, caso não esteja
+# armazenada, seleciona apenas as colunas necessárias no banco de dados e a armazena
+# no cache.
+async def get_user_identity(username: str) -> UserIdentity | None:
+    identity = user_cache.get(username)
+    if identity is not None:
+        return identity
+
+    query = select(User.id, User.username, User.name, User.dept, User.password).where(
+        User.username == username
+    )
+    async with AsyncSession(async_engine) as session:
+        row = (await session.exec(query)).first()
+    if row is None:
+        return None
+
+    identity = UserIdentity(
+        id=row.id,
+        username=row.username,
+        name=row.name,
+        dept=row.dept,
+        password_version=password_version(row.password),
+    )
+    user_cache.set(identity)
+    return identity
 
 
 # TODO: Move to pydantic model for direct validation (maybe).
 # Função para validar se o payload está válido e decodificar o token.
-def get_current_user(
+# O resultado da autenticação é armazenado no contexto da requisição ('request.state'),
+# dessa forma, as dependências que autenticam o usuário na mesma requisição (por exemplo,
+# 'AuthenticatedUser' e 'ShowBalanceField') decodificam o token e buscam o usuário no
+# banco de dados apenas uma vez.
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
     request: Request = None,  # pyright: ignore[reportArgumentType]
     fresh=False,
@@ -177,44 +331,37 @@ def get_current_user(
             except IndexError:
                 raise credentials_exception
 
-    try:
-        # Decodifica o token, retornando o payload.
-        # É necessário a chave secreta e o algoritmo usado anteriormente.
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,  # pyright: ignore[reportArgumentType]
-            algorithms=[ALGORITHM],  # pyright: ignore[reportArgumentType]
-        )
-
-        # Seleciona o 'username' do usuário.
-        username: str = payload.get("sub")
-
-        # Verifica se o 'username' está vazio, se estiver invoca um erro
-        # de validação de credenciais.
-        if username is None:
-            raise credentials_exception
-
-        # Cria uma instância da classe 'Payload' do Pydantic para representar
-        # os dados do token.
-        token_data = Payload(username=username)
-
-    # Caso a decodificação do token falhar, essa exceção é capturada.
-    except PyJWTError:
-        # Invoca uma exceção de erro de validação de credenciais.
-        raise credentials_exception
-
-    # Seleciona o usuário no banco de dados através do 'username'.
-    user = get_user(username=token_data.username)
-
-    # Se não encontrar nenhum usuário, invoca um erro de validação de credenciais.
-    if user is None:
+    # Reutiliza a autenticação já realizada nesta requisição para o mesmo token,
+    # inclusive quando ela falhou, caso contrário, autentica e armazena o resultado.
+    cache = None
+    if request:
+        cache = getattr(request.state, "auth", None)
+        if cache is None:
+            cache = request.state.auth = {}
+    if cache is not None and token in cache:
+        authenticated = cache[token]
+    else:
+        with timed("auth"):
+            authenticated = await _authenticate_token(token)
+        if cache is not None:
+            cache[token] = authenticated
+
+    # Se o token for inválido ou o usuário não for encontrado, invoca um erro de
+    # validação de credenciais.
+    if authenticated is None:
         raise credentials_exception
+    payload, user = authenticated
 
     # Se for um novo token, é no payload a chave 'fresh' não estiver definida e o usuário
     # não for um super usuário, retorna um erro de credenciais.
     if fresh and (not payload["fresh"] and not user.superuser):
         raise credentials_exception
 
+    # Informa às métricas da requisição se o usuário autenticado é um superusuário,
+    # apenas eles podem solicitar o header 'Server-Timing'.
+    if request and (metrics := request_metrics.get()) is not None:
+        metrics.superuser = user.superuser
+
     # Após todas as validações, retorna o usuário, caso tudo for validado com sucesso.
     return user
 
@@ -225,7 +372,7 @@ def get_current_user(
 # 'Depends' indica que o token depende do esquema do oauth2, dessa forma
 # as validações são realizadas.
 async def validate_token(token: str = Depends(oauth2_scheme)) -> User:
-    user = get_current_user(token=token)
+    user = await get_current_user(token=token)
     return user
 
 
@@ -234,7 +381,7 @@ async def validate_token(token: str = Depends(oauth2_scheme)) -> User:
 async def get_current_active_user(
     current_user: User = Depends(get_current_user),
 ) -> User:
-    """Wrap the sync get_active_user for async calls."""
+    """Wrap get_current_user as the AuthenticatedUser dependency."""
     return current_user
 
 
@@ -275,8 +422,16 @@ async def get_user_if_change_password_is_allowed(
     3. authenticated_user is User
     """
 
-    # Buscando o usuário no banco de dados para alterar sua senha.
-    target_user = get_user(username)
+    # Tenta validar se o usuário autenticado é válido. Se for retorna o usuário, se não
+    # retorna None. A autenticação é reaproveitada do contexto da requisição.
+    try:
+        authenticated_user = await get_current_user(token="", request=request)
+    except HTTPException:
+        authenticated_user = None
+
+    # Buscando o usuário no banco de dados para alterar sua senha. O usuário autenticado
+    # não é reaproveitado, pois ele vem do cache e não possui todos os campos.
+    target_user = await get_user(username)
 
     # Se não encontrar nenhum registro, invoca uma exceção HTTP do tipo 404,
     # indicando que o usuário não foi encontrado.
@@ -289,19 +444,11 @@ async def get_user_if_change_password_is_allowed(
     # válido e pertence ao usuário que está fazendo a alteração. Se sim, retorna
     # como True, se não, por invocar uma HTTPException, define como False.
     try:
-        valid_pwd_reset_token = (
-            get_current_user(token=pwd_reset_token or "") == target_user
-        )
+        reset_user = await get_current_user(token=pwd_reset_token or "")
+        valid_pwd_reset_token = reset_user.id == target_user.id
     except HTTPException:
         valid_pwd_reset_token = False
 
-    # Tenta validar se o usuário autenticado é válido. Se for retorna o usuário, se não
-    # retorna None.
-    try:
-        authenticated_user = get_current_user(token="", request=request)
-    except HTTPException:
-        authenticated_user = None
-
     # Verifica se alguma das expressões abaixo é verdadeira, caso qualquer uma delas forem
     # True, 'any' vai retornar True também, caso contrário, retorna False.
     if any(
@@ -350,7 +497,7 @@ async def show_balance_field(
     # Tenta autenticar o usuário que está fazendo a requisição, caso consiga logar, armazena o usuário,
     # caso contrário, armazena como None.
     try:
-        authenticated_user = get_current_user(token="", request=request)
+        authenticated_user = await get_current_user(token="", request=request)
     except HTTPException:
         authenticated_user = None
 
@@ -0,0 +1,440 @@
+"""Broadcast of new transactions to the websocket subscribers"""
+
+import asyncio
+import contextvars
+import logging
+from collections import defaultdict
+from time import monotonic
+from typing import Iterator, Optional
+
+import psycopg
+from pydantic import BaseModel
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, or_, select
+
+from dundie_api.config import settings
+from dundie_api.db import engine
+from dundie_api.metrics import broadcast_subscribers
+from dundie_api.replicas import replica_router
+from dundie_api.models import Transaction, User
+
+logger = logging.getLogger(__name__)
+
+
+# Classe com os filtros de uma inscrição do websocket. Os mesmos filtros são aplicados
+# na query do histórico e, em memória, em cada nova transação transmitida pelo hub.
+class TransactionFilter(BaseModel):
+    """Filters of a websocket subscription."""
+
+    # Id do usuário que recebe e do usuário que envia os pontos.
+    user_id: Optional[int] = None
+    from_id: Optional[int] = None
+    # Departamento de quem recebe ou de quem envia os pontos.
+    dept: Optional[str] = None
+    # Valor mínimo da transação.
+    min_value: Optional[int] = None
+    # Id do usuário autenticado quando ele não é um superusuário, apenas as transações
+    # recebidas ou enviadas por ele são visíveis.
+    viewer_id: Optional[int] = None
+
+    # Verifica se uma transação transmitida pelo hub atende a todos os filtros.
+    def matches(self, transaction: dict) -> bool:
+        return all(
+            [
+                self.user_id is None or transaction["user_id"] == self.user_id,
+                self.from_id is None or transaction["from_id"] == self.from_id,
+                self.dept is None
+                or self.dept in (transaction["to_dept"], transaction["from_dept"]),
+                self.min_value is None or transaction["value"] >= self.min_value,
+                self.viewer_id is None
+                or self.viewer_id in (transaction["user_id"], transaction["from_id"]),
+            ]
+        )
+
+    # Chave do índice de inscrições do hub, usa o filtro mais seletivo disponível.
+    # Inscrições sem filtro de usuário ou departamento usam a chave None.
+    def index_key(self) -> Optional[tuple[str, int | str]]:
+        for user_id in (self.user_id, self.from_id, self.viewer_id):
+            if user_id is not None:
+                return ("user", user_id)
+        if self.dept is not None:
+            return ("dept", self.dept)
+        return None
+
+
+# Função que monta a query das transações com id maior que 'after_id', já com os nomes,
+# usernames e departamentos de quem recebe e de quem envia os pontos, em uma única
+# query com JOINs. 'until_id' limita as transações às que possuem id até ele.
+def _transactions_query(
+    after_id: int,
+    filters: Optional[TransactionFilter] = None,
+    until_id: Optional[int] = None,
+):
+    ToUser, FromUser = aliased(User), aliased(User)
+    query = (
+        select(
+            Transaction.id,
+            Transaction.value,
+            Transaction.date,
+            Transaction.user_id,
+            Transaction.from_id,
+            ToUser.name.label("to"),  # type: ignore
+            FromUser.name.label("from"),  # type: ignore
+            ToUser.username.label("user"),  # type: ignore
+            FromUser.username.label("from_user"),  # type: ignore
+            ToUser.dept.label("to_dept"),  # type: ignore
+            FromUser.dept.label("from_dept"),  # type: ignore
+        )
+        .join(ToUser, Transaction.user_id == ToUser.id)  # type: ignore
+        .join(FromUser, Transaction.from_id == FromUser.id)  # type: ignore
+        .where(Transaction.id > after_id)
+        .order_by(Transaction.id)  # type: ignore
+    )
+    if until_id is not None:
+        query = query.where(Transaction.id <= until_id)
+
+    # Aplica os filtros da inscrição diretamente na query.
+    if filters is None:
+        return query
+    if filters.user_id is not None:
+        query = query.where(Transaction.user_id == filters.user_id)
+    if filters.from_id is not None:
+        query = query.where(Transaction.from_id == filters.from_id)
+    if filters.dept is not None:
+        query = query.where(
+            or_(ToUser.dept == filters.dept, FromUser.dept == filters.dept)
+        )
+    if filters.min_value is not None:
+        query = query.where(Transaction.value >= filters.min_value)
+    if filters.viewer_id is not None:
+        query = query.where(
+            or_(
+                Transaction.user_id == filters.viewer_id,
+                Transaction.from_id == filters.viewer_id,
+            )
+        )
+    return query
+
+
+# As transações são lidas de uma réplica de leitura, quando configurada. Um atraso da
+# réplica apenas adia a entrega, pois as transações são buscadas sempre pelo id.
+# Função que busca até 'limit' transações com id maior que 'after_id'.
+# 'filters' restringe as transações aos filtros informados e 'until_id' ao id máximo.
+def fetch_transactions(
+    after_id: int,
+    limit: int,
+    filters: Optional[TransactionFilter] = None,
+    until_id: Optional[int] = None,
+) -> list[dict]:
+    """Return up to `limit` transactions with id greater than `after_id`."""
+    with Session(replica_router.read_engine()) as session:
+        query = _transactions_query(after_id, filters, until_id).limit(limit)
+        return [row._asdict() for row in session.exec(query)]
+
+
+# Gerador que percorre todas as transações com id maior que 'after_id' usando um
+# cursor no servidor do banco de dados, retornando lotes de 'batch_size' transações
+# sem carregar todo o histórico na memória. A sessão é fechada ao fim do gerador.
+# 'filters' restringe as transações aos filtros da inscrição e 'until_id' ao id máximo.
+def stream_transactions(
+    after_id: int,
+    batch_size: int,
+    filters: Optional[TransactionFilter] = None,
+    until_id: Optional[int] = None,
+) -> Iterator[list[dict]]:
+    """Yield batches of transactions with id greater than `after_id`."""
+    with Session(replica_router.read_engine()) as session:
+        result = session.exec(
+            _transactions_query(after_id, filters, until_id).execution_options(
+                stream_results=True, yield_per=batch_size
+            )
+        )
+        for partition in result.partitions():
+            yield [row._asdict() for row in partition]
+
+
+# Classe que representa a inscrição de um cliente no hub, com os seus filtros. Cada
+# inscrição possui a sua própria fila limitada, caso o cliente não consuma as mensagens a tempo e a fila
+# encher, ele é desconectado ('dropped').
+class Subscription:
+    """A subscriber of the broadcast hub with a bounded queue."""
+
+    def __init__(self, queue_size: int, filters: Optional[TransactionFilter] = None):
+        self.queue: asyncio.Queue[Optional[dict]] = asyncio.Queue(queue_size)
+        self.filters = filters or TransactionFilter()
+        self.dropped = False
+
+    # Entrega uma transação ao cliente sem bloquear o hub. Caso a fila esteja cheia,
+    # descarta as mensagens pendentes e sinaliza o fim com 'None'.
+    def deliver(self, transaction: dict) -> bool:
+        try:
+            self.queue.put_nowait(transaction)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+    # Aguarda a próxima transação, retorna None caso o cliente tenha sido desconectado.
+    async def get(self) -> Optional[dict]:
+        return await self.queue.get()
+
+    # Aguarda a próxima transação e junta a ela as que já estiverem na fila, até o
+    # limite de 'size' transações. Retorna None caso o cliente tenha sido desconectado.
+    async def get_batch(self, size: int) -> Optional[list[dict]]:
+        transactions = [await self.queue.get()]
+        while len(transactions) < size and not self.queue.empty():
+            transactions.append(self.queue.get_nowait())
+        if None in transactions:
+            return None
+        return transactions  # type: ignore
+
+
+# Classe do hub de transmissão, existe uma única instância por processo. O hub busca
+# cada nova transação apenas uma vez e entrega para todos os inscritos.
+# As inscrições ficam em um índice por id de usuário e por departamento, dessa forma
+# cada transação é comparada apenas com as inscrições que podem recebê-la.
+# Ele é acordado pelo 'LISTEN/NOTIFY' do PostgreSQL, pela função 'notify' (quando a
+# transação é criada no mesmo processo) ou, na falta de ambos, a cada 'poll_interval'.
+# Com transferências simultâneas, uma transação pode receber um id menor e ser
+# confirmada depois de outra com id maior. Por isso as transações são entregues em
+# ordem de id e somente após todos os ids anteriores serem confirmados ('settled_id').
+# Um id que não aparece após 'gap_timeout' segundos (transação desfeita) é ignorado.
+class BroadcastHub:
+    """Fan out new transactions to every websocket subscriber."""
+
+    def __init__(self):
+        self.subscribers: set[Subscription] = set()
+        self._index: dict[Optional[tuple], set[Subscription]] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: list[asyncio.Task] = []
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._last_id = 0
+        # Horário em que foi encontrado um intervalo de ids ainda não confirmados,
+        # indexado pelo id da transação logo após o intervalo.
+        self._gaps: dict[int, float] = {}
+
+    # Id da última transação entregue, todas as transações com id menor ou igual já
+    # foram confirmadas. As rotas leem o histórico apenas até esse id, as seguintes são
+    # entregues pelo hub, assim nenhuma transação é perdida ou enviada duas vezes.
+    @property
+    def settled_id(self) -> int:
+        return self._last_id
+
+    # Inscreve um novo cliente, iniciando o hub no event loop atual caso ele ainda não
+    # esteja em execução.
+    async def subscribe(
+        self, filters: Optional[TransactionFilter] = None
+    ) -> Subscription:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            await self._start(loop)
+        self._cancel_idle_stop()
+        subscription = Subscription(settings.broadcast.queue_size, filters)  # type: ignore
+        self._add(subscription)
+        return subscription
+
+    # Remove a inscrição do cliente. Quando não houver mais inscritos, o hub continua
+    # em execução por 'broadcast.idle_timeout' segundos antes de parar, evitando que
+    # clientes de long-polling reiniciem o hub (e a conexão do 'LISTEN') a cada pedido.
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._remove(subscription)
+        if not self.subscribers:
+            self._schedule_idle_stop()
+
+    # Agenda a parada do hub no seu event loop, deve ser chamada a partir dele.
+    def _schedule_idle_stop(self) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed() or self._idle_handle is not None:
+            return
+        idle_timeout = settings.broadcast.idle_timeout  # type: ignore
+        if idle_timeout <= 0:
+            self._stop()
+            return
+        self._idle_handle = loop.call_later(idle_timeout, self._stop_if_idle)
+
+    def _cancel_idle_stop(self) -> None:
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    def _stop_if_idle(self) -> None:
+        self._idle_handle = None
+        if not self.subscribers:
+            self._stop()
+
+    def _add(self, subscription: Subscription) -> None:
+        self.subscribers.add(subscription)
+        self._index[subscription.filters.index_key()].add(subscription)
+        broadcast_subscribers.set(len(self.subscribers))
+
+    def _remove(self, subscription: Subscription) -> None:
+        self.subscribers.discard(subscription)
+        broadcast_subscribers.set(len(self.subscribers))
+        key = subscription.filters.index_key()
+        if key in self._index:
+            self._index[key].discard(subscription)
+            if not self._index[key]:
+                del self._index[key]
+
+    # Acorda o hub para buscar novas transações. Pode ser chamada de qualquer thread,
+    # por exemplo, de uma rota síncrona executada no threadpool.
+    def notify(self) -> None:
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None or wakeup is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            # O event loop foi encerrado entre a verificação e a chamada.
+            pass
+
+    async def _start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._stop()
+        self._loop, self._wakeup = loop, asyncio.Event()
+        self.subscribers = set()
+        self._index = defaultdict(set)
+        broadcast_subscribers.set(0)
+
+        # Inicia a partir da última transação existente, o histórico anterior é enviado
+        # por cada websocket ao se conectar. Entre as transações mais recentes, as que
+        # estão após um intervalo de ids são entregues pelo hub quando ele for
+        # preenchido, já que podem existir transações ainda não confirmadas.
+        recent = await asyncio.to_thread(
+            self._recent_ids,
+            settings.broadcast.batch_size,  # type: ignore
+        )
+        self._last_id = recent[0] if recent else 0
+        for transaction_id in recent[1:]:
+            if transaction_id != self._last_id + 1:
+                break
+            self._last_id = transaction_id
+        self._gaps = {}
+
+        # As tarefas do hub são criadas com um contexto vazio, caso contrário herdariam
+        # o contexto da requisição que iniciou o hub e as suas queries seriam somadas às
+        # métricas dessa requisição, mesmo após ela terminar.
+        self._tasks = [loop.create_task(self._run(), context=contextvars.Context())]
+        if engine.dialect.name == "postgresql":
+            self._tasks.append(
+                loop.create_task(self._listen(), context=contextvars.Context())
+            )
+
+    def _stop(self) -> None:
+        # As tarefas são canceladas no seu próprio event loop, que pode ser de outra
+        # thread (por exemplo, cada cliente do TestClient possui o seu event loop).
+        for task in self._tasks:
+            loop = task.get_loop()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(task.cancel)
+        self._tasks = []
+        if self._idle_handle is not None:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._idle_handle.cancel)
+            self._idle_handle = None
+        self._loop = self._wakeup = None
+
+    # Retorna, em ordem crescente, os ids das 'limit' transações mais recentes.
+    @staticmethod
+    def _recent_ids(limit: int) -> list[int]:
+        with Session(replica_router.read_engine()) as session:
+            ids = session.exec(
+                select(Transaction.id).order_by(Transaction.id.desc()).limit(limit)  # type: ignore
+            ).all()
+        return sorted(ids)  # type: ignore
+
+    # Loop principal do hub, aguarda ser acordado (ou o intervalo de polling) e então
+    # busca as novas transações em lotes, entregando cada uma para todos os inscritos.
+    async def _run(self) -> None:
+        wakeup = self._wakeup
+        assert wakeup is not None
+        batch_size = settings.broadcast.batch_size  # type: ignore
+        while True:
+            try:
+                await asyncio.wait_for(
+                    wakeup.wait(),
+                    timeout=settings.broadcast.poll_interval,  # type: ignore
+                )
+            except TimeoutError:
+                pass
+            wakeup.clear()
+
+            # As transações após um intervalo ainda não confirmado são buscadas
+            # novamente nas próximas execuções, até o intervalo ser preenchido.
+            while True:
+                transactions = await asyncio.to_thread(
+                    fetch_transactions, self._last_id, batch_size
+                )
+                published = self._settle(transactions, monotonic())
+                if published < len(transactions) or len(transactions) < batch_size:
+                    break
+
+    # Entrega, em ordem de id, as transações cujos ids anteriores já foram confirmados,
+    # retornando quantas foram entregues. Ao encontrar um intervalo de ids, aguarda até
+    # 'gap_timeout' segundos para que as transações que faltam sejam confirmadas.
+    def _settle(self, transactions: list[dict], now: float) -> int:
+        gap_timeout = settings.broadcast.gap_timeout  # type: ignore
+        published = 0
+        for transaction in transactions:
+            if transaction["id"] > self._last_id + 1:
+                first_seen = self._gaps.setdefault(transaction["id"], now)
+                if now - first_seen < gap_timeout:
+                    break
+                logger.info(
+                    "Skipping unconfirmed transaction ids %d-%d",
+                    self._last_id + 1,
+                    transaction["id"] - 1,
+                )
+            self._publish(transaction)
+            self._last_id = transaction["id"]
+            published += 1
+        self._gaps = {id: seen for id, seen in self._gaps.items() if id > self._last_id}
+        return published
+
+    # Entrega a transação para as inscrições do índice que envolvem quem recebe, quem
+    # envia, os seus departamentos ou que não possuem filtro, verificando os demais
+    # filtros de cada uma delas.
+    def _publish(self, transaction: dict) -> None:
+        keys = [
+            ("user", transaction["user_id"]),
+            ("user", transaction["from_id"]),
+            ("dept", transaction["to_dept"]),
+            ("dept", transaction["from_dept"]),
+            None,
+        ]
+        candidates = set().union(*(self._index.get(key, ()) for key in keys))
+        for subscription in candidates:
+            if not subscription.filters.matches(transaction):
+                continue
+            if not subscription.deliver(transaction):
+                # Cliente lento, a fila está cheia, então ele deixa de receber.
+                self._remove(subscription)
+
+    # Escuta o canal do PostgreSQL ('LISTEN'), acordando o hub a cada 'NOTIFY' enviado
+    # ao confirmar uma transação, inclusive de outros processos (workers, CLI).
+    # Em caso de erro, o hub continua funcionando apenas pelo polling e tenta se
+    # conectar novamente após o intervalo de polling.
+    async def _listen(self) -> None:
+        url = make_url(settings.db.uri).set(drivername="postgresql")  # type: ignore
+        conninfo = url.render_as_string(hide_password=False)
+        channel = settings.broadcast.channel  # type: ignore
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    conninfo, autocommit=True
+                ) as connection:
+                    await connection.execute(f'LISTEN "{channel}"')
+                    async for _ in connection.notifies():
+                        if self._wakeup is not None:
+                            self._wakeup.set()
+            except psycopg.Error as error:
+                logger.warning("Broadcast LISTEN failed: %s", error)
+            await asyncio.sleep(settings.broadcast.poll_interval)  # type: ignore
+
+
+# Instância única do hub de transmissão usada pelas rotas e pelas tasks.
+hub = BroadcastHub()
@@ -0,0 +1,221 @@
+"""Caches of the authentication data shared across requests"""
+
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import monotonic, time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from dundie_api.config import settings
+
+
+# Classe que representa a identidade de um usuário, apenas os dados necessários para
+# autenticar e autorizar as requisições, sem o hash da senha.
+class UserIdentity(BaseModel):
+    """Identity of a user kept in the user cache."""
+
+    id: int
+    username: str
+    name: str
+    dept: str
+    # Versão da senha, um resumo do hash da senha que muda a cada alteração de senha.
+    password_version: str
+
+    @property
+    def superuser(self) -> bool:
+        return self.dept == "management"
+
+
+# Função que calcula a versão da senha a partir do seu hash, sem armazenar o hash.
+def password_version(password_hash: str) -> str:
+    return sha256(password_hash.encode()).hexdigest()[:16]
+
+
+# Classe do cache de usuários, em memória (LRU com tempo de expiração) ou no Redis,
+# para que vários workers compartilhem o mesmo cache e as mesmas invalidações.
+# Os contadores de acertos, falhas, remoções e expirações são do processo atual.
+class UserCache:
+    """Bounded LRU + TTL cache of user identities keyed by username."""
+
+    def __init__(
+        self, maxsize: int, ttl: float, backend: str = "memory", enabled: bool = True
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.enabled = enabled
+        self._lock = Lock()
+        self._entries: OrderedDict[str, tuple[float, UserIdentity]] = OrderedDict()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    # Retorna a identidade do usuário armazenada no cache ou None, caso não exista ou
+    # esteja expirada.
+    def get(self, username: str) -> Optional[UserIdentity]:
+        if not self.enabled:
+            return None
+        if self.backend == "redis":
+            data = self._redis().get(self._key(username))
+            identity = UserIdentity.model_validate_json(data) if data else None
+            self._record("hits" if identity else "misses")
+            return identity
+
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] <= monotonic():
+                if entry is not None:
+                    del self._entries[username]
+                    self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            # Marca a entrada como a mais recentemente utilizada.
+            self._entries.move_to_end(username)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    # Armazena a identidade do usuário, removendo a menos utilizada recentemente caso
+    # o cache esteja cheio.
+    def set(self, identity: UserIdentity) -> None:
+        if not self.enabled:
+            return
+        if self.backend == "redis":
+            self._redis().set(
+                self._key(identity.username),
+                identity.model_dump_json(),
+                ex=max(int(self.ttl), 1),
+            )
+            return
+
+        with self._lock:
+            self._entries[identity.username] = (monotonic() + self.ttl, identity)
+            self._entries.move_to_end(identity.username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    # Remove o usuário do cache, deve ser chamada sempre que os dados do usuário ou a
+    # sua senha forem alterados.
+    def invalidate(self, username: str) -> None:
+        self._record("invalidations")
+        if self.backend == "redis":
+            self._redis().delete(self._key(username))
+            return
+        with self._lock:
+            self._entries.pop(username, None)
+
+    # Remove todos os usuários do cache.
+    def clear(self) -> None:
+        if self.backend == "redis":
+            redis = self._redis()
+            for key in redis.scan_iter(self._key("*")):
+                redis.delete(key)
+            return
+        with self._lock:
+            self._entries.clear()
+
+    # Retorna uma cópia dos contadores do cache.
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries)}
+
+    def _record(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return f"dundie:user:{username}"
+
+    # O Redis é importado apenas quando o backend é utilizado.
+    @staticmethod
+    def _redis():
+        from dundie_api.queue import redis
+
+        return redis
+
+
+# Instância única do cache de usuários, configurada a partir das configurações.
+user_cache = UserCache(
+    maxsize=settings.user_cache.maxsize,  # type: ignore
+    ttl=settings.user_cache.ttl,  # type: ignore
+    backend=settings.user_cache.backend,  # type: ignore
+    enabled=settings.user_cache.enabled,  # type: ignore
+)
+
+
+# Classe do cache dos payloads de tokens JWT já verificados, evitando verificar a
+# assinatura do mesmo token a cada requisição. A chave é um resumo do token, para não
+# manter os tokens em memória, e cada payload expira exatamente no 'exp' do token.
+class TokenCache:
+    """Bounded LRU cache of verified JWT payloads keyed by token digest."""
+
+    # Escopos de tokens que nunca são armazenados, pois são de uso pontual.
+    bypass_scopes = {"pwd_reset"}
+
+    def __init__(self, maxsize: int, enabled: bool = True):
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self._lock = Lock()
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    # Retorna o payload verificado do token ou None, caso não exista ou o token
+    # esteja expirado.
+    def get(self, token: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time():
+                if entry is not None:
+                    del self._entries[key]
+                    self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    # Armazena o payload verificado do token, tokens sem 'exp' ou com escopo ignorado
+    # não são armazenados.
+    def set(self, token: str, payload: dict) -> None:
+        if not self.enabled or payload.get("scope") in self.bypass_scopes:
+            return
+        if not isinstance(expires_at := payload.get("exp"), (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    # Remove todos os tokens do cache.
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    # Retorna uma cópia dos contadores do cache.
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries)}
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return sha256(token.encode()).hexdigest()
+
+
+# Instância única do cache de tokens, configurada a partir das configurações.
+token_cache = TokenCache(
+    maxsize=settings.token_cache.maxsize,  # type: ignore
+    enabled=settings.token_cache.enabled,  # type: ignore
+)
@@ -5,6 +5,9 @@ import typer
 from rich.console import Console
 from rich.table import Table
 
+# Função para escrever as configurações em arquivos.
+from dynaconf import loaders  # type: ignore
+
 # Biblioteca para manipular banco de dados.
 from sqlmodel import Session, select
 
@@ -13,9 +16,15 @@ from .config import settings
 from .db import engine, SQLModel
 from .models import User
 from .models.user import generate_username
-from dundie_api.security import get_password_hash
-
-from dundie_api.tasks.transaction import add_transaction
+from dundie_api.security import get_password_hash, tune_hashing
+from dundie_api.cache import user_cache
+
+from dundie_api.tasks.transaction import (
+    add_transaction,
+    rebuild_balances,
+    rebuild_stats,
+)
+from dundie_api.queue import queue
 from dundie_api.models.transaction import Transaction, Balance
 
 # Instanciando a classe do Typer, a instância é responsável por
@@ -140,6 +149,8 @@ def create_user(
         # Atualiza o valor do usuário na sessão com os valores do banco de dados,
         # dessa forma, é possível acessar o id do usuário criado no banco de dados.
         session.refresh(user)
+        # Remove do cache qualquer identidade antiga com o mesmo 'username'.
+        user_cache.invalidate(user.username)
         # Mensagem indicando que o usuário foi criado.
         typer.echo(f"Created {user.username} user.")
 
@@ -151,8 +162,15 @@ def create_user(
 # esse comando, logo, todos os pontos saem do usuário administrador.
 # 'username' é o usuário que vai receber os pontos.
 # 'value' é a quantidade de pontos que ele vai receber.
+# '--verify' recalcula os saldos a partir do histórico para conferir o resultado.
 @main.command()
-def transaction(username: str, value: int):
+def transaction(
+    username: str,
+    value: int,
+    verify: bool = typer.Option(
+        False, "--verify", help="Recompute balances from history to check them"
+    ),
+):
     """Add specified value to the user"""
 
     # Cria uma tabela para apresentar os dados da transação.
@@ -189,7 +207,9 @@ def transaction(username: str, value: int):
         user_before = user.balance
 
         # Efetua e confirma a transação.
-        add_transaction(user=user, from_user=from_user, session=session, value=value)
+        add_transaction(
+            user=user, from_user=from_user, session=session, value=value, verify=verify
+        )
 
         # Adiciona as linhas que representam os usuários envolvidos, com seus respectivos saldos,
         # sendo o primeiro o saldo anterior e o segundo o novo saldo após a transação.
@@ -202,6 +222,113 @@ def transaction(username: str, value: int):
         Console().print(table)
 
 
+# Comando CLI para recalcular os saldos de todos os usuários a partir das transações,
+# corrigindo os saldos que estiverem diferentes.
+@main.command(name="rebuild-balances")
+def rebuild_balances_command(
+    user: str | None = typer.Option(None, "--user", help="Rebuild a single user"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only show the differences"),
+    background: bool = typer.Option(
+        False, "--background", help="Enqueue the rebuild on the RQ worker"
+    ),
+):
+    """Recompute balances from transactions and fix differences"""
+
+    # Envia o recálculo para ser executado pelo worker do RQ, em segundo plano.
+    if background:
+        job = queue.enqueue(rebuild_balances, username=user, dry_run=dry_run)
+        typer.echo(f"Enqueued job {job.id}.")
+        return
+
+    # Exibe o progresso a cada lote lido, enquanto o recálculo ainda está em andamento.
+    def progress(done: int):
+        typer.echo(f"{done} balances {'differ' if dry_run else 'fixed'} so far...")
+
+    # No modo de simulação, exibe cada diferença assim que ela é encontrada.
+    def report(username: str, stored: int | None, expected: int):
+        typer.echo(f"{username}: stored {stored}, expected {expected}")
+
+    with Session(engine) as session:
+        found = rebuild_balances(
+            username=user,
+            dry_run=dry_run,
+            progress=progress,
+            report=report if dry_run else None,
+            session=session,
+        )
+
+    typer.echo(f"{found} balances {'differ' if dry_run else 'fixed'}.")
+
+
+# Comando CLI para recalcular o resumo de transações dos usuários a partir do
+# histórico, com uma única query agrupada no banco de dados.
+@main.command(name="rebuild-stats")
+def rebuild_stats_command(
+    user: str | None = typer.Option(None, "--user", help="Rebuild a single user"),
+    background: bool = typer.Option(
+        False, "--background", help="Enqueue the rebuild on the RQ worker"
+    ),
+):
+    """Recompute the user transaction summaries from transactions"""
+
+    # Envia o recálculo para ser executado pelo worker do RQ, em segundo plano.
+    if background:
+        job = queue.enqueue(rebuild_stats, username=user)
+        typer.echo(f"Enqueued job {job.id}.")
+        return
+
+    with Session(engine) as session:
+        written = rebuild_stats(username=user, session=session)
+
+    typer.echo(f"{written} summaries rebuilt.")
+
+
+# Comando CLI para ajustar os parâmetros do Argon2 ao servidor, procurando os parâmetros
+# mais fortes que calculam um hash dentro do tempo alvo. Os parâmetros encontrados são
+# escritos no arquivo de configurações e as senhas são atualizadas no próximo login.
+@main.command(name="tune-hashing")
+def tune_hashing_command(
+    target_ms: float = typer.Option(250.0, "--target-ms", help="Latency budget"),
+    memory: int = typer.Option(
+        settings.security.argon2.memory_cost,  # type: ignore
+        "--memory",
+        help="Maximum memory in KiB",
+    ),
+    parallelism: int = typer.Option(
+        settings.security.argon2.parallelism,  # type: ignore
+        "--parallelism",
+        help="Lanes used by each hash",
+    ),
+    output: str = typer.Option(
+        "settings.toml", "--output", help="Settings file to write"
+    ),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only show the parameters"),
+):
+    """Benchmark Argon2 on this host and write the tuned parameters"""
+    params = tune_hashing(
+        target_ms=target_ms, memory_cost=memory, parallelism=parallelism
+    )
+    elapsed = params.pop("elapsed_ms")
+
+    table = Table(title=f"Argon2 parameters ({elapsed} ms per hash)")
+    for header in params:
+        table.add_column(header, style="magenta")
+    table.add_row(*[str(value) for value in params.values()])
+    Console().print(table)
+
+    if dry_run:
+        return
+
+    # Mescla os parâmetros com as demais configurações de segurança já existentes.
+    loaders.write(
+        output,
+        {"security": {"dynaconf_merge": True, "argon2": params}},
+        env="default",
+        merge=True,
+    )
+    typer.echo(f"Parameters written to {output}.")
+
+
 # Comando CLI para resetar o banco de dados.
 @main.command()
 def reset_db(
@@ -219,3 +346,5 @@ def reset_db(
         # que 'SQLModel' venha do arquivo de db, onde todas as configurações do
         # banco de dados foram definidas.
         SQLModel.metadata.drop_all(engine)
+        # Os usuários armazenados no cache deixam de existir junto com as tabelas.
+        user_cache.clear()
@@ -35,6 +35,22 @@ settings = Dynaconf(
         # 'SECURITY' dentro dos arquivos de configuração ou nas variáveis de ambiente.
         # Ele também define que essa chave deve ser do tipo string e seu tamanho mínimo
         # deve ser de 64 caracteres.
-        Validator("SECURITY__SECRET_KEY", must_exist=True, is_type_of=str, len_min=64)
+        Validator("SECURITY__SECRET_KEY", must_exist=True, is_type_of=str, len_min=64),
+        # Validadores dos parâmetros do pool de conexões com o banco de dados.
+        Validator("DB__POOL__SIZE", is_type_of=int, gte=1),
+        Validator("DB__POOL__MAX_OVERFLOW", is_type_of=int, gte=-1),
+        Validator("DB__POOL__TIMEOUT", is_type_of=(int, float), gt=0),
+        Validator("DB__POOL__RECYCLE", is_type_of=int, gte=-1),
+        Validator("DB__POOL__PRE_PING", is_type_of=bool),
+        Validator("DB__POOL__LOG_WAIT_THRESHOLD", is_type_of=(int, float), gte=0),
+        # Validadores das réplicas de leitura.
+        Validator("DB__REPLICAS__URIS", is_type_of=list),
+        Validator("DB__REPLICAS__STICKY_SECONDS", is_type_of=(int, float), gte=0),
+        Validator("DB__REPLICAS__MAX_LAG", is_type_of=(int, float), gt=0),
+        Validator("DB__REPLICAS__CHECK_INTERVAL", is_type_of=(int, float), gt=0),
+        Validator("DB__REPLICAS__CONNECT_TIMEOUT", is_type_of=int, gte=1),
+        # Validadores das métricas do Prometheus.
+        Validator("METRICS__MULTIPROCESS_DIR", is_type_of=str),
+        Validator("METRICS__RQ_SAMPLE_SIZE", is_type_of=int, gte=1),
     ],
 )
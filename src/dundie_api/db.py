@@ -1,16 +1,176 @@
 """Database connection"""
 
+import logging
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+
 from sqlmodel import create_engine, Session, SQLModel  # noqa: F401
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from .config import settings
+from .metrics import db_pool_checked_out, db_pool_timeouts, db_pool_wait
+from .timing import request_metrics
 from fastapi import Depends
 
+logger = logging.getLogger(__name__)
+
+
+# Função que retorna o rótulo das métricas do pool, indicando se ele pertence a uma
+# engine síncrona ou assíncrona.
+def engine_label(dialect) -> str:
+    return "async" if getattr(dialect, "is_async", False) else "sync"
+
+
+# Classe base dos pools de conexões que mede o tempo de espera para obter uma conexão.
+# Quando uma conexão demora mais do que 'log_wait_threshold' segundos para ser obtida
+# ou o tempo limite é atingido, registra uma linha de log com o estado do pool.
+class TimedPoolMixin:
+    """Record how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_lock = Lock()
+        self.wait_stats = {
+            "waits": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "timeouts": 0,
+        }
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            connection = super()._do_get()  # type: ignore
+        except PoolTimeoutError:
+            with self.wait_lock:
+                self.wait_stats["timeouts"] += 1
+            db_pool_timeouts.labels(engine=engine_label(self._dialect)).inc()  # type: ignore
+            logger.warning("Database connection pool timeout: %s", pool_status(self))
+            raise
+        self._record_wait(perf_counter() - start)
+        return connection
+
+    def _record_wait(self, elapsed: float) -> None:
+        with self.wait_lock:
+            self.wait_stats["waits"] += 1
+            self.wait_stats["wait_total"] += elapsed
+            self.wait_stats["wait_max"] = max(self.wait_stats["wait_max"], elapsed)
+        db_pool_wait.labels(engine=engine_label(self._dialect)).observe(elapsed)  # type: ignore
+        if elapsed >= settings.db.pool.log_wait_threshold:  # type: ignore
+            logger.warning(
+                "Waited %.3fs for a database connection: %s",
+                elapsed,
+                pool_status(self),
+            )
+
+    # Necessário para que o pool recriado (por exemplo, após 'engine.dispose()') também
+    # seja um pool com medição do tempo de espera.
+    def recreate(self):
+        pool = super().recreate()  # type: ignore
+        pool.wait_lock, pool.wait_stats = self.wait_lock, self.wait_stats
+        return pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Função que retorna o estado atual de um pool de conexões: conexões em uso, ociosas,
+# excedentes e as estatísticas do tempo de espera para obter uma conexão.
+def pool_status(pool) -> dict:
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    status = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+    }
+    if isinstance(pool, TimedPoolMixin):
+        with pool.wait_lock:
+            stats = dict(pool.wait_stats)
+        stats["wait_avg"] = (
+            stats["wait_total"] / stats["waits"] if stats["waits"] else 0
+        )
+        status.update({key: round(value, 6) for key, value in stats.items()})
+    return status
+
+
+# Função que monta os argumentos do pool de conexões a partir das configurações
+# ('[default.db.pool]'). No SQLite em memória o pool padrão é mantido.
+def pool_options(uri: str, poolclass: type) -> dict:
+    pool = settings.db.pool  # type: ignore
+    if make_url(uri).database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": pool.size,
+        "max_overflow": pool.max_overflow,
+        "pool_timeout": pool.timeout,
+        "pool_recycle": pool.recycle,
+        "pool_pre_ping": pool.pre_ping,
+    }
+
+
+# Funções ligadas aos eventos da engine que medem o tempo de cada comando SQL. O tempo
+# é somado às métricas da requisição atual e os comandos mais lentos que o limite
+# 'instrumentation.slow_statement_threshold' são registrados no log com o nome da rota.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.dundie_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - context.dundie_start
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.statements += 1
+        metrics.add("db", elapsed)
+    if elapsed >= settings.instrumentation.slow_statement_threshold:  # type: ignore
+        logger.warning(
+            "Slow statement (%.3fs) in %s: %s",
+            elapsed,
+            metrics.route_name if metrics else "background",
+            " ".join(statement.split())[:500],
+        )
+
+
+# Função que liga a medição dos comandos SQL a uma engine síncrona, além de contar as
+# conexões em uso do seu pool nas métricas do Prometheus.
+def instrument(target: Engine) -> Engine:
+    event.listen(target, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target, "after_cursor_execute", _after_cursor_execute)
+    checked_out = db_pool_checked_out.labels(engine=engine_label(target.dialect))
+    event.listen(target, "checkout", lambda *args: checked_out.inc())
+    event.listen(target, "checkin", lambda *args: checked_out.dec())
+    return target
+
+
 # Criando o motor de conexão (engine) para se conectar ao banco de dados,
 # com as configurações sendo passadas do arquivo de config do Dynaconf.
-engine = create_engine(
-    settings.db.uri,  # type: ignore
-    echo=settings.db.echo,  # type: ignore
-    connect_args=settings.db.connect_args,  # type: ignore
-)
+# 'connect_args' são argumentos de conexão extras, somados aos das configurações.
+def build_engine(uri: str, connect_args: Optional[dict] = None) -> Engine:
+    return instrument(
+        create_engine(
+            uri,
+            echo=settings.db.echo,  # type: ignore
+            connect_args={**settings.db.connect_args, **(connect_args or {})},  # type: ignore
+            **pool_options(uri, TimedQueuePool),
+        )
+    )
+
+
+engine = build_engine(settings.db.uri)  # type: ignore
 
 
 # Criando uma função que vai agir como uma dependência da aplicação para
@@ -25,3 +185,56 @@ def get_session():
 # A função 'Depends' que é usada para declara uma dependência.
 # A dependência precisa ser callable, ou seja, capaz de ser chamada.
 ActiveSession = Depends(get_session)
+
+
+# Drivers assíncronos usados para cada banco de dados. O psycopg 3 é o mesmo driver
+# da engine síncrona, já o SQLite utiliza o aiosqlite.
+ASYNC_DRIVERS = {"postgresql": "postgresql+psycopg", "sqlite": "sqlite+aiosqlite"}
+
+
+# Função que converte a URI de conexão do banco de dados para o driver assíncrono.
+def async_uri(uri: str) -> str:
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(
+        hide_password=False
+    )
+
+
+# Criando o motor de conexão assíncrono, usado pelas rotas mais acessadas para que as
+# queries não bloqueiem o event loop. No SQLite cada sessão abre a sua própria conexão
+# ('NullPool'), pois as conexões do aiosqlite não são compartilhadas entre event loops.
+def build_async_engine(uri: str, connect_args: Optional[dict] = None) -> AsyncEngine:
+    sqlite = make_url(uri).get_backend_name() == "sqlite"
+    target = create_async_engine(
+        async_uri(uri),
+        echo=settings.db.echo,  # type: ignore
+        connect_args={**settings.db.connect_args, **(connect_args or {})},  # type: ignore
+        **(
+            {"poolclass": NullPool}
+            if sqlite
+            else pool_options(uri, TimedAsyncAdaptedQueuePool)
+        ),
+    )
+    instrument(target.sync_engine)
+    return target
+
+
+async_engine = build_async_engine(settings.db.uri)  # type: ignore
+
+
+# Função que retorna o estado dos pools de conexões das engines síncrona e assíncrona.
+def engines_status() -> dict:
+    engines: dict[str, Engine] = {"sync": engine, "async": async_engine.sync_engine}
+    return {name: pool_status(target.pool) for name, target in engines.items()}
+
+
+# Dependência que disponibiliza uma sessão assíncrona de conexão com o banco de dados.
+# 'expire_on_commit=False' evita que os objetos sejam recarregados (de forma síncrona)
+# ao serem acessados após o commit.
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+# Atribui a dependência assíncrona a uma variável para melhor uso nas rotas.
+AsyncActiveSession = Depends(get_async_session)
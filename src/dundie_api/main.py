@@ -1,11 +1,32 @@
+from contextlib import asynccontextmanager
+from time import perf_counter
 from fastapi import FastAPI, Request
 from dundie_api.routes import main_router
+from dundie_api.replicas import replica_router
+from dundie_api.config import settings
+from dundie_api.timing import RequestMetrics, request_metrics
+from dundie_api.metrics import (
+    http_request_duration,
+    http_requests_in_flight,
+    mark_worker_dead,
+    route_template,
+)
 from fastapi.middleware.cors import CORSMiddleware
 
+# Métodos HTTP que não alteram dados.
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Ciclo de vida de cada worker, ao ser encerrado as suas métricas deixam de ser somadas.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    mark_worker_dead()
+
 app = FastAPI(
     title="dundie-api",
     version="0.1.0",
     description="dundie-api is a API for Dundie Rewards CLI Project.",
+    lifespan=lifespan,
 )
 
 # Todos os middlewares aqui serão adicionados em todas as rotas da API.
@@ -28,6 +49,45 @@ async def add_new_header(request: Request, make_response):
     # continue. Obrigatório!
     return response
 
+# Middleware que registra as escritas realizadas por cada cliente, dessa forma, as
+# leituras dele são feitas no banco de dados primário durante a janela configurada em
+# 'db.replicas.sticky_seconds', garantindo que ele veja as suas próprias alterações.
+# A escrita é marcada em um cookie assinado, válido em todos os workers.
+@app.middleware("http")
+async def mark_client_writes(request: Request, make_response):
+    response = await make_response(request)
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        replica_router.mark_write(response)
+    return response
+
+# Middleware que instrumenta cada requisição, acumulando a quantidade de comandos SQL
+# e o tempo gasto no banco de dados, na autenticação e na serialização. Quando um
+# superusuário envia o header configurado em 'instrumentation.header', as métricas são
+# retornadas no header 'Server-Timing', exibido nas ferramentas de desenvolvedor.
+# A latência e as requisições em andamento também são registradas nas métricas do
+# Prometheus, rotuladas pelo modelo da rota executada.
+@app.middleware("http")
+async def instrument_request(request: Request, make_response):
+    metrics = RequestMetrics(request.scope)
+    token = request_metrics.set(metrics)
+    status_code = 500
+    start = perf_counter()
+    http_requests_in_flight.inc()
+    try:
+        response = await make_response(request)
+        status_code = response.status_code
+    finally:
+        request_metrics.reset(token)
+        http_requests_in_flight.dec()
+        http_request_duration.labels(
+            method=request.method,
+            route=route_template(request.scope),
+            status=status_code,
+        ).observe(perf_counter() - start)
+    if metrics.superuser and request.headers.get(settings.instrumentation.header):  # type: ignore
+        response.headers["Server-Timing"] = metrics.server_timing()
+    return response
+
 # Adicionando um middleware diretamente com a função
 app.add_middleware(
     # Adicionando a middleware do CORS para permitir que outras
@@ -0,0 +1,210 @@
+"""Prometheus metrics of the HTTP server, database, authentication and queue"""
+
+import logging
+import os
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from typing import Optional
+
+from dundie_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Com vários workers do uvicorn, cada processo grava os seus valores em arquivos
+# (mmap) no diretório 'metrics.multiprocess_dir', somados pelo worker que responde ao
+# '/metrics'. O diretório precisa ser definido antes de importar o 'prometheus_client'
+# e deve ser esvaziado antes de iniciar o servidor.
+if settings.metrics.multiprocess_dir:  # type: ignore
+    os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR",
+        settings.metrics.multiprocess_dir,  # type: ignore
+    )
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,  # noqa: F401
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+from prometheus_client.registry import Collector  # noqa: E402
+from redis.exceptions import RedisError  # noqa: E402
+
+# Diretório compartilhado entre os workers, None quando há apenas um processo.
+MULTIPROCESS_DIR: Optional[str] = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Rótulo usado nas requisições que não correspondem a nenhuma rota (por exemplo, 404),
+# evitando uma série para cada caminho inválido acessado.
+UNMATCHED_ROUTE = "unmatched"
+
+# As métricas das requisições são rotuladas pelo modelo da rota ('/user/{username}/'),
+# nunca pelo caminho acessado, para manter a quantidade de séries limitada.
+http_request_duration = Histogram(
+    "dundie_http_request_duration_seconds",
+    "HTTP request latency by method, route template and status code.",
+    ["method", "route", "status"],
+)
+# Os gauges usam o modo 'livesum', somando apenas os valores dos workers em execução.
+http_requests_in_flight = Gauge(
+    "dundie_http_requests_in_flight",
+    "HTTP requests currently being processed.",
+    multiprocess_mode="livesum",
+)
+
+db_pool_checked_out = Gauge(
+    "dundie_db_pool_checked_out_connections",
+    "Database connections currently checked out of the pools.",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+db_pool_wait = Histogram(
+    "dundie_db_pool_wait_seconds",
+    "Time spent waiting for a connection from the pool.",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+db_pool_timeouts = Counter(
+    "dundie_db_pool_timeouts",
+    "Checkouts that gave up waiting for a connection from the pool.",
+    ["engine"],
+)
+
+argon2_verify_duration = Histogram(
+    "dundie_argon2_verify_seconds",
+    "Time spent verifying a password against its Argon2 hash.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+jwt_failures = Counter(
+    "dundie_jwt_failures",
+    "Rejected JWT tokens by reason.",
+    ["reason"],
+)
+
+broadcast_subscribers = Gauge(
+    "dundie_broadcast_subscribers",
+    "Websocket and SSE clients subscribed to new transactions.",
+    multiprocess_mode="livesum",
+)
+
+
+# Função que retorna o modelo da rota executada na requisição, definido pelo router
+# no escopo da requisição.
+def route_template(scope: dict) -> str:
+    return getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+
+
+# Classe que coleta, no momento da leitura das métricas, o estado da fila do RQ. Os
+# valores ficam no Redis e são os mesmos para todos os workers, por isso não são
+# gravados nos arquivos de cada processo.
+class QueueCollector(Collector):
+    """Collect the RQ queue depth and the latency of recent jobs from Redis."""
+
+    def __init__(self, sample_size: int):
+        self.sample_size = sample_size
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        # A fila é importada apenas ao coletar as métricas, assim como no cache.
+        from dundie_api.queue import queue
+
+        up = GaugeMetricFamily("dundie_rq_up", "Whether Redis answered the scrape.")
+        try:
+            families = list(self._queue_metrics(queue))
+        except RedisError as error:
+            logger.warning("Unable to collect the RQ metrics: %s", error)
+            up.add_metric([], 0)
+            yield up
+            return
+        up.add_metric([], 1)
+        yield up
+        yield from families
+
+    def _queue_metrics(self, queue) -> Iterator[GaugeMetricFamily]:
+        depth = GaugeMetricFamily(
+            "dundie_rq_queue_depth", "Jobs waiting in the RQ queue.", labels=["queue"]
+        )
+        depth.add_metric([queue.name], queue.count)
+        yield depth
+
+        jobs = GaugeMetricFamily(
+            "dundie_rq_jobs", "RQ jobs by registry.", labels=["queue", "state"]
+        )
+        for state, registry in (
+            ("started", queue.started_job_registry),
+            ("finished", queue.finished_job_registry),
+            ("failed", queue.failed_job_registry),
+            ("deferred", queue.deferred_job_registry),
+            ("scheduled", queue.scheduled_job_registry),
+        ):
+            jobs.add_metric([queue.name, state], registry.count)
+        yield jobs
+
+        # Tempo desde que o job mais antigo da fila foi enfileirado.
+        oldest = GaugeMetricFamily(
+            "dundie_rq_oldest_job_age_seconds",
+            "Age of the oldest job waiting in the RQ queue.",
+            labels=["queue"],
+        )
+        job = next(iter(queue.get_jobs(0, 1)), None)
+        oldest.add_metric([queue.name], _elapsed(job.enqueued_at) if job else 0)
+        yield oldest
+
+        # Média do tempo de espera na fila e de execução dos últimos jobs concluídos.
+        latency = GaugeMetricFamily(
+            "dundie_rq_recent_job_latency_seconds",
+            "Mean wait and run time of the most recently finished RQ jobs.",
+            labels=["queue", "phase"],
+        )
+        registry = queue.finished_job_registry
+        job_ids = registry.get_job_ids(-self.sample_size, -1, cleanup=False)
+        wait, run = [], []
+        for job in queue.job_class.fetch_many(job_ids, connection=queue.connection):
+            if job is None or None in (job.enqueued_at, job.started_at, job.ended_at):
+                continue
+            wait.append((job.started_at - job.enqueued_at).total_seconds())
+            run.append((job.ended_at - job.started_at).total_seconds())
+        for phase, values in (("wait", wait), ("run", run)):
+            latency.add_metric(
+                [queue.name, phase], sum(values) / len(values) if values else 0
+            )
+        yield latency
+
+
+# Função que retorna os segundos decorridos desde um horário registrado pelo RQ.
+def _elapsed(moment: Optional[datetime]) -> float:
+    if moment is None:
+        return 0
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return max((datetime.now(UTC) - moment).total_seconds(), 0)
+
+
+# Registro separado para as métricas da fila, combinado com as métricas dos processos.
+queue_registry = CollectorRegistry()
+queue_registry.register(
+    QueueCollector(sample_size=settings.metrics.rq_sample_size)  # type: ignore
+)
+
+
+# Função que gera as métricas no formato de texto do Prometheus. Com vários workers, os
+# arquivos de todos os processos são somados, caso contrário é usado o registro padrão.
+def render() -> bytes:
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry)
+    if settings.metrics.rq:  # type: ignore
+        output += generate_latest(queue_registry)
+    return output
+
+
+# Função chamada ao encerrar o worker, remove os seus gauges 'livesum' do diretório
+# compartilhado, para que não sejam somados após o fim do processo.
+def mark_worker_dead() -> None:
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(os.getpid(), MULTIPROCESS_DIR)
@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
 from typing import TYPE_CHECKING, Optional
 
-from sqlmodel import Field, Relationship, SQLModel, Column, DateTime
+from sqlmodel import Field, Relationship, SQLModel, Column, DateTime, Index
 
 # Realiza o import apenas no momento de verificação dos tipos e não em execução para
 # evitar circular import.
@@ -13,6 +13,16 @@ if TYPE_CHECKING:
 class Transaction(SQLModel, table=True):
     """Represent the Transaction Model"""
 
+    # Índices compostos usados pelos filtros de listagem por quem recebeu ('user_id')
+    # ou enviou ('from_id') os pontos, já ordenados por data e id, e pelas ordenações
+    # por data e por valor. São criados nas migrations 'c3f1a2b4d5e6' e 'd7e8f9a0b1c2'.
+    __table_args__ = (
+        Index("ix_transaction_user_id_date_id", "user_id", "date", "id"),
+        Index("ix_transaction_from_id_date_id", "from_id", "date", "id"),
+        Index("ix_transaction_date_id", "date", "id"),
+        Index("ix_transaction_value_id", "value", "id"),
+    )
+
     # Campo identificador da transação.
     id: Optional[int] = Field(default=None, primary_key=True)
     # Campo identificador do usuário que está recebendo os pontos.
@@ -74,3 +84,34 @@ class Balance(SQLModel, table=True):
 
     # Campo para declarar a relação entre as tabelas 'User' e 'Balance', popula o campo '_balance' na tabela do usuário.
     user: Optional["User"] = Relationship(back_populates="_balance")
+
+
+# Classe que representa a tabela 'user_stats' no banco de dados, um resumo das
+# transações de cada usuário mantido junto com o saldo a cada nova transação.
+class UserStats(SQLModel, table=True):
+    """Store the transaction summary of a user account"""
+
+    __tablename__ = "user_stats"  # type: ignore
+
+    # Campo que define o identificador dessa tabela, que também representa qual o usuário.
+    user_id: int = Field(foreign_key="user.id", nullable=False, primary_key=True)
+    # Quantidade de transações recebidas e a soma dos pontos recebidos.
+    received_count: int = Field(default=0, nullable=False)
+    received_total: int = Field(default=0, nullable=False)
+    # Quantidade de transações enviadas e a soma dos pontos enviados.
+    sent_count: int = Field(default=0, nullable=False)
+    sent_total: int = Field(default=0, nullable=False)
+
+    # Data e hora da primeira e da última transação do usuário, recebida ou enviada.
+    first_transaction_at: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    last_transaction_at: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+
+    # Campo que armazena o tempo em que o resumo foi modificado pela última vez.
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
@@ -0,0 +1,50 @@
+"""Cursor (keyset) pagination"""
+
+# Bibliotecas para codificar o cursor em um texto opaco.
+import base64
+import json
+
+from typing import Any, Generic, Optional, TypeVar
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+# Modelo de resposta de uma página paginada por cursor. Diferente da 'Page' do
+# fastapi-pagination, não possui o total de registros, evitando o 'COUNT(*)'.
+class CursorPage(BaseModel, Generic[T]):
+    """A page of items and the cursor to fetch the next one."""
+
+    # Registros da página atual.
+    items: list[T]
+    # Quantidade máxima de registros por página.
+    size: int
+    # Cursor para buscar a próxima página, None quando não houver mais registros.
+    next_cursor: Optional[str] = None
+
+
+# Função para gerar um cursor opaco a partir da ordenação usada e dos valores do
+# último registro da página, usados para buscar os registros seguintes.
+def encode_cursor(order: str, values: list[Any]) -> str:
+    """Encode the sort key and the last row values into an opaque token."""
+    # Datas são convertidas para texto no formato ISO 8601 com 'default=str'.
+    payload = json.dumps({"o": order, "v": values}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+# Função para ler um cursor, validando se ele foi gerado para a mesma ordenação.
+# Caso o cursor seja inválido, invoca uma exceção HTTP do tipo 400.
+def decode_cursor(cursor: str, order: str) -> list[Any]:
+    """Decode a token created by encode_cursor for the same sort key."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if payload["o"] == order and isinstance(payload["v"], list):
+            return payload["v"]
+    except (ValueError, TypeError, KeyError):
+        pass
+
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor."
+    )
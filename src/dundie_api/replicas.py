@@ -0,0 +1,232 @@
+"""Read replica routing"""
+
+import hmac
+import logging
+from hashlib import sha256
+from itertools import count
+from math import ceil
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Optional
+
+from fastapi import Depends, Request, Response
+from sqlalchemy import text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from dundie_api.config import settings
+from dundie_api.db import async_engine, build_async_engine, build_engine, engine
+
+logger = logging.getLogger(__name__)
+
+# Cookie que marca até quando as leituras do cliente vão para o primário após uma
+# escrita (read-your-writes).
+WRITE_COOKIE = "dundie_last_write"
+
+# Query que retorna o atraso, em segundos, de uma réplica do PostgreSQL em relação ao
+# primário. Caso o banco não seja uma réplica, o atraso é zero. Quando a réplica já
+# aplicou todo o WAL recebido ela está em dia, mesmo que a última transação aplicada
+# seja antiga (primário sem escritas), por isso o atraso também é zero.
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE("
+    "EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+# Classe que representa uma réplica de leitura, com as suas engines síncrona e
+# assíncrona e o resultado da última verificação de saúde.
+class Replica:
+    """A read replica and its last health check."""
+
+    def __init__(self, engine: Engine, async_engine: AsyncEngine):
+        self.engine = engine
+        self.async_engine = async_engine
+        # A réplica só é usada após a primeira verificação de saúde.
+        self.healthy = False
+        self.lag = 0.0
+        self.checked_at: Optional[float] = None
+
+    # Verifica se a réplica está acessível e se o seu atraso está dentro do limite.
+    def check(self, max_lag: float) -> bool:
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = float(connection.execute(LAG_QUERY).scalar() or 0)
+                else:
+                    connection.execute(text("SELECT 1"))
+            self.healthy = self.lag <= max_lag
+        except Exception as error:
+            logger.warning("Read replica %s is unavailable: %s", self.engine.url, error)
+            self.healthy = False
+        if not self.healthy:
+            logger.warning(
+                "Read replica %s is unhealthy (lag %.1fs)", self.engine.url, self.lag
+            )
+        self.checked_at = monotonic()
+        return self.healthy
+
+
+# Classe que escolhe a engine usada pelas rotas de leitura. As réplicas são usadas em
+# rodízio (round-robin), as que estiverem fora do ar ou atrasadas são ignoradas até a
+# próxima verificação e, sem nenhuma réplica saudável, as leituras vão para o primário.
+# As verificações são feitas por uma thread em segundo plano a cada 'check_interval',
+# dessa forma uma réplica inacessível nunca bloqueia as requisições.
+# Após uma escrita, o cliente lê do primário por 'sticky_seconds' segundos, garantindo
+# que ele veja as suas próprias alterações (read-your-writes). A marca da escrita fica
+# com o cliente, em um cookie assinado, dessa forma ela vale em todos os workers e
+# continua valendo após o token ser renovado.
+class ReplicaRouter:
+    """Round-robin read routing with health checks and read-your-writes."""
+
+    def __init__(
+        self,
+        replicas: list[Replica],
+        sticky_seconds: float,
+        max_lag: float,
+        check_interval: float,
+    ):
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._counter = count()
+        self._lock = Lock()
+        self._checker: Optional[Thread] = None
+        self._stopped = Event()
+
+    # Retorna a marca de uma escrita realizada agora: o horário até o qual as leituras
+    # vão para o primário e a sua assinatura, impedindo que o cliente a altere.
+    def write_marker(self) -> str:
+        until = f"{time() + self.sticky_seconds:.3f}"
+        return f"{until}.{_sign(until)}"
+
+    # Registra na resposta, no cookie de escrita, que o cliente realizou uma escrita.
+    def mark_write(self, response: Response) -> None:
+        if not self.replicas:
+            return
+        response.set_cookie(
+            WRITE_COOKIE,
+            self.write_marker(),
+            max_age=ceil(self.sticky_seconds),
+            httponly=True,
+            samesite="lax",
+        )
+
+    # Verifica se a marca de escrita enviada pelo cliente é válida e ainda não expirou.
+    def is_sticky(self, marker: Optional[str]) -> bool:
+        if not marker:
+            return False
+        until, _, signature = marker.rpartition(".")
+        if not hmac.compare_digest(signature, _sign(until)):
+            return False
+        try:
+            return float(until) > time()
+        except ValueError:
+            return False
+
+    # Verifica a saúde e o atraso de todas as réplicas.
+    def check_replicas(self) -> None:
+        for replica in self.replicas:
+            replica.check(self.max_lag)
+
+    # Inicia a thread que verifica as réplicas em segundo plano, apenas uma vez.
+    def start(self) -> None:
+        with self._lock:
+            if self._checker is not None or not self.replicas:
+                return
+            self._checker = Thread(
+                target=self._check_forever, name="dundie-replica-check", daemon=True
+            )
+            self._checker.start()
+
+    # Para a thread de verificação das réplicas.
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _check_forever(self) -> None:
+        while not self._stopped.is_set():
+            self.check_replicas()
+            self._stopped.wait(self.check_interval)
+
+    # Retorna a próxima réplica saudável, ou None caso as leituras devam ir para o
+    # primário. Usa o resultado da última verificação, sem acessar o banco de dados.
+    # 'marker' é a marca de escrita enviada pelo cliente.
+    def pick(self, marker: Optional[str] = None) -> Optional[Replica]:
+        if not self.replicas or self.is_sticky(marker):
+            return None
+        self.start()
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.healthy:
+                return replica
+        return None
+
+    # Engine síncrona usada para uma leitura.
+    def read_engine(self, marker: Optional[str] = None) -> Engine:
+        replica = self.pick(marker)
+        return replica.engine if replica else engine
+
+    # Engine assíncrona usada para uma leitura.
+    def read_async_engine(self, marker: Optional[str] = None) -> AsyncEngine:
+        replica = self.pick(marker)
+        return replica.async_engine if replica else async_engine
+
+
+# Função que assina a marca de escrita com a chave secreta da aplicação.
+def _sign(value: str) -> str:
+    key = settings.security.secret_key.encode()  # type: ignore
+    return hmac.new(key, value.encode(), sha256).hexdigest()
+
+
+# Função que cria as engines das réplicas configuradas em '[default.db.replicas]',
+# com as mesmas configurações de pool do primário. No PostgreSQL, a conexão com uma
+# réplica inacessível desiste após 'connect_timeout' segundos.
+def create_replicas(uris: list[str]) -> list[Replica]:
+    connect_timeout = settings.db.replicas.connect_timeout  # type: ignore
+    replicas = []
+    for uri in uris:
+        connect_args = {}
+        if make_url(uri).get_backend_name() == "postgresql":
+            connect_args = {"connect_timeout": connect_timeout}
+        replicas.append(
+            Replica(
+                build_engine(uri, connect_args),
+                build_async_engine(uri, connect_args),
+            )
+        )
+    return replicas
+
+
+# Instância única do roteador de leituras, sem réplicas configuradas todas as leituras
+# continuam indo para o primário.
+replica_router = ReplicaRouter(
+    replicas=create_replicas(settings.db.replicas.uris),  # type: ignore
+    sticky_seconds=settings.db.replicas.sticky_seconds,  # type: ignore
+    max_lag=settings.db.replicas.max_lag,  # type: ignore
+    check_interval=settings.db.replicas.check_interval,  # type: ignore
+)
+
+
+# Dependência que disponibiliza uma sessão de leitura, conectada a uma réplica ou ao
+# primário. Deve ser usada apenas em rotas que não realizam escritas.
+def get_read_session(request: Request):
+    marker = request.cookies.get(WRITE_COOKIE)
+    with Session(replica_router.read_engine(marker)) as session:
+        yield session
+
+
+# Versão assíncrona da dependência de sessão de leitura.
+async def get_async_read_session(request: Request):
+    target = replica_router.read_async_engine(request.cookies.get(WRITE_COOKIE))
+    async with AsyncSession(target, expire_on_commit=False) as session:
+        yield session
+
+
+# Atribui as dependências de leitura a variáveis para melhor uso nas rotas.
+ReadActiveSession = Depends(get_read_session)
+AsyncReadActiveSession = Depends(get_async_read_session)
@@ -1,7 +1,10 @@
 from fastapi import APIRouter
+from dundie_api.config import settings
 from dundie_api.routes.user import router as user_router
 from dundie_api.routes.auth import router as auth_router
 from dundie_api.routes.transaction import router as transaction_router
+from dundie_api.routes.admin import router as admin_router
+from dundie_api.routes.metrics import router as metrics_router
 
 # Criando um main router para incluir todas os conjuntos de subrotas
 # criados.
@@ -19,3 +22,10 @@ main_router.include_router(
 
 # Incluindo as rotas de autenticação de usuários.
 main_router.include_router(auth_router, tags=["auth"])
+
+# Incluindo as rotas de administração com o prefixo '/admin'.
+main_router.include_router(admin_router, prefix="/admin", tags=["admin"])
+
+# Incluindo a rota das métricas do Prometheus, quando habilitada nas configurações.
+if settings.metrics.enabled:  # type: ignore
+    main_router.include_router(metrics_router)
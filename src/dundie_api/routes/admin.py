@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+
+from dundie_api.auth import SuperUser
+from dundie_api.db import engines_status
+from dundie_api.timing import InstrumentedRoute
+
+# Criando um conjunto de rotas individuais, neste caso, elas são responsáveis
+# pelas rotas de administração e monitoramento da API.
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+# Rota para exibir o estado dos pools de conexões com o banco de dados deste worker:
+# conexões em uso, ociosas, excedentes e o tempo de espera para obter uma conexão.
+# Apenas superusuários podem acessá-la.
+@router.get("/pool", dependencies=[SuperUser])
+async def get_pool_status():
+    """Return the database connection pool statistics of this worker."""
+    return engines_status()
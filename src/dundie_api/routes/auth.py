@@ -10,16 +10,20 @@ from dundie_api.auth import (
     create_access_token,
     create_refresh_token,
     get_user,
+    get_user_identity,
+    token_claims,
     validate_token,
 )
+from dundie_api.cache import password_version
 from dundie_api.config import settings
+from dundie_api.timing import InstrumentedRoute
 
 # Tempo de expiração do token, adquiridos das configurações.
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.security.access_token_expire_minutes  # type: ignore
 REFRESH_TOKEN_EXPIRE_MINUTES = settings.security.refresh_token_expire_minutes  # type: ignore
 
 # Criando um router para incluir as rotas de autenticação.
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 
 # View que o usuário chama para adquirir um novo token.
@@ -32,7 +36,7 @@ router = APIRouter()
 # 'Depends' indica que 'form_data' é uma dependência dessa rota.
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # Autentica o usuário passando o seu 'username' e senha.
-    user = authenticate_user(get_user, form_data.username, form_data.password)
+    user = await authenticate_user(get_user, form_data.username, form_data.password)
 
     # Se o usuário não for válido ou não for uma instância de 'User' exibe um erro
     # do tipo 401 (Não autorizado), informando que as credenciais estão incorretas.
@@ -43,19 +47,22 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Os tokens carregam a versão da senha atual do usuário.
+    claims = token_claims(user.username, password_version(user.password))
+
     # Define o tempo de expiração do token usando uma representação de tempo.
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)  # type: ignore
     # Cria o access token com o 'username' do usuário e 'fresh=True' indicando que é um token novo.
     # Também define o tempo de expiração do token de acesso.
     access_token = create_access_token(
-        data={"sub": user.username, "fresh": True}, expires_delta=access_token_expires
+        data={**claims, "fresh": True}, expires_delta=access_token_expires
     )
 
     # Mesmo procedimento anterior, a diferença é que esse token é o refresh token. Nesse token
     # não vai a informação 'fresh'.
     refresh_token_expires = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)  # type: ignore
     refresh_token = create_refresh_token(
-        data={"sub": user.username}, expires_delta=refresh_token_expires
+        data=claims, expires_delta=refresh_token_expires
     )
 
     # Retorna os tokens gerados e qual o tipo dos tokens.
@@ -76,18 +83,23 @@ async def refresh_token(form_data: RefreshToken):
     # do código.
     user = await validate_token(token=form_data.refresh_token)
 
+    # O refresh token já foi validado com a versão da senha atual, que é mantida nos
+    # novos tokens.
+    identity = await get_user_identity(user.username)
+    claims = token_claims(user.username, identity.password_version)  # type: ignore
+
     # Cria um novo token de acesso com as mesmas informações, porém dessa vez 'fresh' é
     # False, indicando que não é um token novo mais, mas sim um renovado.
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)  # type: ignore
     access_token = create_access_token(
-        data={"sub": user.username, "fresh": False},
+        data={**claims, "fresh": False},
         expires_delta=access_token_expires,
     )
 
     # Cria e atualiza o refresh token também
     refresh_token_expires = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)  # type: ignore
     refresh_token = create_refresh_token(
-        data={"sub": user.username}, expires_delta=refresh_token_expires
+        data=claims, expires_delta=refresh_token_expires
     )
 
     # Retorna os novos tokens criados.
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Response
+
+from dundie_api.metrics import CONTENT_TYPE_LATEST, render
+from dundie_api.timing import InstrumentedRoute
+
+# Criando um conjunto de rotas individuais, neste caso, ela é responsável por expor as
+# métricas da API para o Prometheus.
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+# Rota lida pelo Prometheus, com as métricas de todos os workers. Não exige autenticação,
+# por isso deve ser acessível apenas pela rede interna (bloqueada no proxy reverso).
+# É síncrona, pois lê os arquivos das métricas e o Redis sem bloquear o event loop.
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Return the metrics in the Prometheus text format."""
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
@@ -1,18 +1,99 @@
-from asyncio import sleep
-from fastapi import APIRouter, Body, HTTPException, Depends, WebSocket
-from dundie_api.auth import AuthenticatedUser
-from dundie_api.db import ActiveSession
+from asyncio import (
+    FIRST_COMPLETED,
+    Future,
+    create_task,
+    gather,
+    shield,
+    to_thread,
+    wait,
+    wait_for,
+)
+from collections.abc import AsyncIterator, Iterator
+from datetime import datetime
+from typing import Annotated, Literal, Optional
+from fastapi import (
+    APIRouter,
+    Body,
+    HTTPException,
+    Depends,
+    Header,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from dundie_api.auth import AuthenticatedUser, get_current_user
+from dundie_api.broadcast import (
+    TransactionFilter,
+    fetch_transactions,
+    hub,
+    stream_transactions,
+)
+from dundie_api.config import settings
+from dundie_api.db import AsyncActiveSession, engine
+from dundie_api.replicas import AsyncReadActiveSession
 from dundie_api.models import User
-from dundie_api.serializers.transaction import TransactionResponse
-from dundie_api.tasks.transaction import add_transaction, TransactionError, Transaction
-from sqlmodel import select, Session, text
+from dundie_api.pagination import CursorPage, decode_cursor, encode_cursor
+from dundie_api.serializers.transaction import (
+    TransactionBulkRequest,
+    TransactionBulkResponse,
+    TransactionChangesResponse,
+    TransactionResponse,
+)
+from dundie_api.tasks.transaction import (
+    add_transaction,
+    add_transactions,
+    TransactionError,
+    Transaction,
+)
+from dundie_api.timing import InstrumentedRoute
+from sqlmodel import select, Session, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from sqlalchemy.orm import aliased
+from pydantic import Field
 
-from fastapi_pagination.ext.sqlmodel import paginate
+from fastapi_pagination.ext.sqlmodel import apaginate
 from fastapi_pagination import Page, Params
+from fastapi.responses import StreamingResponse
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+# Rota para realizar várias transações de uma só vez. Ela precisa ser declarada antes
+# da rota '/{username}', caso contrário 'bulk' seria interpretado como um username.
+@router.post("/bulk", response_model=TransactionBulkResponse, status_code=201)
+# 'payload' contém a lista de transferências e o modo do lote.
+# 'current_user' é o usuário logado e também representa o usuário que vai enviar os pontos.
+async def create_transactions(
+    *,
+    payload: TransactionBulkRequest,
+    current_user: User = AuthenticatedUser,
+):
+    """Add many transactions from the authenticated user at once."""
+
+    # Realiza todas as transferências do lote em um único commit. Assim como na
+    # transferência individual, é executada em outra thread, com a sua própria sessão,
+    # para que a espera pelos locks e as novas tentativas não bloqueiem o event loop.
+    results = await to_thread(
+        _add_transactions,
+        [(item.username, item.value) for item in payload.items],
+        current_user,
+        payload.mode == "atomic",
+    )
+
+    response = TransactionBulkResponse(
+        mode=payload.mode,
+        added=sum(result["status"] == "added" for result in results),
+        failed=sum(result["status"] == "failed" for result in results),
+        results=results,  # type: ignore
+    )
+
+    # No modo tudo ou nada, caso algum item tenha falhado, nenhuma transação foi
+    # salva e o resultado de cada item é retornado junto do erro.
+    if payload.mode == "atomic" and response.failed:
+        raise HTTPException(status_code=400, detail=response.model_dump())
+
+    return response
 
 
 # Rota para realizar uma transação.
@@ -27,19 +108,22 @@ async def create_transaction(
     username: str,
     value: int = Body(embed=True),
     current_user: User = AuthenticatedUser,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
 ):
     """Add a new transaction to the specified user."""
 
     # Seleciona o usuário a receber os pontos do banco de dados.
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = (await session.exec(select(User).where(User.username == username))).first()
     # Caso o usuário não existir, emite uma exceção HTTP indicando que ele não foi encontrado.
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
 
     # Tenta criar uma transação de transferência de pontos.
+    # A transferência é síncrona e, em caso de conflito, espera com 'time.sleep' antes
+    # de uma nova tentativa. Por isso é executada em outra thread, com a sua própria
+    # sessão síncrona, sem bloquear o event loop durante as queries e as esperas.
     try:
-        add_transaction(user=user, from_user=current_user, value=value, session=session)
+        await to_thread(_add_transaction, user, current_user, value)
 
     # Caso ocorra algum erro, ele é interceptado e a mensagem de erro é exibida.
     except TransactionError as e:
@@ -49,54 +133,64 @@ async def create_transaction(
     return {"message": "Transaction added"}
 
 
-# Rota para listar as transações dos usuários, esta rota contém paginação com 'Page' e o
-# modelo de resposta 'TransactionResponse'. Ela também contém filtros e ordenação pela data
-# da transação.
-@router.get("/", response_model=Page[TransactionResponse])
+# Função executada em outra thread pela rota de criação de transações.
+def _add_transaction(user: User, from_user: User, value: int) -> None:
+    with Session(engine) as session:
+        add_transaction(user=user, from_user=from_user, value=value, session=session)
+
+
+# Função executada em outra thread pela rota de transferências em lote.
+def _add_transactions(
+    items: list[tuple[str, int]], from_user: User, atomic: bool
+) -> list[dict]:
+    with Session(engine) as session:
+        return add_transactions(
+            items=items, from_user=from_user, session=session, atomic=atomic
+        )
+
+
+# Função que monta a query base de listagem das transações, aplicando os filtros e a
+# regra de visibilidade. É compartilhada entre os modos de paginação.
 # 'current_user' indica o usuário autenticado.
-# 'session' é a sessão de conexão com o banco de dados.
-# 'params' são os parâmetros da funcionalidade de paginação, como o número da página e
-# o limite de registros por página.
 # 'user' é o filtro opcional para exibir as transações que o usuário recebeu pontos.
 # 'from_user' é o filtro opcional para exibir as transações que o usuário enviou pontos.
-# 'order_by' é o campo de ordenação pela data, podendo ser ascendente e decrescente.
-async def list_transactions(
-    *,
-    current_user: User = AuthenticatedUser,
-    session: Session = ActiveSession,
-    params: Params = Depends(),
-    user: str | None = None,
-    from_user: str | None = None,
-    order_by: str | None = None,
+def _transactions_query(
+    current_user: User, user: str | None = None, from_user: str | None = None
 ):
-    """List all transactions."""
+    """Build the filtered transactions query visible to current_user.
+
+    The usernames of both users are selected in the same statement, so
+    the rows can be serialized without lazy loading the relationships.
+    """
 
-    # Query base, seleciona todas as transações.
-    query = select(Transaction)
+    # Cria dois aliases para o model User, um para o usuário que recebeu os pontos e
+    # outro para o usuário que enviou, permitindo dois JOINs com a mesma tabela. O
+    # SQLAlchemy entende cada alias como uma tabela diferente na query.
+    ToUser, FromUser = aliased(User), aliased(User)
+
+    # Query base, seleciona apenas os campos da resposta de todas as transações, já
+    # incluindo o 'username' de quem recebeu e de quem enviou os pontos.
+    query = (
+        select(
+            Transaction.id,
+            Transaction.value,
+            Transaction.date,
+            ToUser.username.label("user"),  # type: ignore
+            FromUser.username.label("from_user"),  # type: ignore
+        )
+        .join(ToUser, Transaction.user_id == ToUser.id)  # type: ignore
+        .join(FromUser, Transaction.from_id == FromUser.id)  # type: ignore
+    )
 
     # Caso o filtro 'user' estiver definido, exibe todas as transações que o usuário
     # em questão recebeu pontos.
     if user:
-        # Adiciona na query a cláusula JOIN, buscando as transações que o usuário foi
-        # o usuário que recebeu os pontos.
-        query = query.join(User, Transaction.user_id == User.id).where(
-            User.username == user
-        )
+        query = query.where(ToUser.username == user)
 
     # Caso o filtro 'from_user' estiver definido, exibe todas as transações em que o
     # usuário em questão enviou pontos.
     if from_user:
-        # Cria um alias para o model User, permitindo adicionar mais um JOIN, caso ambos
-        # os filtros 'user' e 'from_user' estejam definidos, caso contrário vai gerar um
-        # erro. O alias 'FromUser' aponta também para a tabela 'User' mas permite que o
-        # SQLAlchemy faça as operações de forma correta e entenda o que está sendo pedido.
-        FromUser = aliased(User)
-
-        # Adiciona na query a cláusula JOIN, buscando as transações que o usuário foi
-        # o usuário que enviou os pontos.
-        query = query.join(FromUser, Transaction.from_id == FromUser.id).where(
-            FromUser.username == from_user
-        )
+        query = query.where(FromUser.username == from_user)
 
     # Cláusula de guarda onde permite que usuários que não são super usuários vejam apenas as
     # suas próprias transações, sendo elas de entrada ou saída.
@@ -108,59 +202,446 @@ async def list_transactions(
             | (Transaction.from_id == current_user.id)
         )
 
-    # Caso o campo de ordenação esteja definido, realiza a ordenação decrescente ou crescente usando
-    # o campo 'date' da tabela. Quando especificado '-date' realiza a ordenação decrescente.
-    if order_by:
-        # Utiliza a função 'text' para construir um texto que vai representar uma parte ou então uma
-        # query SQL completa. Neste caso, se tiver o sinal '-', a ordenação vai ser decrescente, caso
-        # contrário, crescente.
-        order_text = text(
-            order_by.replace("-", "") + " " + ("desc" if "-" in order_by else "asc")
+    return query
+
+
+# Chaves de ordenação aceitas no parâmetro 'order_by' e as colunas correspondentes.
+# O 'id' é sempre usado como desempate, garantindo uma ordenação estável, e cada
+# combinação de colunas possui um índice, evitando ordenar a tabela inteira.
+# Com o prefixo '-' a ordenação é decrescente.
+TRANSACTION_ORDERING = {
+    "id": (Transaction.id,),
+    "date": (Transaction.date, Transaction.id),
+    "value": (Transaction.value, Transaction.id),
+}
+
+
+# Função que valida a chave de ordenação e retorna as colunas e a direção dela.
+# Caso a chave não seja permitida, invoca uma exceção HTTP do tipo 400.
+def _ordering(order_by: str | None) -> tuple[str, tuple, bool]:
+    """Return the sort key, its columns and whether it is descending."""
+    order = order_by or "id"
+    columns = TRANSACTION_ORDERING.get(order.removeprefix("-"))
+    if columns is None:
+        allowed = ", ".join(f"{key}, -{key}" for key in TRANSACTION_ORDERING)
+        raise HTTPException(
+            status_code=400, detail=f"Invalid order_by, use one of: {allowed}."
+        )
+    return order, columns, order.startswith("-")
+
+
+# Função que valida os valores de um cursor para as colunas de ordenação. A data,
+# armazenada como texto no cursor, é convertida de volta para 'datetime' e as demais
+# colunas (id e valor) devem ser inteiros. Caso contrário, invoca uma exceção HTTP 400.
+def _cursor_values(values: list, columns: tuple) -> list:
+    if len(values) != len(columns):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    parsed = []
+    for column, value in zip(columns, values):
+        if column is Transaction.date:
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor.")
+        elif type(value) is not int:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        parsed.append(value)
+    return parsed
+
+
+# Função para paginar as transações por cursor (keyset). Em vez de pular 'offset'
+# registros e contar o total, busca diretamente os registros após o último registro
+# da página anterior, usando o índice das colunas de ordenação.
+async def _paginate_by_cursor(
+    session: AsyncSession, query, size: int, order_by: str | None, cursor: str | None
+) -> CursorPage[TransactionResponse]:
+    """Return one keyset page of query ordered by one of TRANSACTION_ORDERING."""
+
+    order, columns, descending = _ordering(order_by)
+
+    # Caso um cursor tenha sido informado, busca apenas os registros após ele.
+    if cursor:
+        values = _cursor_values(decode_cursor(cursor, order), columns)
+        key, last = tuple_(*columns), tuple_(*values)
+        query = query.where(key < last if descending else key > last)
+
+    # Busca um registro a mais do que o tamanho da página para saber se existe uma
+    # próxima página, sem precisar contar o total.
+    query = query.order_by(
+        *[column.desc() if descending else column.asc() for column in columns]
+    )
+    transactions = (await session.exec(query.limit(size + 1))).all()
+
+    next_cursor = None
+    if len(transactions) > size:
+        transactions = transactions[:size]
+        last_row = transactions[-1]
+        next_cursor = encode_cursor(
+            order, [getattr(last_row, column.key) for column in columns]
         )
-        # Compõe a query base com o SQL para realizar a ordenação.
-        query = query.order_by(order_text)
+
+    return CursorPage[TransactionResponse](
+        items=[
+            TransactionResponse.model_validate(row, from_attributes=True)
+            for row in transactions
+        ],
+        size=size,
+        next_cursor=next_cursor,
+    )
+
+
+# Rota para listar as transações dos usuários, esta rota contém paginação com 'Page' e o
+# modelo de resposta 'TransactionResponse'. Ela também contém filtros e ordenação pela data
+# da transação.
+# Com 'pagination=cursor' a paginação é feita por cursor, retornando 'CursorPage'.
+# 'left_to_right' garante que a 'Page' seja validada primeiro, pois a 'CursorPage'
+# também aceitaria os campos de uma 'Page'.
+@router.get(
+    "/",
+    response_model=Annotated[
+        Page[TransactionResponse] | CursorPage[TransactionResponse],
+        Field(union_mode="left_to_right"),
+    ],
+)
+# 'current_user' indica o usuário autenticado.
+# 'session' é a sessão de conexão com o banco de dados.
+# 'params' são os parâmetros da funcionalidade de paginação, como o número da página e
+# o limite de registros por página.
+# 'user' é o filtro opcional para exibir as transações que o usuário recebeu pontos.
+# 'from_user' é o filtro opcional para exibir as transações que o usuário enviou pontos.
+# 'order_by' é a chave de ordenação (date, value ou id), podendo ser ascendente ou
+# decrescente com o prefixo '-'.
+# 'pagination' define o modo de paginação, por página ('page') ou por cursor ('cursor').
+# 'cursor' é o cursor da próxima página retornado no modo de paginação por cursor.
+async def list_transactions(
+    *,
+    current_user: User = AuthenticatedUser,
+    session: AsyncSession = AsyncReadActiveSession,
+    params: Params = Depends(),
+    user: str | None = None,
+    from_user: str | None = None,
+    order_by: str | None = None,
+    pagination: Literal["page", "cursor"] = "page",
+    cursor: str | None = None,
+):
+    """List all transactions."""
+
+    # Query base com os filtros e a regra de visibilidade aplicados.
+    query = _transactions_query(current_user, user, from_user)
+
+    # Paginação por cursor, usada quando solicitada ou quando um cursor é informado.
+    if pagination == "cursor" or cursor:
+        return await _paginate_by_cursor(session, query, params.size, order_by, cursor)
+
+    # Realiza a ordenação crescente ou decrescente pelas colunas da chave de ordenação.
+    # Quando não especificada, ordena pelo 'id', garantindo páginas estáveis.
+    _, columns, descending = _ordering(order_by)
+    query = query.order_by(
+        *[column.desc() if descending else column.asc() for column in columns]
+    )
 
     # Retorna todas as transações de forma paginada. Para isso é preciso passar a sessão de conexão com
     # o banco de dados, a query de seleção e os parâmetros (nº de páginas e nº de registros por página).
-    return paginate(session=session, query=query, params=params)
+    return await apaginate(session, query, params=params)
+
+
+# Função que monta a mensagem enviada ao cliente do websocket para cada transação.
+def _ws_message(transaction: dict) -> dict:
+    return {
+        "to": transaction["to"],
+        "from": transaction["from"],
+        "value": transaction["value"],
+    }
+
+
+# Função que monta os filtros de uma inscrição do hub (websocket ou SSE).
+# Usuários comuns recebem apenas as transações enviadas ou recebidas por eles.
+def _subscription_filters(
+    current_user: User,
+    user: str | None = None,
+    from_user: str | None = None,
+    dept: str | None = None,
+    min_value: int | None = None,
+) -> TransactionFilter:
+    # Busca os ids dos usuários dos filtros em uma única query.
+    usernames = {name for name in (user, from_user) if name}
+    user_ids = {}
+    if usernames:
+        with Session(engine) as session:
+            user_ids = dict(
+                session.exec(
+                    select(User.username, User.id).where(User.username.in_(usernames))  # type: ignore
+                ).all()
+            )
+    if missing := usernames - user_ids.keys():
+        raise HTTPException(status_code=404, detail=f"User {missing.pop()} not found")
+
+    return TransactionFilter(
+        user_id=user_ids.get(user),
+        from_id=user_ids.get(from_user),
+        dept=dept,
+        min_value=min_value,
+        viewer_id=None if current_user.superuser else current_user.id,
+    )
+
+
+# Função que autentica o cliente do websocket e monta os filtros da sua inscrição.
+# O token JWT pode ser enviado no header 'Authorization' ou no parâmetro 'token', já
+# que os navegadores não permitem enviar headers ao abrir um websocket.
+async def _ws_filters(
+    websocket: WebSocket,
+    token: str | None,
+    user: str | None,
+    from_user: str | None,
+    dept: str | None,
+    min_value: int | None,
+) -> TransactionFilter:
+    current_user = await get_current_user(token=token or "", request=websocket)  # type: ignore
+    return await to_thread(
+        _subscription_filters, current_user, user, from_user, dept, min_value
+    )
+
+
+# Classe que lê os lotes do histórico (um gerador síncrono com um cursor no banco de
+# dados) em outra thread. Caso o cliente se desconecte durante uma leitura, a thread
+# continua executando o gerador, por isso 'close' aguarda a leitura em andamento
+# terminar antes de fechá-lo.
+class _Backlog:
+    """Read the history batches off the event loop and close them safely."""
+
+    def __init__(self, batches: Iterator[list[dict]]):
+        self._batches = batches
+        self._pending: Optional[Future] = None
+
+    # Retorna o próximo lote do histórico ou None ao chegar ao fim.
+    async def next(self) -> Optional[list[dict]]:
+        self._pending = create_task(to_thread(next, self._batches, None))
+        return await shield(self._pending)
+
+    # Fecha o gerador, encerrando a sessão com o banco de dados.
+    async def close(self) -> None:
+        if self._pending is not None:
+            await gather(self._pending, return_exceptions=True)
+        await to_thread(self._batches.close)
+
+
+# Gerador dos eventos do SSE ('text/event-stream'), usando o mesmo hub do websocket.
+# Cada transação é enviada como um evento com o seu id, que o navegador reenvia no
+# header 'Last-Event-ID' ao se reconectar. Quando não houver novas transações por
+# 'heartbeat_interval' segundos, envia um comentário para manter a conexão aberta.
+async def _transaction_events(
+    filters: TransactionFilter, last_id: int | None
+) -> AsyncIterator[str]:
+    frame_size = settings.broadcast.frame_size  # type: ignore
+    heartbeat = settings.broadcast.heartbeat_interval  # type: ignore
+
+    def event(transaction: dict) -> str:
+        data = TransactionResponse.model_validate(transaction).model_dump_json()
+        return f"id: {transaction['id']}\nevent: transaction\ndata: {data}\n\n"
+
+    # Inscreve no hub antes de ler o histórico, assim como no websocket. Sem um id de
+    # retomada, apenas as novas transações são enviadas.
+    subscription = await hub.subscribe(filters)
+    backlog = _Backlog(
+        stream_transactions(last_id or 0, frame_size, filters, hub.settled_id)
+    )
+    try:
+        last = last_id or 0
+        if last_id is not None:
+            while (transactions := await backlog.next()) is not None:
+                yield "".join(event(transaction) for transaction in transactions)
+                last = transactions[-1]["id"]
+        await backlog.close()
+
+        while True:
+            try:
+                transactions = await wait_for(
+                    subscription.get_batch(frame_size), timeout=heartbeat
+                )
+            except TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            # Cliente lento, o hub encerrou a inscrição.
+            if transactions is None:
+                return
+            transactions = [t for t in transactions if t["id"] > last]
+            if transactions:
+                yield "".join(event(transaction) for transaction in transactions)
+                last = transactions[-1]["id"]
+    finally:
+        hub.unsubscribe(subscription)
+        await backlog.close()
+
+
+# Rota de feed de alterações para sincronizar as transações de forma incremental.
+# Retorna as transações com id maior que 'since_id', ordenadas pelo id, até 'limit'.
+# Caso não existam novas transações, a requisição fica aguardando (sem manter uma
+# conexão com o banco de dados) até uma nova transação ser criada ou até 'timeout'
+# segundos. O 'next_since_id' da resposta deve ser usado na próxima chamada.
+# Apenas as transações até a última entregue pelo hub ('settled_id') são retornadas,
+# uma transação com id menor confirmada após outra com id maior não é pulada.
+@router.get("/changes", response_model=TransactionChangesResponse)
+async def list_transaction_changes(
+    *,
+    current_user: User = AuthenticatedUser,
+    since_id: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+    timeout: float = Query(default=25.0, ge=0, le=60),
+    user: str | None = None,
+    from_user: str | None = None,
+):
+    """List transactions created after since_id, waiting for new ones."""
+    filters = await to_thread(_subscription_filters, current_user, user, from_user)
+
+    # Inscreve no hub antes de consultar o banco de dados, dessa forma uma transação
+    # criada logo após a consulta não é perdida. As transações após o 'settled_id'
+    # são entregues pelo hub, em ordem de id, quando os ids anteriores forem confirmados.
+    subscription = await hub.subscribe(filters)
+    try:
+        transactions = await to_thread(
+            fetch_transactions, since_id, limit, filters, hub.settled_id
+        )
+        if not transactions:
+            # Aguarda as próximas transações entregues pelo hub, que já são filtradas.
+            try:
+                transactions = await wait_for(
+                    subscription.get_batch(limit), timeout=timeout
+                )
+            except TimeoutError:
+                pass
+            transactions = [t for t in transactions or [] if t["id"] > since_id]
+    finally:
+        hub.unsubscribe(subscription)
+
+    return TransactionChangesResponse(
+        items=[TransactionResponse.model_validate(t) for t in transactions],
+        next_since_id=transactions[-1]["id"] if transactions else since_id,
+    )
+
+
+# Rota que transmite as novas transações via Server-Sent Events, uma alternativa ao
+# websocket para clientes atrás de proxies que não suportam websockets.
+# Aceita os mesmos filtros da listagem de transações e retoma a partir do id enviado no
+# header 'Last-Event-ID' (ou do parâmetro 'since_id').
+@router.get("/stream")
+async def stream_transactions_events(
+    *,
+    current_user: User = AuthenticatedUser,
+    user: str | None = None,
+    from_user: str | None = None,
+    since_id: int | None = None,
+    last_event_id: Annotated[int | None, Header()] = None,
+):
+    """Stream new transactions as Server-Sent Events."""
+    filters = await to_thread(_subscription_filters, current_user, user, from_user)
+    return StreamingResponse(
+        _transaction_events(filters, last_event_id or since_id),
+        media_type="text/event-stream",
+        # Impede que proxies armazenem ou agrupem os eventos antes de enviá-los.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-# TODO: Use ConnectionManager from fastapi docs.
 # Definindo um endpoint do tipo websocket.
+# As novas transações são recebidas do hub de transmissão, que busca cada transação
+# apenas uma vez e entrega para todos os clientes conectados, sem que cada conexão
+# fique consultando o banco de dados ou mantenha uma sessão aberta.
+# 'since_id' ativa o modo em lotes: o cliente recebe apenas as transações após esse id,
+# agrupadas em mensagens '{"items": [...], "last_id": N}'. O 'last_id' da última
+# mensagem recebida deve ser usado como 'since_id' ao se reconectar.
+# Sem 'since_id', todo o histórico é enviado com uma mensagem por transação.
+# 'user', 'from_user', 'dept' e 'min_value' filtram as transações no servidor, tanto no
+# histórico quanto nas novas transações.
 @router.websocket("/ws")
-async def list_transactions_ws(websocket: WebSocket, session: Session = ActiveSession):
+async def list_transactions_ws(
+    websocket: WebSocket,
+    since_id: int | None = None,
+    token: str | None = None,
+    user: str | None = None,
+    from_user: str | None = None,
+    dept: str | None = None,
+    min_value: int | None = None,
+):
+    # Autentica o cliente antes de aceitar a conexão, caso o token seja inválido ou
+    # algum filtro não exista, a conexão é recusada com o código 1008 (violação de
+    # política).
+    try:
+        filters = await _ws_filters(websocket, token, user, from_user, dept, min_value)
+    except HTTPException as error:
+        await websocket.close(code=1008, reason=str(error.detail))
+        return
+
     # Quando o usuário chama o endpoint para abrir uma conexão, cai nessa linha, que ela aceita a conexão.
     # Por ser operações de I/O, deve-se utilizar o await e por conta disso o servidor fica aguardando mensagens
     # neste ponto do código.
     await websocket.accept()
 
-    # Variável de controle para exibir apenas a última transição por vez.
-    last = 0
-
-    # Loop infinito para que a conexão fique aberta sempre. A partir daqui a conexão já está aberta.
-    while True:
-        # Realiza uma query no banco de dados filtrando apenas pelas novas transações, ordenando-as por id.
-        # Aqui mora o problema por conta de ser síncrono, prejudicando muito a performance e não é recomendado
-        # fazer isso em operações de websocket.
-        new_transactions = session.exec(
-            select(Transaction).where(Transaction.id > last).order_by("id")
-        )
-
-        # Para cada transação, constrói um dicionário com os dados requisitados e envia ao usuário.
-        for transaction in new_transactions:
-            data = {
-                "to": transaction.user.name,
-                "from": transaction.from_user.name,
-                "value": transaction.value,
-            }
+    frame_size = settings.broadcast.frame_size  # type: ignore
+    send_timeout = settings.broadcast.send_timeout  # type: ignore
 
+    # Envia as transações ao cliente, em lotes ou uma por mensagem. O envio aguarda o
+    # buffer do socket ser liberado, caso isso demore mais que 'send_timeout' o cliente
+    # é considerado lento.
+    async def send(transactions: list[dict]) -> None:
+        if since_id is None:
+            messages = [_ws_message(transaction) for transaction in transactions]
+        else:
+            messages = []
+            for start in range(0, len(transactions), frame_size):
+                chunk = transactions[start : start + frame_size]
+                items = [{"id": item["id"], **_ws_message(item)} for item in chunk]
+                messages.append({"items": items, "last_id": chunk[-1]["id"]})
+        for message in messages:
             # Encaminha o JSON para o cliente que está conectado. O uso de await se deve ao fato de garantir
             # que a mensagem vai chegar por inteira ao usuário antes de continuar a execução do código, não
             # sobrepondo as mensagens.
-            await websocket.send_json(data)
+            await wait_for(websocket.send_json(message), timeout=send_timeout)
+
+    # Inscreve o cliente no hub antes de ler o histórico, dessa forma nenhuma transação
+    # criada durante a leitura é perdida. O histórico é lido apenas até a última
+    # transação entregue pelo hub, as seguintes são enviadas por ele em ordem de id.
+    subscription = await hub.subscribe(filters)
+    backlog = _Backlog(
+        stream_transactions(since_id or 0, frame_size, filters, hub.settled_id)
+    )
+    try:
+        # Variável de controle com o id da última transação enviada ao cliente.
+        last = since_id or 0
+
+        # Envia o histórico de transações em lotes, lidos por um cursor no servidor do
+        # banco de dados fora do event loop. A sessão é fechada ao fim do histórico.
+        while (transactions := await backlog.next()) is not None:
+            await send(transactions)
+            last = transactions[-1]["id"]
+        await backlog.close()
+
+        # Encaminha as novas transações recebidas do hub, ignorando as que já foram
+        # enviadas junto com o histórico. Caso o cliente seja lento e a sua fila encha,
+        # o hub o desconecta e a conexão é fechada.
+        async def forward():
+            while (
+                transactions := await subscription.get_batch(frame_size)
+            ) is not None:
+                transactions = [t for t in transactions if t["id"] > last]
+                if transactions:
+                    await send(transactions)
+            await websocket.close(code=1013, reason="Slow consumer")
 
-            # Define qual foi a última transação enviada para o usuário.
-            last = transaction.id
+        # Aguarda o cliente fechar a conexão, liberando a inscrição imediatamente.
+        async def watch():
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
 
-            # Apenas para visualização no frontend, não é necessário!!!
-            await sleep(1)
+        tasks = [create_task(forward()), create_task(watch())]
+        done, pending = await wait(tasks, return_when=FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+    except TimeoutError:
+        await websocket.close(code=1013, reason="Slow consumer")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        await backlog.close()
@@ -1,12 +1,21 @@
-from sqlmodel import Session, select
-from dundie_api.models import User
+from hashlib import sha256
+
+from sqlmodel import Session, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import joinedload
+from dundie_api.models import Balance, User, UserStats
+from dundie_api.pagination import decode_cursor, encode_cursor
 from dundie_api.serializers.user import (
     UserResponse,
     UserRequest,
+    UserStatsResponse,
     UserProfilePatchRequest,
     UserPasswordPatchRequest,
 )
 from dundie_api.db import ActiveSession
+from dundie_api.replicas import AsyncReadActiveSession, ReadActiveSession
+from dundie_api.cache import user_cache
+from dundie_api.security import async_get_password_hash
 from dundie_api.auth import (
     AuthenticatedUser,
     SuperUser,
@@ -15,46 +24,109 @@ from dundie_api.auth import (
 )
 from dundie_api.tasks.user import try_to_send_pwd_reset_email
 from dundie_api.queue import queue
+from dundie_api.timing import InstrumentedRoute
 
 from sqlalchemy.exc import IntegrityError
 
-from fastapi import APIRouter, HTTPException, status, Body
+from fastapi import APIRouter, HTTPException, status, Body, Query, Request, Response
+from fastapi.responses import JSONResponse
 
 # Criando um conjunto de rotas individuais, neste caso, elas são
 # responsáveis pelas rotas de usuários.
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 
 # Rota 'GET' para listar todos os usuários cadastrados no banco de dados.
 # Ela possui um modelo de resposta indicando que vai ser retornado uma
 # lista de UserResponse, que é o serializer 'UserResponse'.
 # E possui uma dependência atrelada, que é da sessão do banco de dados 'session'.
-# Protengendo a rota com a dependência 'AuthenticatedUser' para que apenas usuários
-# autenticados a chamem.
 # 'response_model_exclude_unset=True' faz com que seja excluídos campos não definidos
 # na response, usando o modelo de response.
+# A listagem é paginada por 'offset' ou por 'cursor', o cursor da próxima página é
+# retornado no header 'X-Next-Cursor'. A resposta possui um 'ETag', caso o cliente
+# envie o mesmo valor no header 'If-None-Match', é retornado 304 sem corpo.
 @router.get(
     "/",
     response_model=list[UserResponse],
     response_model_exclude_unset=True
 )
 async def list_users(
-    *, session: Session = ActiveSession, show_balance_field: bool = ShowBalanceField
+    *,
+    request: Request,
+    session: Session = ReadActiveSession,
+    show_balance_field: bool = ShowBalanceField,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = None,
 ):
     """List all users from database."""
-    # TODO: Pagination and move balance show to another view.
+    # TODO: Move balance show to another view.
+
+    # Seleciona apenas as colunas exibidas na resposta, sem carregar a senha e o email.
+    # O 'id' é usado apenas para a ordenação e o cursor.
+    columns = [
+        User.id,
+        User.name,
+        User.username,
+        User.dept,
+        User.avatar,
+        User.bio,
+        User.currency,
+    ]
+    query = select(*columns)
 
-    # Selecionando todos os usuários da tabela 'user'.
-    users = session.exec(select(User)).all()
+    # Caso o campo show_balance_field estiver como verdadeiro e o usuário tiver
+    # permissão, inclui o saldo de cada usuário na mesma query, através de um JOIN
+    # com a tabela 'balance'. Usuários sem saldo possuem saldo zero.
+    if show_balance_field:
+        query = query.add_columns(
+            func.coalesce(Balance.value, 0).label("balance")
+        ).outerjoin(Balance, Balance.user_id == User.id)  # type: ignore
+
+    # Paginação por cursor busca os usuários após o último da página anterior, caso
+    # contrário, pula a quantidade de usuários definida em 'offset'.
+    if cursor:
+        values = decode_cursor(cursor, "id")
+        # O cursor deve conter apenas o id (inteiro) do último usuário da página.
+        if len(values) != 1 or type(values[0]) is not int:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        query = query.where(User.id > values[0])
+    else:
+        query = query.offset(offset)
+
+    # Busca um usuário a mais do que o limite para saber se existe uma próxima página.
+    rows = session.exec(query.order_by(User.id).limit(limit + 1)).all()
+    headers = {"Vary": "Authorization"}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor("id", [rows[-1].id])
+
+    # Serializa as linhas usando o 'UserResponse', excluindo o campo 'balance' quando
+    # ele não foi selecionado.
+    users = [
+        UserResponse.model_validate(row, from_attributes=True).model_dump(
+            exclude_unset=True
+        )
+        for row in rows
+    ]
+    response = JSONResponse(content=users, headers=headers)
 
-    # Se o campo show_balance_field estiver como falso, exclui da resposta o campo
-    # de 'balance' que indica a quantidade de moeda de cada usuário.
-    if not show_balance_field:
-        return [User.model_dump(user, exclude="balance") for user in users]
+    # O 'ETag' é o hash do corpo da resposta, caso o cliente já possua essa mesma
+    # versão da página, retorna apenas o status 304 (não modificado).
+    etag = f'"{sha256(response.body).hexdigest()[:32]}"'
+    if _etag_matches(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers={"ETag": etag, **headers})
 
-    # Caso o campo show_balance_field estiver como verdadeiro e o usuário tiver
-    # permissão, exibe todos os usuários com seus respectivos saldos.
-    return users
+    response.headers["ETag"] = etag
+    return response
+
+
+# Função que verifica se o ETag da resposta está no header 'If-None-Match'. O header é
+# uma lista separada por vírgulas, com ou sem espaços, e a comparação é fraca: 'W/"x"'
+# corresponde a '"x"'. O valor '*' corresponde a qualquer versão.
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
 
 
 # Criando uma rota para listar um usuário através de seu username, o 'username' está
@@ -73,18 +145,24 @@ async def list_users(
 )
 async def get_user_by_username(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncReadActiveSession,
     username: str,
     show_balance_field: bool = ShowBalanceField,
 ):
     """Get single user by username"""
 
     # Query para selecionar o usuário no banco de dados através de seu 'username'.
-    query = select(User).where(User.username == username)
+    # O saldo é carregado na mesma query, pois a sessão assíncrona não carrega os
+    # relacionamentos de forma preguiçosa (lazy) ao serem acessados.
+    query = (
+        select(User)
+        .where(User.username == username)
+        .options(joinedload(User._balance))  # type: ignore
+    )
 
     # Executando a query SQL. 'first()' é usado para retornar a instância única do
     # usuário direta, sem ser uma lista.
-    user = session.exec(query).first()
+    user = (await session.exec(query)).first()
 
     # Verifica se o usuário existe no banco de dados, senão existir retorna uma
     # mensagem de erro.
@@ -102,6 +180,43 @@ async def get_user_by_username(
     return user
 
 
+# Rota para exibir o resumo das transações de um usuário (quantidades, somas e datas),
+# lido de uma única linha da tabela 'user_stats' através do 'username'.
+# Assim como o saldo, apenas o próprio usuário ou um superusuário podem visualizar.
+@router.get("/{username}/stats/", response_model=UserStatsResponse)
+async def get_user_stats(
+    *,
+    session: Session = ActiveSession,
+    current_user: User = AuthenticatedUser,
+    username: str,
+):
+    """Get the transaction summary of a user"""
+
+    # Cláusula de guarda, usuários comuns só podem ver o seu próprio resumo.
+    if not current_user.superuser and current_user.username != username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You can only see your own stats.",
+        )
+
+    # Busca o usuário e o seu resumo em uma única query, usuários sem nenhuma
+    # transação ainda não possuem resumo, por isso o 'OUTER JOIN'.
+    query = (
+        select(User.username, UserStats)
+        .outerjoin(UserStats, UserStats.user_id == User.id)  # type: ignore
+        .where(User.username == username)
+    )
+    row = session.exec(query).first()
+
+    # Verifica se o usuário existe no banco de dados.
+    if not row:
+        raise HTTPException(status_code=404, detail=f"User {username} not found")
+
+    username, stats = row
+    summary = stats.model_dump(exclude={"user_id", "updated_at"}) if stats else {}
+    return UserStatsResponse(username=username, **summary)
+
+
 # Rota para criar um novo usuário no banco de dados, recebe 'UserResponse' como modelo
 # de resposta e 'status_code' indica quais os códigos HTTP que podem ser retornados.
 # Recebe como injeção de dependência, a sessão do banco de dados (session) e o payload (user)
@@ -124,7 +239,10 @@ async def create_user(*, session: Session = ActiveSession, user: UserRequest):
 
     # Converte e valida o serializador de entrada 'UserRequest' para o modelo 'User',
     # que é o modelo de conexão ao banco de dados. Todos os campos são validados.
-    db_user = User.model_validate(user)
+    # O hash da senha é calculado no pool de hashes, sem bloquear o event loop.
+    db_user = User.model_validate(
+        user, update={"password": await async_get_password_hash(user.password)}
+    )
 
     # Adiciona o usuário a sessão de conexão, para criá-lo.
     session.add(db_user)
@@ -143,6 +261,9 @@ async def create_user(*, session: Session = ActiveSession, user: UserRequest):
             detail="Database IntegrityError",
         )
 
+    # Remove do cache qualquer identidade antiga armazenada com o mesmo 'username'.
+    user_cache.invalidate(db_user.username)
+
     # Atualiza os dados do usuário instanciado na rota com os dados atualizados do
     # banco de dados, mantendo a conformidade.
     session.refresh(db_user)
@@ -204,6 +325,9 @@ async def update_user(
     # Confirma as mudanças, refletindo as alterações no banco de dados.
     session.commit()
 
+    # Remove o usuário do cache, para que a próxima requisição carregue os novos dados.
+    user_cache.invalidate(user.username)
+
     # Atualiza a instância do usuário para refletir informações preenchidas
     # no nível do banco de dados na instância atual.
     session.refresh(user)
@@ -226,8 +350,9 @@ async def change_password(
     patch_data: UserPasswordPatchRequest,
     user: User = CanChangeUserPassword,
 ):
-    # Altera a senha do usuário.
-    user.password = patch_data.password
+    # Altera a senha do usuário, o hash é calculado no pool de hashes, sem bloquear
+    # o event loop.
+    user.password = await async_get_password_hash(patch_data.password)
 
     # Adiciona o usuário na sessão.
     session.add(user)
@@ -235,6 +360,9 @@ async def change_password(
     # Adiciona o usuário no banco de dados.
     session.commit()
 
+    # Remove o usuário do cache, a versão da senha armazenada não é mais válida.
+    user_cache.invalidate(user.username)
+
     # Atualiza o objeto 'user' com as informações
     # do banco de dados, para refletir qualquer
     # alteração feita na camada de banco de dados.
@@ -1,20 +1,51 @@
 """Security utilities"""
 
+# Executa funções em outras threads a partir de código assíncrono.
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+
+# Funções para medir o tempo de cálculo dos hashes.
+from statistics import median
+from time import perf_counter
+
 # Biblioteca para criar e verificar hashes de senhas usando o algoritmo Argon2id.
 from argon2 import PasswordHasher
 
-# Criando um contexto, que vai ser usado para criar e vericiar os hashes
-# 'schemes' declara quais os algoritmos vão ser usados para criar os hashes e
-# 'deprecated' como 'auto' define que todos os algoritmos, tirando o padrão, vão ser
-# considerads depreciados.
-pwd_context = PasswordHasher()
+# Variável de configurações da API.
+from dundie_api.config import settings
+
+# Histograma do tempo de verificação das senhas.
+from dundie_api.metrics import argon2_verify_duration
+
+# Memória mínima, em KiB, aceita pelo ajuste automático dos parâmetros do Argon2.
+MIN_MEMORY_COST = 8 * 1024
+
+
+# Função que cria o contexto de hashes a partir dos parâmetros do Argon2 definidos
+# nas configurações ('[default.security.argon2]'), ajustados para cada servidor com
+# o comando 'dundie tune-hashing'.
+def build_password_hasher() -> PasswordHasher:
+    argon2 = settings.security.argon2  # type: ignore
+    return PasswordHasher(
+        time_cost=argon2.time_cost,
+        memory_cost=argon2.memory_cost,
+        parallelism=argon2.parallelism,
+    )
+
+
+# Criando um contexto, que vai ser usado para criar e vericiar os hashes.
+# Hashes criados com parâmetros diferentes continuam sendo verificados e são
+# atualizados no login (veja 'check_needs_rehash').
+pwd_context = build_password_hasher()
 
 
 # Função para verificar se a senha inserida é igual ao hash armazenado no banco de dados.
 # Retorna um booleano indicando se é (True) ou não (False) igual.
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a hash against a password"""
-    return pwd_context.verify(hashed_password, plain_password)
+    # O tempo é registrado também quando a senha não confere e uma exceção é lançada.
+    with argon2_verify_duration.time():
+        return pwd_context.verify(hashed_password, plain_password)
 
 
 # Função para criar o hash a partir da senha do usuário.
@@ -28,3 +59,73 @@ def get_password_hash(password: str) -> str:
 # ser gerado um novo hash atualizado para a senha do usuário.
 def check_needs_rehash(hash: str) -> bool:
     return pwd_context.check_needs_rehash(hash)
+
+
+# Função que mede a mediana, em milissegundos, do tempo para calcular um hash com os
+# parâmetros informados.
+def measure_hash(
+    time_cost: int, memory_cost: int, parallelism: int, rounds: int = 5
+) -> float:
+    hasher = PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+    )
+    timings = []
+    for _ in range(rounds):
+        start = perf_counter()
+        hasher.hash("dundie-tune-hashing")
+        timings.append((perf_counter() - start) * 1000)
+    return median(timings)
+
+
+# Função que procura os parâmetros mais fortes do Argon2 que calculam um hash dentro
+# do tempo alvo ('target_ms') neste servidor. A memória começa em 'memory_cost' e é
+# reduzida pela metade enquanto uma única iteração ultrapassar o tempo alvo, depois o
+# número de iterações ('time_cost') é aumentado enquanto couber no tempo alvo.
+def tune_hashing(
+    target_ms: float, memory_cost: int, parallelism: int, rounds: int = 5
+) -> dict:
+    """Find the strongest Argon2 parameters hashing within target_ms."""
+    elapsed = measure_hash(1, memory_cost, parallelism, rounds)
+    while elapsed > target_ms and memory_cost // 2 >= MIN_MEMORY_COST:
+        memory_cost //= 2
+        elapsed = measure_hash(1, memory_cost, parallelism, rounds)
+
+    time_cost = 1
+    while True:
+        candidate = measure_hash(time_cost + 1, memory_cost, parallelism, rounds)
+        if candidate > target_ms:
+            break
+        time_cost, elapsed = time_cost + 1, candidate
+
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "elapsed_ms": round(elapsed, 2),
+    }
+
+
+# Pool dedicado e limitado de threads para calcular os hashes de senhas. O Argon2 consome
+# dezenas de milissegundos de CPU e libera o GIL durante o cálculo, dessa forma, as rotas
+# assíncronas não bloqueiam o event loop e o número de hashes simultâneos é limitado,
+# sem ocupar o pool de threads padrão usado pelas rotas e dependências síncronas.
+hash_executor = ThreadPoolExecutor(
+    max_workers=settings.security.hash_workers,  # type: ignore
+    thread_name_prefix="dundie-hash",
+)
+
+
+# Versão assíncrona de 'verify_password', executada no pool de hashes.
+async def async_verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifies a hash against a password without blocking the event loop"""
+    return await get_running_loop().run_in_executor(
+        hash_executor, verify_password, plain_password, hashed_password
+    )
+
+
+# Versão assíncrona de 'get_password_hash', executada no pool de hashes.
+async def async_get_password_hash(password: str) -> str:
+    """Generate a hash from plain text without blocking the event loop"""
+    return await get_running_loop().run_in_executor(
+        hash_executor, get_password_hash, password
+    )
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, field_validator
 
@@ -23,6 +23,10 @@ class TransactionResponse(BaseModel):
     @field_validator("user", "from_user", mode="before")
     @classmethod
     def get_usernames(cls, value) -> str | None:
+        # As listagens já selecionam o 'username' na própria query, nesse caso o valor
+        # já é o texto e é retornado diretamente, sem carregar o usuário.
+        if isinstance(value, str):
+            return value
         # Se o usuário estiver definido ('value') por conta do operador 'and' vai ser
         # retornado o último valor verdadeiro, no caso, o seu 'username'. Caso ele não
         # existir, vai ser retornado None, por conta que o 'and' ao encontrar um valor
@@ -30,3 +34,47 @@ class TransactionResponse(BaseModel):
         return value and value.username
 
     # TODO: Serialize date field to correct time.
+
+
+# Serializer para cada item de uma transferência em lote.
+class TransactionBulkItem(BaseModel):
+    # Usuário que vai receber os pontos.
+    username: str
+    # Quantidade de pontos a serem transferidos.
+    value: int
+
+
+# Serializer do corpo da requisição de transferência em lote.
+class TransactionBulkRequest(BaseModel):
+    # Lista de transferências a serem realizadas.
+    items: list[TransactionBulkItem]
+    # 'atomic' só salva as transferências se todas forem válidas (tudo ou nada),
+    # 'best_effort' salva as válidas e reporta as que falharam.
+    mode: Literal["atomic", "best_effort"] = "atomic"
+
+
+# Serializer com o resultado de cada item da transferência em lote.
+class TransactionBulkResult(BaseModel):
+    username: str
+    value: int
+    # 'added' quando a transferência foi salva, 'failed' quando o item é inválido e
+    # 'skipped' quando o item era válido, mas o lote foi rejeitado no modo 'atomic'.
+    status: Literal["added", "failed", "skipped"]
+    # Motivo da falha, caso exista.
+    detail: Optional[str] = None
+
+
+# Serializer da resposta da transferência em lote.
+class TransactionBulkResponse(BaseModel):
+    mode: str
+    # Quantidade de transferências salvas e que falharam.
+    added: int
+    failed: int
+    results: list[TransactionBulkResult]
+
+
+# Serializer da resposta do feed de alterações, com as transações após o 'since_id'
+# informado e o 'since_id' que deve ser usado na próxima chamada.
+class TransactionChangesResponse(BaseModel):
+    items: list[TransactionResponse]
+    next_since_id: int
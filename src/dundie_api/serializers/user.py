@@ -7,8 +7,7 @@ from pydantic import BaseModel, field_validator, ValidationInfo, Field, model_va
 # Classe para definir que uma variável pode ser None, ou seja, opcional.
 from typing import Optional
 
-# Função para criar um hash da senha.
-from dundie_api.security import get_password_hash
+from datetime import datetime
 
 # Função para criar um username para o usuário.
 from dundie_api.models.user import generate_username
@@ -37,6 +36,22 @@ class UserResponse(BaseModel):
     balance: Optional[int] = None
 
 
+# Classe que representa o resumo das transações de um usuário, lido da tabela
+# 'user_stats' que é mantida a cada nova transação.
+class UserStatsResponse(BaseModel):
+    """Serializer for the transaction summary of a user."""
+
+    username: str
+    # Quantidade e soma das transações recebidas e enviadas pelo usuário.
+    received_count: int = 0
+    received_total: int = 0
+    sent_count: int = 0
+    sent_total: int = 0
+    # Data e hora da primeira e da última transação, recebida ou enviada.
+    first_transaction_at: Optional[datetime] = None
+    last_transaction_at: Optional[datetime] = None
+
+
 # Classe que define o serializador de Request, que será usado quando o usuário
 # for criar uma nova instância de usuário no banco de dados.
 # Possui suas próprias validações, requerente campos diferentes do serializer
@@ -80,16 +95,6 @@ class UserRequest(BaseModel):
         # Retorna o campo validado, é obrigatório sempre retornar um valor.
         return value
 
-    # Outro validador, mas para o campo 'password' que também vai ser executado antes
-    # mesmo de instanciar a classe UserRequest. Também precisa do decorator para ser um
-    # método da classe '@classmethod' permitindo receber o contexto da instância.
-    # Este validador tem a função de realizar o hash da senha (password) do usuário.
-    @field_validator("password", mode="before")
-    @classmethod
-    def hash_password(cls, value: str) -> str:
-        # Retorna o hash sempre ao criar um novo usuário.
-        return get_password_hash(value)
-
 
 # Serializer para validar a operação de PATCH (update parcial) de um usuário.
 class UserProfilePatchRequest(BaseModel):
@@ -145,14 +150,3 @@ class UserPasswordPatchRequest(BaseModel):
 
         # Obrigatoriamente
         return values
-
-    # Validador para garantir que a senha passada seja hasheada antes mesmo de instanciar
-    # a classe, dessa forma, garante um nível de segurança mesmo durante as transações e
-    # execuções do script.
-    # 'cls' representa o contexto da instância, por ser um '@classmethod' e 'value' representa
-    # o valor do campo 'password' a ser validado.
-    @field_validator("password", mode="before")
-    @classmethod
-    def hash_password(cls, value: str) -> str:
-        # Retorna o hash sempre ao criar um novo usuário.
-        return get_password_hash(value)
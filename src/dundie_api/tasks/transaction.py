@@ -1,7 +1,36 @@
-from typing import Optional
-from sqlmodel import Session
+import random
+from collections import defaultdict
+from datetime import datetime, timezone
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, func, insert, literal, select, text, true, union_all
+
+from dundie_api.broadcast import hub
+from dundie_api.config import settings
 from dundie_api.db import engine
-from dundie_api.models import User, Transaction, Balance
+from dundie_api.models import User, Transaction, Balance, UserStats
+
+T = TypeVar("T")
+
+# Códigos de erro do PostgreSQL que indicam um conflito de concorrência e que podem
+# ser resolvidos executando a transação novamente: falha de serialização, deadlock
+# e tempo de espera por um lock esgotado.
+RETRYABLE_SQLSTATES = {"40001", "40P01", "55P03"}
+
+# Contadores de espera por locks e de novas tentativas das transferências, são
+# compartilhados entre todas as threads do processo, por isso o uso do 'Lock'.
+_stats_lock = Lock()
+_stats = {
+    "lock_acquisitions": 0,
+    "lock_wait_seconds": 0.0,
+    "retries": 0,
+    "retries_exhausted": 0,
+}
 
 
 # Definindo uma exceção personalizada para as transações.
@@ -9,13 +38,232 @@ class TransactionError(Exception):
     """Can't add transaction"""
 
 
+# Função que retorna o 'INSERT' específico do banco de dados em uso, tanto o
+# PostgreSQL quanto o SQLite suportam 'ON CONFLICT', que permite realizar um
+# upsert (insere ou atualiza) em um único comando SQL.
+def _upsert(session: Session, model):
+    """Return a dialect specific INSERT supporting ON CONFLICT."""
+    if session.get_bind().dialect.name == "postgresql":
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+
+# Função para aplicar a variação (delta) do saldo de cada usuário de forma atômica.
+# 'deltas' é um dicionário onde a chave é o id do usuário e o valor é quanto vai
+# ser somado (ou subtraído, se negativo) ao seu saldo atual.
+def _apply_balance_deltas(session: Session, deltas: dict[int, int]) -> None:
+    """Apply balance deltas with a single atomic upsert.
+
+    Runs `UPDATE balance SET value = value + :delta` for existing holders and
+    inserts the row for new ones, so the cost does not depend on the history.
+    """
+    now = datetime.now(timezone.utc)
+
+    # Ordena pelo id do usuário para que as linhas sejam sempre escritas na mesma
+    # ordem, independente de quem envia ou recebe os pontos.
+    rows = [
+        {"user_id": user_id, "value": delta, "updated_at": now}
+        for user_id, delta in sorted(deltas.items())
+    ]
+
+    # Caso o usuário ainda não possua saldo, a linha é criada com o próprio delta,
+    # caso contrário, o delta é somado ao valor atual diretamente no banco de dados.
+    stmt = _upsert(session, Balance).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Balance.user_id],
+        set_={
+            "value": Balance.value + stmt.excluded.value,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    session.execute(stmt)
+
+
+# Função para atualizar o resumo de transações (quantidades, somas e datas) de cada
+# usuário envolvido nas transações informadas, de forma atômica.
+# 'transactions' é a lista de transações (user_id, from_id, value e date) inseridas.
+def _apply_stats(session: Session, transactions: list[dict]) -> None:
+    """Add the transactions to the per-user summary with a single upsert."""
+    now = datetime.now(timezone.utc)
+
+    # Agrega as transações por usuário, quem recebe soma nas entradas e quem envia
+    # soma nas saídas.
+    stats: dict[int, dict] = {}
+    for transaction in transactions:
+        for user_id, kind in (
+            (transaction["user_id"], "received"),
+            (transaction["from_id"], "sent"),
+        ):
+            row = stats.setdefault(
+                user_id,
+                {
+                    "user_id": user_id,
+                    "received_count": 0,
+                    "received_total": 0,
+                    "sent_count": 0,
+                    "sent_total": 0,
+                    "first_transaction_at": transaction["date"],
+                    "last_transaction_at": transaction["date"],
+                    "updated_at": now,
+                },
+            )
+            row[f"{kind}_count"] += 1
+            row[f"{kind}_total"] += transaction["value"]
+            row["first_transaction_at"] = min(
+                row["first_transaction_at"], transaction["date"]
+            )
+            row["last_transaction_at"] = max(
+                row["last_transaction_at"], transaction["date"]
+            )
+
+    # Assim como no saldo, as linhas são escritas ordenadas pelo id do usuário e as
+    # variações são somadas aos valores atuais diretamente no banco de dados. A
+    # primeira transação é mantida e a última é sempre a mais recente.
+    stmt = _upsert(session, UserStats).values(
+        [stats[user_id] for user_id in sorted(stats)]
+    )
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={
+            "received_count": UserStats.received_count + excluded.received_count,
+            "received_total": UserStats.received_total + excluded.received_total,
+            "sent_count": UserStats.sent_count + excluded.sent_count,
+            "sent_total": UserStats.sent_total + excluded.sent_total,
+            "first_transaction_at": func.coalesce(
+                UserStats.first_transaction_at, excluded.first_transaction_at
+            ),
+            "last_transaction_at": excluded.last_transaction_at,
+            "updated_at": excluded.updated_at,
+        },
+    )
+    session.execute(stmt)
+
+
+# Função que avisa o hub do websocket que novas transações foram criadas. No
+# PostgreSQL também envia um 'NOTIFY', que só é entregue aos outros processos quando
+# a transação do banco de dados for confirmada.
+def _notify_new_transactions(session: Session) -> None:
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(
+            text("SELECT pg_notify(:channel, '')"),
+            {"channel": settings.broadcast.channel},  # type: ignore
+        )
+
+
+# Função que retorna uma cópia dos contadores de locks e novas tentativas.
+def get_lock_stats() -> dict:
+    """Return the lock-wait and retry counters of the transfer path."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+# Função para incrementar os contadores de forma segura entre threads.
+def _record(**increments) -> None:
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+
+# Função que verifica se um erro do banco de dados é um conflito de concorrência,
+# como falha de serialização ou deadlock (PostgreSQL) ou banco bloqueado (SQLite).
+def _is_retryable(error: DBAPIError) -> bool:
+    if getattr(error.orig, "sqlstate", None) in RETRYABLE_SQLSTATES:
+        return True
+    return "database is locked" in str(error.orig)
+
+
+# Função que executa a operação e, caso ocorra um conflito de concorrência, desfaz as
+# alterações e tenta novamente, esperando um tempo que dobra a cada tentativa.
+def _run_with_retry(session: Session, operation: Callable[[], T]) -> T:
+    """Run operation, retrying serialization failures with bounded backoff."""
+    max_retries = settings.transaction.max_retries  # type: ignore
+    backoff = settings.transaction.retry_backoff  # type: ignore
+
+    for attempt in range(max_retries + 1):
+        try:
+            return operation()
+        except DBAPIError as error:
+            session.rollback()
+            if not _is_retryable(error):
+                raise
+            if attempt == max_retries:
+                _record(retries_exhausted=1)
+                raise
+            _record(retries=1)
+            # O 'jitter' aleatório evita que as transações em conflito tentem
+            # novamente exatamente ao mesmo tempo.
+            sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+# Função que bloqueia as linhas de saldo dos usuários envolvidos até o fim da
+# transação do banco de dados, retornando o saldo atual de cada um deles.
+def _lock_balances(session: Session, user_ids: set[int]) -> dict[int, int]:
+    """Lock the balance rows with SELECT ... FOR UPDATE in user id order.
+
+    Locking always in the same order avoids deadlocks between two transfers
+    in opposite directions. Missing rows are created first so that new
+    holders can be locked as well.
+    """
+    ids = sorted(user_ids)
+    now = datetime.now(timezone.utc)
+
+    # Garante que todos os usuários possuem uma linha na tabela 'balance', sem
+    # alterar as linhas existentes.
+    stmt = _upsert(session, Balance).values(
+        [{"user_id": user_id, "value": 0, "updated_at": now} for user_id in ids]
+    )
+    session.execute(stmt.on_conflict_do_nothing(index_elements=[Balance.user_id]))
+
+    # Bloqueia as linhas de saldo, ordenadas pelo id do usuário, medindo o tempo de
+    # espera caso outra transferência esteja utilizando as mesmas linhas.
+    start = perf_counter()
+    balances = session.exec(
+        select(Balance.user_id, Balance.value)
+        .where(Balance.user_id.in_(ids))  # type: ignore
+        .order_by(Balance.user_id)
+        .with_for_update()
+    ).all()
+    _record(lock_acquisitions=1, lock_wait_seconds=perf_counter() - start)
+
+    return dict(balances)  # type: ignore
+
+
+# Função que recalcula o saldo completo de um usuário a partir de todo o histórico
+# de transações. É usada apenas no modo de verificação, pois o custo é proporcional
+# a quantidade de transações do usuário.
+def compute_balance(session: Session, user_id: int) -> int:
+    """Recompute the balance of a user from the whole transaction history."""
+    # Soma todos os valores das transações recebidas.
+    total_income = (
+        select(func.coalesce(func.sum(Transaction.value), 0))
+        .where(Transaction.user_id == user_id)
+        .scalar_subquery()
+    )
+    # Soma todos os valores das transações enviadas.
+    total_expense = (
+        select(func.coalesce(func.sum(Transaction.value), 0))
+        .where(Transaction.from_id == user_id)
+        .scalar_subquery()
+    )
+    return session.scalar(select(total_income - total_expense)) or 0
+
+
 # Função para criar uma nova transação entre dois usuários.
 # 'user' é o usuário que está recebendo as moedas.
 # 'from_user' é o usuário que está enviando as moedas.
 # 'value' é o valor da transação.
 # 'session' é a sessão de conexão com o banco de dados, sendo opcional.
+# 'verify' ativa o recálculo completo do saldo para conferir o saldo incremental.
 def add_transaction(
-    *, user: User, from_user: User, value: int, session: Optional[Session] = None
+    *,
+    user: User,
+    from_user: User,
+    value: int,
+    session: Optional[Session] = None,
+    verify: bool = False,
 ):
     """Add a new transaction to the specified user.
 
@@ -23,51 +271,381 @@ def add_transaction(
         user: The user to add transaction to.
         from_user: The user where amount is coming from or superuser
         value: The value being added
+        verify: Recompute both balances from history and fail on mismatch
     """
 
-    # Cláusula de guarda, se o usuário não for um super usuário e o seu saldo
-    # for menor que o valor que ele está tentando transferir, invoca a exceção
-    # informando que o saldo é insuficiente.
-    if not from_user.superuser and from_user.balance < value:
-        raise TransactionError("Insufficient balance")
-
     # Cria uma nova sessão de banco de dados ou então utiliza a sessão passada
     # no parâmetro.
     session = session or Session(engine)
 
-    # Instância uma nova transação, informando todos os campos necessários.
-    transaction = Transaction(user=user, from_user=from_user, value=value)  # type: ignore
+    # Armazena os dados necessários dos usuários antes de iniciar, pois em caso de
+    # uma nova tentativa, a sessão é desfeita (rollback).
+    user_id, from_id, superuser = user.id, from_user.id, from_user.superuser
 
-    # Adiciona a transação a sessão de conexão com o banco de dados.
-    session.add(transaction)
+    def transfer():
+        # Bloqueia os saldos dos dois usuários e lê o saldo atual de quem envia.
+        balances = _lock_balances(session, {user_id, from_id})  # type: ignore
 
-    # Adiciona a transação no banco de dados.
-    # TODO: Tratar erros.
-    session.commit()
+        # Cláusula de guarda, se o usuário não for um super usuário e o seu saldo
+        # for menor que o valor que ele está tentando transferir, invoca a exceção
+        # informando que o saldo é insuficiente.
+        if not superuser and balances[from_id] < value:  # type: ignore
+            session.rollback()
+            raise TransactionError("Insufficient balance")
 
-    # Consulta o banco de dados e atualiza os dados dos usuário da transação.
-    session.refresh(user)
-    session.refresh(from_user)
+        # Instância uma nova transação e adiciona a sessão de conexão com o banco.
+        transaction = {
+            "user_id": user_id,
+            "from_id": from_id,
+            "value": value,
+            "date": datetime.now(timezone.utc),
+        }
+        session.add(Transaction(**transaction))
 
-    # Para cada usuário, calcula o total de saídas e entradas de pontos para definir
-    # seu saldo.
-    for holder in (user, from_user):
-        # Soma todos os valores das transações recebidas.
-        total_income = sum([t.value for t in holder.incomes])  # type: ignore
-        # Soma todos os valores das transações enviadas.
-        total_expense = sum([t.value for t in holder.expenses])  # type: ignore
+        # Calcula a variação do saldo de cada usuário envolvido. Usando um
+        # 'defaultdict' uma transferência para si mesmo resulta em uma variação nula.
+        deltas: dict[int, int] = defaultdict(int)
+        deltas[user_id] += value  # type: ignore
+        deltas[from_id] -= value  # type: ignore
 
-        # Tenta encontrar na tabela 'balance' se o usuário em questão já possui
-        # um saldo, caso ele não possuir nenhum saldo definido, instância um novo
-        # objeto para definir seu saldo.
-        balance = session.get(Balance, holder.id) or Balance(user=holder, value=0)  # type: ignore
+        # Atualiza os saldos na mesma transação do banco de dados em que a
+        # transação foi inserida, dessa forma, ou tudo é salvo ou nada é salvo.
+        # O resumo de transações dos usuários também é atualizado.
+        _apply_balance_deltas(session, deltas)
+        _apply_stats(session, [transaction])
 
-        # Realiza o cálculo do seu novo saldo, subtraindo os gastos dos ganhos totais.
-        balance.value = total_income - total_expense
+        # Modo de verificação, recalcula o saldo a partir de todo o histórico e
+        # compara com o saldo incremental antes de confirmar as alterações.
+        if verify:
+            for holder_id in deltas:
+                expected = compute_balance(session, holder_id)
+                stored = session.scalar(
+                    select(Balance.value).where(Balance.user_id == holder_id)
+                )
+                if stored != expected:
+                    session.rollback()
+                    raise TransactionError(
+                        f"Balance mismatch for user {holder_id}: "
+                        f"stored {stored}, expected {expected}"
+                    )
 
-        # Adiciona a sessão de conexão ao banco de dados.
-        session.add(balance)
+        # Reflete a transação e os novos saldos no banco de dados, liberando os locks,
+        # e acorda o hub para transmitir a nova transação.
+        _notify_new_transactions(session)
+        session.commit()
+        hub.notify()
 
-    # Após definir todos os novos saldos de cada um dos usuários, reflete as informações
-    # no banco de dados.
+    _run_with_retry(session, transfer)
+
+
+# Função para criar várias transações de um mesmo usuário de uma só vez.
+# 'items' é a lista de pares (username, valor) que vão receber os pontos.
+# 'from_user' é o usuário que está enviando os pontos.
+# 'atomic' define se o lote é tudo ou nada (True) ou se salva apenas os itens válidos.
+def add_transactions(
+    *,
+    items: list[tuple[str, int]],
+    from_user: User,
+    session: Optional[Session] = None,
+    atomic: bool = True,
+) -> list[dict]:
+    """Add many transactions from the same user in a single commit.
+
+    Returns one result per item, in the same order, with the status
+    `added`, `failed` or `skipped` (valid item of a rejected atomic batch).
+    """
+    session = session or Session(engine)
+
+    # Busca todos os usuários que vão receber os pontos em uma única query,
+    # montando um dicionário de 'username' para 'id'.
+    usernames = {username for username, _ in items}
+    user_ids = dict(
+        session.exec(
+            select(User.username, User.id).where(User.username.in_(usernames))  # type: ignore
+        ).all()
+    )
+
+    from_id, superuser = from_user.id, from_user.superuser
+
+    def transfer() -> list[dict]:
+        # Bloqueia os saldos de todos os envolvidos e lê o saldo disponível de quem
+        # envia apenas uma vez. Super usuários não possuem limite de saldo, por isso
+        # o saldo disponível é None.
+        balances = _lock_balances(session, {from_id, *user_ids.values()})  # type: ignore
+        available = None if superuser else balances[from_id]  # type: ignore
+
+        results = []
+        for username, value in items:
+            result = {"username": username, "value": value, "status": "added"}
+
+            # Apenas valores positivos podem ser transferidos, um valor negativo
+            # retiraria pontos de quem recebe e aumentaria o saldo disponível.
+            if value <= 0:
+                result.update(status="failed", detail="Value must be positive.")
+            # Usuário que vai receber os pontos não existe.
+            elif username not in user_ids:
+                result.update(status="failed", detail="User not found.")
+            # O valor acumulado do lote ultrapassa o saldo de quem está enviando.
+            elif available is not None and value > available:
+                result.update(status="failed", detail="Insufficient balance")
+            # Item válido, desconta do saldo disponível para validar os próximos.
+            elif available is not None:
+                available -= value
+
+            results.append(result)
+
+        # No modo tudo ou nada, caso algum item tenha falhado, nenhuma transação é
+        # salva e os itens válidos são marcados como ignorados.
+        if atomic and any(result["status"] == "failed" for result in results):
+            session.rollback()
+            for result in results:
+                if result["status"] == "added":
+                    result.update(status="skipped", detail="Batch rejected.")
+            return results
+
+        accepted = [result for result in results if result["status"] == "added"]
+        if not accepted:
+            session.rollback()
+            return results
+
+        # Monta as linhas das transações e agrega a variação de saldo de cada usuário.
+        now = datetime.now(timezone.utc)
+        rows = []
+        deltas: dict[int, int] = defaultdict(int)
+        for result in accepted:
+            user_id = user_ids[result["username"]]
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "from_id": from_id,
+                    "value": result["value"],
+                    "date": now,
+                }
+            )
+            deltas[user_id] += result["value"]
+            deltas[from_id] -= result["value"]  # type: ignore
+
+        # Insere todas as transações com um INSERT de múltiplas linhas e aplica os
+        # saldos e resumos agregados, confirmando tudo em um único commit.
+        session.execute(insert(Transaction), rows)
+        _apply_balance_deltas(session, deltas)
+        _apply_stats(session, rows)
+        _notify_new_transactions(session)
+        session.commit()
+        hub.notify()
+
+        return results
+
+    return _run_with_retry(session, transfer)
+
+
+# Função que recalcula os saldos de todos os usuários (ou de apenas um) a partir do
+# histórico de transações, utilizando uma única agregação no banco de dados.
+# 'username' restringe o recálculo a um único usuário.
+# 'dry_run' apenas conta as diferenças encontradas, sem corrigi-las.
+# 'batch_size' é a quantidade de linhas lidas e corrigidas por vez.
+# 'progress' é uma função opcional chamada a cada lote com o total de diferenças até ali.
+# 'report' é uma função opcional chamada com (username, armazenado, esperado) para cada
+# diferença encontrada.
+# Também é usada como task do RQ, por isso retorna apenas tipos simples.
+def rebuild_balances(
+    *,
+    username: Optional[str] = None,
+    dry_run: bool = False,
+    batch_size: int = 10_000,
+    progress: Optional[Callable[[int], None]] = None,
+    report: Optional[Callable[[str, Optional[int], int], None]] = None,
+    session: Optional[Session] = None,
+) -> int:
+    """Recompute balances from the transaction table and fix the differences.
+
+    Returns the number of balances that differ. `report` receives each
+    `(username, stored, expected)`, where `stored` is None when the balance
+    row does not exist.
+    """
+    # Sem uma sessão (por exemplo, no worker do RQ), abre uma sessão que é fechada ao
+    # final do recálculo.
+    if session is None:
+        with Session(engine) as session:
+            return rebuild_balances(
+                username=username,
+                dry_run=dry_run,
+                batch_size=batch_size,
+                progress=progress,
+                report=report,
+                session=session,
+            )
+
+    # No PostgreSQL bloqueia a escrita na tabela 'balance' até o fim do recálculo,
+    # as transferências feitas durante esse tempo esperam e aplicam a sua variação
+    # sobre o saldo já corrigido, evitando perder atualizações.
+    if not dry_run and session.get_bind().dialect.name == "postgresql":
+        session.execute(text("LOCK TABLE balance IN SHARE ROW EXCLUSIVE MODE"))
+
+    # Cada transação gera duas movimentações: uma entrada positiva para quem recebe
+    # e uma saída negativa para quem envia.
+    incomes = select(Transaction.user_id.label("user_id"), Transaction.value)  # type: ignore
+    expenses = select(
+        Transaction.from_id.label("user_id"),  # type: ignore
+        (-Transaction.value).label("value"),
+    )
+    users = select(User.id, User.username)
+
+    # Filtra apenas as movimentações e o usuário em questão, caso informado.
+    if username:
+        user_id = select(User.id).where(User.username == username).scalar_subquery()
+        incomes = incomes.where(Transaction.user_id == user_id)
+        expenses = expenses.where(Transaction.from_id == user_id)
+        users = users.where(User.username == username)
+
+    # Soma todas as movimentações agrupando por usuário (GROUP BY).
+    movements = union_all(incomes, expenses).subquery()
+    totals = (
+        select(movements.c.user_id, func.sum(movements.c.value).label("value"))
+        .group_by(movements.c.user_id)
+        .subquery()
+    )
+
+    # Compara o saldo calculado com o saldo armazenado, retornando apenas os usuários
+    # em que os valores são diferentes.
+    users = users.subquery()
+    expected = func.coalesce(totals.c.value, 0)
+    query = (
+        select(users.c.username, users.c.id, Balance.value, expected)
+        .outerjoin(Balance, Balance.user_id == users.c.id)  # type: ignore
+        .outerjoin(totals, totals.c.user_id == users.c.id)
+        .where(func.coalesce(Balance.value, 0) != expected)
+        .order_by(users.c.id)
+    )
+
+    # Lê as diferenças em lotes e corrige cada lote assim que ele é lido, sem manter
+    # todas as diferenças na memória. Os lotes são lidos em ordem de id e cada upsert
+    # altera apenas usuários já lidos, por isso não interfere nos próximos lotes.
+    found = 0
+    now = datetime.now(timezone.utc)
+    for rows in session.execute(
+        query.execution_options(yield_per=batch_size)
+    ).partitions():
+        found += len(rows)
+        if report:
+            for name, _, stored, value in rows:
+                report(name, stored, value)
+        if not dry_run:
+            # Corrige os saldos do lote com um upsert de múltiplas linhas, atribuindo
+            # o valor calculado diretamente.
+            stmt = _upsert(session, Balance).values(
+                [
+                    {"user_id": user_id, "value": value, "updated_at": now}
+                    for _, user_id, _, value in rows
+                ]
+            )
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[Balance.user_id],
+                    set_={
+                        "value": stmt.excluded.value,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                )
+            )
+        if progress:
+            progress(found)
+
+    if dry_run:
+        session.rollback()
+    else:
+        session.commit()
+
+    return found
+
+
+# Função que recalcula o resumo de transações de todos os usuários (ou de apenas um)
+# a partir do histórico, com um único 'INSERT ... SELECT' agrupado no banco de dados.
+# 'username' restringe o recálculo a um único usuário.
+# Também é usada como task do RQ, por isso retorna apenas tipos simples.
+def rebuild_stats(
+    *,
+    username: Optional[str] = None,
+    session: Optional[Session] = None,
+) -> int:
+    """Recompute the per-user transaction summary from the transaction table.
+
+    Returns the number of summaries written.
+    """
+    # Sem uma sessão (por exemplo, no worker do RQ), abre uma sessão que é fechada ao
+    # final do recálculo.
+    if session is None:
+        with Session(engine) as session:
+            return rebuild_stats(username=username, session=session)
+
+    # Cada transação gera uma entrada para quem recebe e uma saída para quem envia.
+    one, zero = literal(1), literal(0)
+    incomes = select(
+        Transaction.user_id.label("user_id"),  # type: ignore
+        one.label("received_count"),
+        Transaction.value.label("received_total"),
+        zero.label("sent_count"),
+        zero.label("sent_total"),
+        Transaction.date.label("date"),  # type: ignore
+    )
+    expenses = select(
+        Transaction.from_id.label("user_id"),  # type: ignore
+        zero.label("received_count"),
+        zero.label("received_total"),
+        one.label("sent_count"),
+        Transaction.value.label("sent_total"),
+        Transaction.date.label("date"),  # type: ignore
+    )
+    users = select(User.id)
+
+    # Filtra apenas as movimentações e o usuário em questão, caso informado.
+    if username:
+        user_id = select(User.id).where(User.username == username).scalar_subquery()
+        incomes = incomes.where(Transaction.user_id == user_id)
+        expenses = expenses.where(Transaction.from_id == user_id)
+        users = users.where(User.username == username)
+
+    # Soma as movimentações agrupando por usuário (GROUP BY).
+    movements = union_all(incomes, expenses).subquery()
+    totals = (
+        select(
+            movements.c.user_id,
+            func.sum(movements.c.received_count).label("received_count"),
+            func.sum(movements.c.received_total).label("received_total"),
+            func.sum(movements.c.sent_count).label("sent_count"),
+            func.sum(movements.c.sent_total).label("sent_total"),
+            func.min(movements.c.date).label("first_transaction_at"),
+            func.max(movements.c.date).label("last_transaction_at"),
+        )
+        .group_by(movements.c.user_id)
+        .subquery()
+    )
+
+    # Usuários sem transações também recebem um resumo zerado.
+    users = users.subquery()
+    counters = ["received_count", "received_total", "sent_count", "sent_total"]
+    fields = [*counters, "first_transaction_at", "last_transaction_at", "updated_at"]
+    summaries = (
+        select(
+            users.c.id,
+            *[func.coalesce(totals.c[name], 0) for name in counters],
+            totals.c.first_transaction_at,
+            totals.c.last_transaction_at,
+            literal(datetime.now(timezone.utc)),
+        )
+        .outerjoin(totals, totals.c.user_id == users.c.id)
+        # O SQLite exige um 'WHERE' em um 'INSERT ... SELECT' com 'ON CONFLICT'.
+        .where(true())
+    )
+
+    # Escreve todos os resumos de uma só vez, substituindo os valores existentes.
+    stmt = _upsert(session, UserStats).from_select(["user_id", *fields], summaries)
+    result = session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[UserStats.user_id],
+            set_={name: stmt.excluded[name] for name in fields},
+        )
+    )
     session.commit()
+
+    return result.rowcount
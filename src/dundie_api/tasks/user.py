@@ -4,7 +4,8 @@ from time import sleep
 
 from sqlmodel import Session, select
 
-from dundie_api.auth import create_access_token
+from dundie_api.auth import create_access_token, token_claims
+from dundie_api.cache import password_version
 from dundie_api.config import settings
 from dundie_api.db import engine
 from dundie_api.models.user import User
@@ -88,10 +89,11 @@ def try_to_send_pwd_reset_email(email):
         expire = settings.security.RESET_TOKEN_EXPIRE_MINUTES  # type: ignore
 
         # Criando um token para alterar a senha do usuário, definindo o seu
-        # 'username' para identificar o token, o tempo de expiração dele 'expires_delta'
+        # 'username' para identificar o token, a versão da senha (o token deixa de
+        # valer após a senha ser alterada), o tempo de expiração dele 'expires_delta'
         # e o escopo 'scope'.
         pwd_reset_token = create_access_token(
-            data={"sub": user.username},
+            data=token_claims(user.username, password_version(user.password)),
             expires_delta=timedelta(minutes=expire),  # type: ignore
             scope="pwd_reset",
         )
@@ -0,0 +1,120 @@
+"""Per-request timing of the database, authentication and serialization"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import replace
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter
+from typing import Optional
+
+from fastapi.routing import APIRoute
+
+
+# Classe que acumula as métricas de uma requisição: quantidade de comandos SQL e o tempo
+# gasto no banco de dados, na autenticação e na serialização da resposta.
+class RequestMetrics:
+    """Statements and timings accumulated during one request."""
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.statements = 0
+        self.timings = {"db": 0.0, "auth": 0.0, "serialize": 0.0}
+        # Indica se o usuário autenticado na requisição é um superusuário.
+        self.superuser = False
+        # Momento em que a função da rota terminou, antes da serialização.
+        self.endpoint_end: Optional[float] = None
+
+    # Nome da rota que está sendo executada, por exemplo 'GET /user/{username}/'.
+    @property
+    def route_name(self) -> str:
+        route = self.scope.get("route")
+        path = getattr(route, "path", None) or self.scope.get("path", "")
+        return f"{self.scope.get('method', 'WS')} {path}"
+
+    def add(self, name: str, elapsed: float) -> None:
+        self.timings[name] += elapsed
+
+    # Monta o valor do header 'Server-Timing', com as durações em milissegundos.
+    def server_timing(self) -> str:
+        entries = []
+        for name, elapsed in self.timings.items():
+            entry = f"{name};dur={elapsed * 1000:.2f}"
+            if name == "db":
+                entry += f';desc="{self.statements} statements"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+# Métricas da requisição atual, definidas pelo middleware de instrumentação. As threads
+# usadas pelas dependências síncronas recebem uma cópia do contexto, por isso também
+# acumulam as métricas na mesma instância.
+request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+# Gerenciador de contexto que soma o tempo do bloco à métrica 'name' da requisição atual.
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    metrics = request_metrics.get()
+    if metrics is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, perf_counter() - start)
+
+
+# Função que envolve a função da rota para registrar o momento em que ela termina,
+# mantendo-a assíncrona ou síncrona, já que o FastAPI decide como executá-la por isso.
+def _mark_endpoint_end(call):
+    def mark():
+        if (metrics := request_metrics.get()) is not None:
+            metrics.endpoint_end = perf_counter()
+
+    if iscoroutinefunction(call):
+
+        @wraps(call)
+        async def async_endpoint(*args, **kwargs):
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                mark()
+
+        return async_endpoint
+
+    @wraps(call)
+    def endpoint(*args, **kwargs):
+        try:
+            return call(*args, **kwargs)
+        finally:
+            mark()
+
+    return endpoint
+
+
+# Classe de rota que mede o tempo de serialização da resposta, ou seja, o tempo entre o
+# fim da função da rota e a resposta pronta (validação do 'response_model' e JSON).
+class InstrumentedRoute(APIRoute):
+    """APIRoute that records the response serialization time."""
+
+    def get_route_handler(self):
+        dependant = self.dependant
+        self.dependant = replace(dependant, call=_mark_endpoint_end(dependant.call))
+        try:
+            handler = super().get_route_handler()
+        finally:
+            self.dependant = dependant
+
+        async def instrumented_handler(request):
+            response = await handler(request)
+            metrics = request_metrics.get()
+            if metrics is not None and metrics.endpoint_end is not None:
+                metrics.add("serialize", perf_counter() - metrics.endpoint_end)
+            return response
+
+        return instrumented_handler
@@ -2,10 +2,12 @@ import os
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
 from dundie_api.main import app
 from dundie_api.cli import create_user
+from dundie_api.db import async_engine, engine
 
 # Definindo a URI do banco de dados de testes no ambiente, para garantir
 # que o banco correto vai ser utilizado.
@@ -82,3 +84,21 @@ def api_client_user2():
 @pytest.fixture(scope="function")
 def api_client_user3():
     return create_api_client_authenticated("user3")
+
+
+# Fixture que registra todos os comandos SQL executados no banco de dados enquanto
+# o teste está sendo executado, permitindo contar quantas queries uma rota realiza.
+@pytest.fixture(scope="function")
+def sql_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Registra os comandos das engines síncrona e assíncrona.
+    engines = [engine, async_engine.sync_engine]
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    yield statements
+    for target in engines:
+        event.remove(target, "before_cursor_execute", record)
@@ -1,4 +1,37 @@
+import asyncio
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
 import pytest
+from argon2 import PasswordHasher
+from fastapi import WebSocketDisconnect
+from sqlmodel import Session, delete, func, select
+
+from dundie_api.auth import create_access_token, token_claims
+from dundie_api.broadcast import BroadcastHub
+from dundie_api.cache import password_version, user_cache
+from dundie_api.cli import create_user
+from dundie_api.config import settings
+from dundie_api.db import engine
+from dundie_api.models import Balance, Transaction, User, UserStats
+from dundie_api.pagination import encode_cursor
+from dundie_api.security import check_needs_rehash, verify_password
+from dundie_api.routes.transaction import (
+    _Backlog,
+    _subscription_filters,
+    _transaction_events,
+)
+from dundie_api.tasks.transaction import (
+    TransactionError,
+    add_transaction,
+    compute_balance,
+    get_lock_stats,
+    rebuild_balances,
+    rebuild_stats,
+)
 
 # Dicionários para usar de apoio para validar as respostas.
 USER_RESPONSE_KEYS = {"name", "username", "dept", "avatar", "bio", "currency"}
@@ -144,3 +177,897 @@ def test_admin_can_list_all_transactions_ws(api_client_admin):
         for i in range(4):
             data = ws.receive_json()
             assert data.keys() == {"to", "from", "value"}
+
+
+# Teste para validar que o saldo incremental bate com o recálculo completo do histórico.
+@pytest.mark.order(7)
+def test_add_transaction_verify_mode(api_client_admin):
+    """Incremental balance matches a full recompute in verify mode"""
+    with Session(engine) as session:
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        user3 = session.exec(select(User).where(User.username == "user3")).one()
+        add_transaction(
+            user=user3, from_user=admin, value=10, session=session, verify=True
+        )
+        assert compute_balance(session, user3.id) == user3.balance == 510
+        assert compute_balance(session, admin.id) == admin.balance
+
+
+# Teste para validar que um lote inválido no modo tudo ou nada não salva nenhuma transação.
+@pytest.mark.order(8)
+def test_bulk_transaction_atomic_rejects_whole_batch(api_client_user2):
+    """An atomic batch with an invalid item adds nothing"""
+    response = api_client_user2.post(
+        "/transaction/bulk",
+        json={
+            "items": [
+                {"username": "user3", "value": 5},
+                {"username": "nobody", "value": 5},
+                {"username": "user3", "value": 0},
+                {"username": "user3", "value": -5},
+            ]
+        },
+    )
+    assert response.status_code == 400
+    results = response.json()["detail"]["results"]
+    assert [r["status"] for r in results] == ["skipped", "failed", "failed", "failed"]
+
+    user2 = api_client_user2.get("/user/user2/?show_balance=true").json()
+    assert user2["balance"] == 520
+
+
+# Teste para validar que o modo de melhor esforço salva os itens válidos e valida o saldo.
+@pytest.mark.order(8)
+def test_bulk_transaction_best_effort(api_client_user2, api_client_admin):
+    """A best effort batch adds valid items and reports the failed ones"""
+    response = api_client_user2.post(
+        "/transaction/bulk",
+        json={
+            "mode": "best_effort",
+            "items": [
+                {"username": "user1", "value": -10},
+                {"username": "user3", "value": 500},
+                {"username": "user1", "value": 30},
+                {"username": "nobody", "value": 1},
+            ],
+        },
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert (data["added"], data["failed"]) == (1, 3)
+    assert [r["status"] for r in data["results"]] == [
+        "failed",
+        "added",
+        "failed",
+        "failed",
+    ]
+    assert data["results"][0]["detail"] == "Value must be positive."
+
+    user2 = api_client_admin.get("/user/user2/?show_balance=true").json()
+    user3 = api_client_admin.get("/user/user3/?show_balance=true").json()
+    assert user2["balance"] == 20
+    assert user3["balance"] == 1010
+
+
+# Teste de estresse que dispara milhares de transferências em paralelo a partir do mesmo
+# usuário, garantindo que o saldo nunca fica negativo e que nenhuma atualização se perde.
+@pytest.mark.order(9)
+def test_concurrent_transfers_from_hot_sender():
+    """Parallel transfers never overdraft the sender nor lose updates"""
+    sender = create_user(
+        name="hot-sender", email="hot-sender@dm.com", password="x", dept="sales"
+    )
+    receiver = create_user(
+        name="hot-receiver", email="hot-receiver@dm.com", password="x", dept="sales"
+    )
+
+    with Session(engine) as session:
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        add_transaction(user=sender, from_user=admin, value=500, session=session)
+
+    # Cada transferência usa a sua própria sessão, como em requisições diferentes.
+    def transfer(_):
+        with Session(engine) as session:
+            try:
+                add_transaction(
+                    user=receiver, from_user=sender, value=1, session=session
+                )
+                return True
+            except TransactionError:
+                return False
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(transfer, range(2000)))
+
+    assert results.count(True) == 500
+
+    with Session(engine) as session:
+        sent = session.scalar(
+            select(func.count()).where(Transaction.from_id == sender.id)
+        )
+        assert sent == 500
+        assert session.get(User, sender.id).balance == 0
+        assert session.get(User, receiver.id).balance == 500
+        assert compute_balance(session, sender.id) == 0
+        assert compute_balance(session, receiver.id) == 500
+
+    assert get_lock_stats()["lock_acquisitions"] >= 2000
+
+
+# Teste para validar que o recálculo dos saldos encontra e corrige saldos incorretos.
+@pytest.mark.order(10)
+def test_rebuild_balances_fixes_corrupted_balance():
+    """rebuild_balances finds and fixes a corrupted balance"""
+
+    # Executa o recálculo, retornando as diferenças reportadas a cada linha lida.
+    def differences(**kwargs):
+        found, progress = [], []
+        count = rebuild_balances(
+            report=lambda *row: found.append(row),
+            progress=progress.append,
+            batch_size=1,
+            **kwargs,
+        )
+        assert count == len(found) == (progress[-1] if progress else 0)
+        return found
+
+    assert differences(dry_run=True) == []
+
+    with Session(engine) as session:
+        user3 = session.exec(select(User).where(User.username == "user3")).one()
+        balance = session.get(Balance, user3.id)
+        expected = balance.value
+        balance.value = 0
+        session.add(balance)
+        session.commit()
+
+    assert differences(dry_run=True) == [("user3", 0, expected)]
+    assert differences(username="user2", dry_run=True) == []
+    assert differences(username="user3") == [("user3", 0, expected)]
+    assert differences(dry_run=True) == []
+
+    # Vários saldos incorretos são corrigidos lote a lote, durante a leitura.
+    with Session(engine) as session:
+        corrupted = session.exec(
+            select(Balance).join(User).where(User.username.in_(["user1", "user2"]))
+        ).all()
+        for balance in corrupted:
+            balance.value += 1
+            session.add(balance)
+        session.commit()
+
+    assert [row[0] for row in differences()] == ["user1", "user2"]
+    assert differences(dry_run=True) == []
+
+
+# Teste para validar que a paginação por cursor percorre todas as transações visíveis,
+# sem repetir registros, em qualquer uma das ordenações suportadas.
+@pytest.mark.order(11)
+@pytest.mark.parametrize("order_by", ["id", "date", "-date", "value", "-value"])
+def test_list_transactions_by_cursor(api_client_user3, order_by):
+    """Cursor pagination walks all visible transactions in order"""
+    expected = api_client_user3.get(
+        "/transaction/", params={"size": 100, "order_by": order_by}
+    ).json()["items"]
+
+    items, cursor = [], None
+    while True:
+        params = {"pagination": "cursor", "size": 2, "order_by": order_by}
+        if cursor:
+            params["cursor"] = cursor
+        page = api_client_user3.get("/transaction/", params=params).json()
+        assert "total" not in page
+        items.extend(page["items"])
+        if not (cursor := page["next_cursor"]):
+            break
+
+    assert len(items) == len(expected) > 2
+    assert sorted(t["id"] for t in items) == sorted(t["id"] for t in expected)
+    if order_by == "id":
+        assert [t["id"] for t in items] == sorted(t["id"] for t in items)
+
+
+# Teste para validar que um cursor inválido ou de outra ordenação é rejeitado.
+@pytest.mark.order(11)
+def test_list_transactions_invalid_cursor(api_client_admin):
+    """Invalid cursors are rejected with 400"""
+    page = api_client_admin.get(
+        "/transaction/", params={"pagination": "cursor", "size": 1}
+    ).json()
+    response = api_client_admin.get(
+        "/transaction/", params={"cursor": page["next_cursor"], "order_by": "-date"}
+    )
+    assert response.status_code == 400
+    response = api_client_admin.get("/transaction/", params={"cursor": "garbage"})
+    assert response.status_code == 400
+
+
+# Teste para validar que cursores bem formados, mas com valores de tipos inválidos,
+# são rejeitados com o status 400.
+@pytest.mark.order(11)
+@pytest.mark.parametrize(
+    "order_by, values",
+    [
+        ("id", [{"x": 1}]),
+        ("id", ["abc"]),
+        ("id", [1.5]),
+        ("value", [None, 1]),
+        ("value", [10, "1"]),
+        ("-date", ["2024-01-01T00:00:00", [1]]),
+        ("-date", [1, 1]),
+    ],
+)
+def test_list_transactions_rejects_invalid_cursor_values(
+    api_client_admin, order_by, values
+):
+    """Cursor values of the wrong type are rejected with 400"""
+    cursor = encode_cursor(order_by, values)
+    response = api_client_admin.get(
+        "/transaction/",
+        params={"pagination": "cursor", "order_by": order_by, "cursor": cursor},
+    )
+    assert response.status_code == 400
+
+
+# Teste para validar que apenas as chaves de ordenação permitidas são aceitas.
+@pytest.mark.order(11)
+@pytest.mark.parametrize("order_by", ["password", "user_id", "date desc; --", "--id"])
+def test_list_transactions_rejects_unknown_order_by(api_client_admin, order_by):
+    """order_by outside the whitelist is rejected with 400"""
+    response = api_client_admin.get("/transaction/", params={"order_by": order_by})
+    assert response.status_code == 400
+
+
+# Teste para validar a ordenação por valor, desempatada pelo id.
+@pytest.mark.order(11)
+def test_list_transactions_order_by_value(api_client_admin):
+    """order_by=-value sorts by value and then by id"""
+    items = api_client_admin.get(
+        "/transaction/", params={"order_by": "-value", "size": 100}
+    ).json()["items"]
+    keys = [(t["value"], t["id"]) for t in items]
+    assert keys == sorted(keys, reverse=True)
+
+
+# Teste para validar que a listagem de transações executa uma quantidade constante de
+# queries, independente do tamanho da página (sem N+1 ao carregar os usuários).
+@pytest.mark.order(12)
+@pytest.mark.parametrize("pagination", ["page", "cursor"])
+def test_list_transactions_query_count_is_constant(
+    api_client_admin, sql_statements, pagination
+):
+    """Listing transactions issues the same number of queries for any page size"""
+    counts = []
+    for size in (5, 50):
+        sql_statements.clear()
+        response = api_client_admin.get(
+            "/transaction/", params={"size": size, "pagination": pagination}
+        )
+        assert len(response.json()["items"]) == size
+        counts.append(len(sql_statements))
+
+    assert counts[0] == counts[1] <= 3
+
+
+# Teste para validar a paginação da listagem de usuários por offset e por cursor.
+@pytest.mark.order(13)
+def test_list_users_offset_and_cursor(api_client_admin):
+    """Walking /user/ with limit/cursor returns the same users as offset pages"""
+    everyone = api_client_admin.get("/user/", params={"limit": 1000}).json()
+    assert (
+        "X-Next-Cursor"
+        not in api_client_admin.get("/user/", params={"limit": 1000}).headers
+    )
+
+    walked, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = api_client_admin.get("/user/", params=params)
+        assert response.status_code == 200
+        walked.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert walked == everyone
+    offset_page = api_client_admin.get("/user/", params={"offset": 2, "limit": 2})
+    assert offset_page.json() == everyone[2:4]
+
+
+# Teste para validar que cursores bem formados, mas com valores inválidos, são
+# rejeitados com o status 400.
+@pytest.mark.order(13)
+@pytest.mark.parametrize("values", [[], [1, 2], [None], [{"a": 1}], ["1"], [True]])
+def test_list_users_rejects_invalid_cursor_values(api_client_admin, values):
+    """Cursors not holding exactly one integer id are rejected with 400"""
+    cursor = encode_cursor("id", values)
+    response = api_client_admin.get("/user/", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor."
+
+
+# Teste para validar que o saldo é incluído na listagem apenas para superusuários e
+# que a senha e o email nunca são retornados.
+@pytest.mark.order(13)
+def test_list_users_projection(api_client_admin, api_client_user2):
+    """Balances are joined for superusers only and private fields never leak"""
+    admin_view = api_client_admin.get("/user/", params={"show_balance": True}).json()
+    assert all(isinstance(user["balance"], int) for user in admin_view)
+
+    user_view = api_client_user2.get("/user/", params={"show_balance": True}).json()
+    assert all("balance" not in user for user in user_view)
+    assert all("password" not in user and "email" not in user for user in user_view)
+
+
+# Teste para validar que uma página inalterada retorna 304 quando o ETag é enviado.
+@pytest.mark.order(13)
+def test_list_users_etag(api_client_admin):
+    """If-None-Match with the current ETag returns 304 without a body"""
+    response = api_client_admin.get("/user/")
+    etag = response.headers["ETag"]
+
+    cached = api_client_admin.get("/user/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    other_page = api_client_admin.get(
+        "/user/", params={"limit": 1}, headers={"If-None-Match": etag}
+    )
+    assert other_page.status_code == 200
+    assert other_page.headers["ETag"] != etag
+
+    # Listas sem espaço após a vírgula, ETags fracos e '*' também correspondem.
+    for header in (f'"other",{etag}', f'"other", W/{etag}', "*"):
+        cached = api_client_admin.get("/user/", headers={"If-None-Match": header})
+        assert cached.status_code == 304
+
+
+# Teste para validar que o resumo mantido a cada transação é igual ao resumo calculado
+# a partir do histórico e que o recálculo corrige um resumo incorreto.
+@pytest.mark.order(14)
+def test_user_stats_match_history(api_client_user3):
+    """The incremental summary matches the history and rebuild_stats fixes it"""
+    stats = api_client_user3.get("/user/user3/stats/").json()
+
+    with Session(engine) as session:
+        user3 = session.exec(select(User).where(User.username == "user3")).one()
+        for column, kind in (
+            (Transaction.user_id, "received"),
+            (Transaction.from_id, "sent"),
+        ):
+            count, total = session.exec(
+                select(
+                    func.count(), func.coalesce(func.sum(Transaction.value), 0)
+                ).where(column == user3.id)
+            ).one()
+            assert (stats[f"{kind}_count"], stats[f"{kind}_total"]) == (count, total)
+
+        summary = session.get(UserStats, user3.id)
+        summary.received_total = -1
+        session.add(summary)
+        session.commit()
+
+    assert api_client_user3.get("/user/user3/stats/").json() != stats
+    assert rebuild_stats(username="user3") == 1
+    assert api_client_user3.get("/user/user3/stats/").json() == stats
+    assert rebuild_stats() >= 4
+
+
+# Teste para validar que apenas o próprio usuário ou um superusuário vê o resumo.
+@pytest.mark.order(14)
+def test_user_stats_permissions(api_client_admin, api_client_user2):
+    """Regular users only see their own stats"""
+    assert api_client_user2.get("/user/user3/stats/").status_code == 403
+    assert api_client_user2.get("/user/user2/stats/").status_code == 200
+    assert api_client_admin.get("/user/user3/stats/").status_code == 200
+    assert api_client_admin.get("/user/nobody/stats/").status_code == 404
+
+
+# Teste para validar que uma nova transação é transmitida pelo hub para todos os
+# clientes conectados ao websocket, após o envio do histórico.
+@pytest.mark.order(15)
+def test_ws_broadcasts_new_transaction_to_every_subscriber(api_client_admin):
+    """Every connected socket receives a transaction created after the history"""
+    with Session(engine) as session:
+        history = session.scalar(select(func.count()).select_from(Transaction))
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        user2 = session.exec(select(User).where(User.username == "user2")).one()
+
+    # O cliente é usado como gerenciador de contexto para que os dois websockets
+    # compartilhem o mesmo event loop, assim como em um servidor real.
+    with (
+        api_client_admin,
+        api_client_admin.websocket_connect("/transaction/ws") as first,
+        api_client_admin.websocket_connect("/transaction/ws") as second,
+    ):
+        for ws in (first, second):
+            for _ in range(history):
+                ws.receive_json()
+
+        add_transaction(user=user2, from_user=admin, value=7)
+
+        for ws in (first, second):
+            assert ws.receive_json() == {"to": "user2", "from": "Admin", "value": 7}
+
+
+# Teste para validar a retomada do websocket a partir de um id, recebendo o histórico
+# restante em lotes limitados e depois as novas transações no mesmo formato.
+@pytest.mark.order(16)
+def test_ws_resumes_from_since_id_in_batches(api_client_admin, monkeypatch):
+    """since_id replays only newer transactions in size-capped frames"""
+    monkeypatch.setattr(settings.broadcast, "frame_size", 2)
+    with Session(engine) as session:
+        ids = session.exec(select(Transaction.id).order_by(Transaction.id)).all()
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        user3 = session.exec(select(User).where(User.username == "user3")).one()
+
+    since_id = ids[-5]
+    with (
+        api_client_admin,
+        api_client_admin.websocket_connect(
+            f"/transaction/ws?since_id={since_id}"
+        ) as ws,
+    ):
+        frames = [ws.receive_json() for _ in range(2)]
+        assert [len(frame["items"]) for frame in frames] == [2, 2]
+        assert [item["id"] for frame in frames for item in frame["items"]] == ids[-4:]
+        assert frames[-1]["last_id"] == ids[-1]
+
+        add_transaction(user=user3, from_user=admin, value=3)
+
+        frame = ws.receive_json()
+        assert frame["last_id"] > ids[-1]
+        assert frame["items"] == [
+            {"id": frame["last_id"], "to": "user3", "from": "Admin", "value": 3}
+        ]
+
+
+# Teste para validar que o websocket exige um token válido.
+@pytest.mark.order(17)
+def test_ws_requires_authentication(api_client):
+    """Connections without a valid JWT are refused with 1008"""
+    for url in ("/transaction/ws", "/transaction/ws?token=invalid"):
+        with pytest.raises(WebSocketDisconnect) as error:
+            with api_client.websocket_connect(url):
+                pass
+        assert error.value.code == 1008
+
+
+# Teste para validar que usuários comuns recebem apenas as suas próprias transferências,
+# autenticando pelo parâmetro 'token'.
+@pytest.mark.order(17)
+def test_ws_regular_user_only_sees_own_transfers(api_client):
+    """A non-superuser subscription only contains their own transfers"""
+    with Session(engine) as session:
+        user2 = session.exec(select(User).where(User.username == "user2")).one()
+        expected = session.scalar(
+            select(func.count()).where(
+                (Transaction.user_id == user2.id) | (Transaction.from_id == user2.id)
+            )
+        )
+
+    claims = token_claims("user2", password_version(user2.password))
+    token = create_access_token(data={**claims, "fresh": True})
+    received = []
+    with api_client.websocket_connect(
+        f"/transaction/ws?since_id=0&token={token}"
+    ) as ws:
+        while len(received) < expected:
+            received.extend(ws.receive_json()["items"])
+
+    assert len(received) == expected
+    assert all("user2" in (item["to"], item["from"]) for item in received)
+
+
+# Teste para validar que os filtros da inscrição são aplicados nas novas transações.
+@pytest.mark.order(17)
+def test_ws_filters_live_transactions(api_client_admin):
+    """Only new transactions matching user and min_value are pushed"""
+    with Session(engine) as session:
+        last = session.scalar(select(func.max(Transaction.id)))
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        user2 = session.exec(select(User).where(User.username == "user2")).one()
+        user3 = session.exec(select(User).where(User.username == "user3")).one()
+
+    url = f"/transaction/ws?since_id={last}&user=user3&min_value=5"
+    with api_client_admin, api_client_admin.websocket_connect(url) as ws:
+        add_transaction(user=user2, from_user=admin, value=9)
+        add_transaction(user=user3, from_user=admin, value=2)
+        add_transaction(user=user3, from_user=admin, value=9)
+
+        frame = ws.receive_json()
+        assert [(item["to"], item["value"]) for item in frame["items"]] == [
+            ("user3", 9)
+        ]
+
+
+# Teste para validar que o SSE exige autenticação, assim como a listagem.
+@pytest.mark.order(18)
+def test_transaction_stream_requires_authentication(api_client):
+    """GET /transaction/stream without a token returns 401"""
+    assert api_client.get("/transaction/stream").status_code == 401
+
+
+# Teste para validar que o SSE retoma a partir do 'Last-Event-ID', envia as novas
+# transações filtradas e comentários de 'heartbeat' quando não há transações.
+@pytest.mark.order(18)
+def test_transaction_events_resume_and_heartbeat(monkeypatch):
+    """Events resume after the last id, follow the filters and send heartbeats"""
+    monkeypatch.setattr(settings.broadcast, "heartbeat_interval", 0.1)
+    with Session(engine) as session:
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        user3 = session.exec(select(User).where(User.username == "user3")).one()
+        ids = session.exec(
+            select(Transaction.id)
+            .where(Transaction.user_id == user3.id)
+            .order_by(Transaction.id)
+        ).all()
+
+    filters = _subscription_filters(admin, user="user3")
+
+    async def scenario():
+        events = _transaction_events(filters, ids[-3])
+        backlog = await anext(events)
+        await asyncio.to_thread(add_transaction, user=user3, from_user=admin, value=4)
+        live = await anext(events)
+        heartbeat = await anext(events)
+        await events.aclose()
+        return backlog, live, heartbeat
+
+    backlog, live, heartbeat = asyncio.run(scenario())
+
+    assert re.findall(r"^id: (\d+)$", backlog, re.MULTILINE) == [
+        str(id) for id in ids[-2:]
+    ]
+    data = json.loads(re.search(r"^data: (.*)$", live, re.MULTILINE).group(1))
+    assert data["id"] > ids[-1]
+    assert (data["user"], data["from_user"], data["value"]) == ("user3", "admin", 4)
+    assert heartbeat == ": heartbeat\n\n"
+
+
+# Teste para validar que, quando o cliente se desconecta durante a leitura de um lote
+# do histórico, o gerador só é fechado após a leitura em andamento terminar.
+@pytest.mark.order(18)
+def test_backlog_close_waits_for_running_batch():
+    """Closing the backlog after a cancelled read waits for the running batch"""
+    started, release = threading.Event(), threading.Event()
+
+    def batches():
+        started.set()
+        release.wait(5)
+        yield [{"id": 1}]
+        yield [{"id": 2}]
+
+    async def scenario():
+        backlog = _Backlog(batches())
+        read = asyncio.create_task(backlog.next())
+        await asyncio.to_thread(started.wait, 5)
+        read.cancel()
+        closing = asyncio.create_task(backlog.close())
+        await asyncio.sleep(0.1)
+        waiting = not closing.done()
+        release.set()
+        await closing
+        return waiting, read.cancelled()
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+# Teste para validar que o feed de alterações retorna as transações após o 'since_id'
+# em ordem de id, respeitando o limite e a visibilidade do usuário.
+@pytest.mark.order(19)
+def test_transaction_changes_returns_newer_transactions(api_client_user2):
+    """Changes are returned in id order after since_id with next_since_id"""
+    with Session(engine) as session:
+        user2 = session.exec(select(User).where(User.username == "user2")).one()
+        ids = session.exec(
+            select(Transaction.id)
+            .where(
+                (Transaction.user_id == user2.id) | (Transaction.from_id == user2.id)
+            )
+            .order_by(Transaction.id)
+        ).all()
+
+    response = api_client_user2.get(
+        "/transaction/changes", params={"since_id": ids[-4], "limit": 2}
+    )
+    assert response.status_code == 200
+    changes = response.json()
+    assert [item["id"] for item in changes["items"]] == ids[-3:-1]
+    assert changes["next_since_id"] == ids[-2]
+
+
+# Teste para validar que, sem novas transações, a requisição aguarda até o 'timeout'.
+@pytest.mark.order(19)
+def test_transaction_changes_times_out_without_new_data(api_client_admin):
+    """An empty long-poll returns after the timeout with the same since_id"""
+    with Session(engine) as session:
+        last = session.scalar(select(func.max(Transaction.id)))
+
+    start = perf_counter()
+    changes = api_client_admin.get(
+        "/transaction/changes", params={"since_id": last, "timeout": 0.3}
+    ).json()
+    assert perf_counter() - start >= 0.3
+    assert changes == {"items": [], "next_since_id": last}
+
+
+# Teste para validar que a requisição em espera retorna assim que uma nova transação
+# é criada, sem aguardar o 'timeout'.
+@pytest.mark.order(19)
+def test_transaction_changes_wakes_up_on_new_transaction(api_client_admin):
+    """A waiting long-poll returns the new transaction as soon as it is created"""
+    with Session(engine) as session:
+        last = session.scalar(select(func.max(Transaction.id)))
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        user2 = session.exec(select(User).where(User.username == "user2")).one()
+
+    with ThreadPoolExecutor() as executor:
+        start = perf_counter()
+        future = executor.submit(
+            api_client_admin.get,
+            "/transaction/changes",
+            params={"since_id": last, "timeout": 30},
+        )
+        sleep(0.5)
+        add_transaction(user=user2, from_user=admin, value=6)
+        changes = future.result().json()
+
+    assert perf_counter() - start < 10
+    assert [(item["user"], item["value"]) for item in changes["items"]] == [
+        ("user2", 6)
+    ]
+    assert changes["next_since_id"] == changes["items"][0]["id"]
+
+
+# Função que confirma, com o id informado, uma transferência do admin para ele mesmo,
+# simulando transferências simultâneas confirmadas fora da ordem dos ids. Transferências
+# para si mesmo não alteram o saldo.
+def _commit_transaction(transaction_id: int) -> None:
+    with Session(engine) as session:
+        admin = session.exec(select(User).where(User.username == "admin")).one()
+        session.add(
+            Transaction(id=transaction_id, user_id=admin.id, from_id=admin.id, value=1)
+        )
+        session.commit()
+
+
+# Remove as transações criadas com ids explícitos, que não avançam a sequência do
+# PostgreSQL.
+def _delete_transactions(*ids: int) -> None:
+    with Session(engine) as session:
+        session.exec(delete(Transaction).where(Transaction.id.in_(ids)))  # type: ignore
+        session.commit()
+
+
+# Teste para validar que uma transação com id menor, confirmada após outra com id maior,
+# é entregue pelo hub, e que as transações são entregues em ordem de id.
+@pytest.mark.order(19)
+def test_hub_delivers_transactions_committed_out_of_id_order():
+    """A lower id committed after a higher one is still delivered, in id order"""
+    with Session(engine) as session:
+        last = session.scalar(select(func.max(Transaction.id)))
+
+    async def scenario():
+        broadcast = BroadcastHub()
+        subscription = await broadcast.subscribe()
+        await asyncio.to_thread(_commit_transaction, last + 2)
+        broadcast.notify()
+        await asyncio.sleep(0.3)
+        held = subscription.queue.empty()
+        await asyncio.to_thread(_commit_transaction, last + 1)
+        broadcast.notify()
+        ids = [(await asyncio.wait_for(subscription.get(), 5))["id"] for _ in "ab"]
+        broadcast.unsubscribe(subscription)
+        return held, ids, broadcast.settled_id
+
+    try:
+        assert asyncio.run(scenario()) == (True, [last + 1, last + 2], last + 2)
+    finally:
+        _delete_transactions(last + 1, last + 2)
+
+
+# Teste para validar que o feed de alterações não avança o 'next_since_id' além de uma
+# transação ainda não confirmada, que é retornada assim que for confirmada.
+@pytest.mark.order(19)
+def test_transaction_changes_do_not_skip_late_commits(api_client_admin):
+    """next_since_id never moves past a lower id that commits later"""
+    with Session(engine) as session:
+        last = session.scalar(select(func.max(Transaction.id)))
+
+    try:
+        _commit_transaction(last + 2)
+        changes = api_client_admin.get(
+            "/transaction/changes", params={"since_id": last, "timeout": 0}
+        ).json()
+        assert changes == {"items": [], "next_since_id": last}
+
+        _commit_transaction(last + 1)
+        changes = api_client_admin.get(
+            "/transaction/changes", params={"since_id": last, "timeout": 0}
+        ).json()
+        assert [item["id"] for item in changes["items"]] == [last + 1, last + 2]
+        assert changes["next_since_id"] == last + 2
+    finally:
+        _delete_transactions(last + 1, last + 2)
+
+
+# Teste para validar que a autenticação é realizada uma única vez por requisição, mesmo
+# com várias dependências de autenticação ('AuthenticatedUser' e 'ShowBalanceField').
+@pytest.mark.order(20)
+def test_authenticated_user_is_loaded_once_per_request(
+    api_client_user1, sql_statements
+):
+    """GET /user/{username}/?show_balance=true loads the authenticated user once"""
+    user_cache.clear()
+
+    def user_queries():
+        return [
+            statement
+            for statement in sql_statements
+            if re.search(r'^FROM "?user"?\b', statement, re.MULTILINE)
+        ]
+
+    response = api_client_user1.get("/user/user1/", params={"show_balance": True})
+    assert response.status_code == 200
+    assert "balance" in response.json()
+
+    # Uma query para autenticar o usuário e outra da própria rota.
+    assert len(user_queries()) == 2, user_queries()
+
+    # Na próxima requisição o usuário autenticado vem do cache.
+    sql_statements.clear()
+    response = api_client_user1.get("/user/user1/", params={"show_balance": True})
+    assert response.status_code == 200
+    assert len(user_queries()) == 1, user_queries()
+
+
+@pytest.mark.order(21)
+def test_user_cache_is_invalidated_on_changes(api_client, api_client_user1):
+    """Profile and password changes invalidate the cached user"""
+    user_cache.clear()
+    assert api_client_user1.get("/user/user1/").status_code == 200
+    assert user_cache.get("user1") is not None
+
+    response = api_client_user1.patch("/user/user1/", json={"bio": "cached"})
+    assert response.status_code == 200
+    assert user_cache.get("user1") is None
+
+    assert api_client_user1.get("/user/user1/").status_code == 200
+    version = user_cache.get("user1").password_version
+    response = api_client_user1.post(
+        "/user/user1/password/",
+        json={"password": "user1", "password_confirm": "user1"},
+    )
+    assert response.status_code == 200
+    assert user_cache.get("user1") is None
+
+    # A nova senha gera uma nova versão da identidade armazenada e o token emitido
+    # antes da alteração deixa de ser aceito.
+    assert api_client_user1.get("/user/user1/").status_code == 401
+    assert user_cache.get("user1").password_version != version
+
+    # Os tokens emitidos após a alteração são aceitos, inclusive os renovados.
+    tokens = api_client.post(
+        "/token", data={"username": "user1", "password": "user1"}
+    ).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert api_client.get("/user/user1/", headers=headers).status_code == 200
+    response = api_client.post(
+        "/refresh_token", json={"refresh_token": tokens["refresh_token"]}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert api_client.get("/user/user1/", headers=headers).status_code == 200
+
+
+@pytest.mark.order(22)
+def test_login_rehashes_outdated_password(api_client):
+    """Logging in rehashes passwords created with older Argon2 parameters"""
+    weak = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
+    with Session(engine) as session:
+        user = User(
+            name="Rehash",
+            username="rehash",
+            email="rehash@dm.com",
+            dept="sales",
+            currency="USD",
+            password=weak.hash("rehash"),
+        )
+        session.add(user)
+        session.commit()
+
+    response = api_client.post(
+        "/token", data={"username": "rehash", "password": "rehash"}
+    )
+    assert response.status_code == 200
+
+    with Session(engine) as session:
+        stored = session.exec(select(User).where(User.username == "rehash")).one()
+    assert not check_needs_rehash(stored.password)
+    assert verify_password("rehash", stored.password)
+
+    # Um novo login com o hash já atualizado não altera a senha armazenada.
+    response = api_client.post(
+        "/token", data={"username": "rehash", "password": "rehash"}
+    )
+    assert response.status_code == 200
+    with Session(engine) as session:
+        assert session.get(User, stored.id).password == stored.password
+
+
+@pytest.mark.order(23)
+def test_pool_status_is_superuser_only(api_client_admin, api_client_user2):
+    """GET /admin/pool reports the pool statistics to superusers only"""
+    assert api_client_user2.get("/admin/pool").status_code == 403
+
+    response = api_client_admin.get("/admin/pool")
+    assert response.status_code == 200
+    status = response.json()["sync"]
+    assert status["pool"] == "TimedQueuePool"
+    assert status["size"] == settings.db.pool.size
+    assert status["waits"] > 0
+    assert {"checked_out", "idle", "overflow", "wait_max", "timeouts"} <= set(status)
+
+
+@pytest.mark.order(24)
+def test_server_timing_header(api_client_admin, api_client_user2):
+    """Superusers get a Server-Timing header when they ask for it"""
+    header = {settings.instrumentation.header: "1"}
+
+    response = api_client_admin.get("/user/user2/", params={"show_balance": True})
+    assert "server-timing" not in response.headers
+
+    response = api_client_user2.get("/user/user2/", headers=header)
+    assert "server-timing" not in response.headers
+
+    response = api_client_admin.get(
+        "/user/user2/", params={"show_balance": True}, headers=header
+    )
+    timings = {
+        entry.split(";")[0]: entry
+        for entry in response.headers["server-timing"].split(", ")
+    }
+    assert set(timings) == {"db", "auth", "serialize"}
+    assert re.search(r'db;dur=[\d.]+;desc="[1-9]\d* statements"', timings["db"])
+
+
+@pytest.mark.order(25)
+def test_slow_statements_are_logged_with_route(api_client_admin, monkeypatch, caplog):
+    """Statements slower than the threshold are logged with the route name"""
+    monkeypatch.setitem(settings.instrumentation, "slow_statement_threshold", 0)
+    with caplog.at_level("WARNING", logger="dundie_api.db"):
+        response = api_client_admin.get("/transaction/")
+    assert response.status_code == 200
+    assert any("GET /transaction/" in record.getMessage() for record in caplog.records)
+
+
+@pytest.mark.order(26)
+def test_metrics_endpoint(api_client, api_client_admin, monkeypatch):
+    """GET /metrics exposes the HTTP, database and authentication metrics"""
+    # O Redis não está disponível nos testes, a fila é testada em 'test_metrics.py'.
+    monkeypatch.setitem(settings.metrics, "rq", False)
+    assert api_client_admin.get("/user/admin/").status_code == 200
+    assert api_client.get("/user/").status_code == 200
+    assert api_client.get("/nowhere/").status_code == 404
+    response = api_client.get("/transaction/", headers={"Authorization": "Bearer x"})
+    assert response.status_code == 401
+
+    response = api_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    # A latência é rotulada pelo modelo da rota, nunca pelo caminho acessado.
+    assert (
+        'dundie_http_request_duration_seconds_count{method="GET",'
+        'route="/user/{username}/",status="200"}' in body
+    )
+    assert 'route="unmatched",status="404"' in body
+    assert "/nowhere/" not in body
+    # A própria requisição do '/metrics' está em andamento.
+    assert "dundie_http_requests_in_flight 1.0" in body
+    assert re.search(r'dundie_jwt_failures_total\{reason="malformed"\} [1-9]', body)
+    assert re.search(r"dundie_argon2_verify_seconds_count [1-9]", body)
+    assert re.search(r'dundie_db_pool_wait_seconds_count\{engine="sync"\} [1-9]', body)
+    assert 'dundie_db_pool_checked_out_connections{engine="sync"}' in body
+    assert "dundie_broadcast_subscribers" in body
+    assert "dundie_rq_up" not in body
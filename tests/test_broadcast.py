@@ -0,0 +1,125 @@
+import asyncio
+
+from dundie_api.broadcast import BroadcastHub, Subscription, TransactionFilter
+from dundie_api.config import settings
+from dundie_api.timing import RequestMetrics, request_metrics
+
+
+# Teste para validar que um cliente lento, com a fila cheia, é desconectado em vez de
+# bloquear a entrega para os demais clientes.
+def test_slow_subscriber_is_dropped():
+    async def scenario():
+        subscription = Subscription(queue_size=2)
+        assert subscription.deliver({"id": 1})
+        assert subscription.deliver({"id": 2})
+        assert not subscription.deliver({"id": 3})
+        return subscription.dropped, await subscription.get()
+
+    assert asyncio.run(scenario()) == (True, None)
+
+
+# Teste para validar que cada transação é entregue apenas às inscrições cujos filtros
+# ela atende, incluindo a restrição de usuários comuns às suas próprias transferências.
+def test_publish_matches_subscription_filters():
+    transaction = {
+        "id": 10,
+        "value": 5,
+        "user_id": 1,
+        "from_id": 2,
+        "to_dept": "sales",
+        "from_dept": "management",
+    }
+    filters = {
+        "everything": TransactionFilter(),
+        "receiver": TransactionFilter(user_id=1),
+        "other receiver": TransactionFilter(user_id=3),
+        "sender dept": TransactionFilter(dept="management"),
+        "other dept": TransactionFilter(dept="accounting"),
+        "big values": TransactionFilter(min_value=10),
+        "own transfers": TransactionFilter(viewer_id=2),
+        "someone else": TransactionFilter(viewer_id=3),
+    }
+
+    async def scenario():
+        hub = BroadcastHub()
+        subscriptions = {name: Subscription(10, f) for name, f in filters.items()}
+        for subscription in subscriptions.values():
+            hub._add(subscription)
+        hub._publish(transaction)
+        return {name for name, s in subscriptions.items() if not s.queue.empty()}
+
+    assert asyncio.run(scenario()) == {
+        "everything",
+        "receiver",
+        "sender dept",
+        "own transfers",
+    }
+
+
+# Teste para validar que o hub não é reiniciado quando um novo cliente se inscreve logo
+# após o último sair (long-polling) e que ele para após o tempo ocioso configurado.
+def test_hub_stays_running_while_idle(monkeypatch):
+    monkeypatch.setitem(settings.broadcast, "idle_timeout", 0.05)
+
+    async def scenario():
+        hub = BroadcastHub()
+        first = await hub.subscribe()
+        tasks = list(hub._tasks)
+        hub.unsubscribe(first)
+        second = await hub.subscribe()
+        restarted = hub._tasks != tasks
+        hub.unsubscribe(second)
+        running = bool(hub._tasks)
+        await asyncio.sleep(0.2)
+        return restarted, running, hub._tasks, hub._loop
+
+    assert asyncio.run(scenario()) == (False, True, [], None)
+
+
+# Teste para validar que as transações após um id ainda não confirmado aguardam até ele
+# ser confirmado e que, após o 'gap_timeout', o id que falta é ignorado.
+def test_settle_waits_for_missing_ids(monkeypatch):
+    monkeypatch.setitem(settings.broadcast, "gap_timeout", 5)
+
+    def transaction(id: int) -> dict:
+        return {
+            "id": id,
+            "value": 1,
+            "user_id": 1,
+            "from_id": 2,
+            "to_dept": "sales",
+            "from_dept": "sales",
+        }
+
+    async def scenario():
+        hub = BroadcastHub()
+        hub._last_id = 10
+        subscription = Subscription(10)
+        hub._add(subscription)
+        published = [
+            hub._settle([transaction(12)], now=0),
+            hub._settle([transaction(11), transaction(12)], now=1),
+            hub._settle([transaction(14)], now=2),
+            hub._settle([transaction(14)], now=7),
+        ]
+        ids = []
+        while not subscription.queue.empty():
+            ids.append(subscription.queue.get_nowait()["id"])
+        return published, ids, hub.settled_id
+
+    assert asyncio.run(scenario()) == ([0, 2, 0, 1], [11, 12, 14], 14)
+
+
+# Teste para validar que as tarefas do hub não herdam as métricas da requisição que
+# iniciou o hub, já que continuam em execução após ela terminar.
+def test_hub_tasks_do_not_inherit_request_metrics():
+    async def scenario():
+        hub = BroadcastHub()
+        request_metrics.set(RequestMetrics({"type": "http", "path": "/"}))
+        subscription = await hub.subscribe()
+        contexts = [task.get_context() for task in hub._tasks]
+        hub.unsubscribe(subscription)
+        hub._stop()
+        return [context.get(request_metrics) for context in contexts]
+
+    assert asyncio.run(scenario()) == [None]
@@ -0,0 +1,59 @@
+from time import time
+
+from dundie_api.cache import TokenCache, UserCache, UserIdentity
+
+
+def identity(username: str) -> UserIdentity:
+    return UserIdentity(
+        id=1, username=username, name=username, dept="sales", password_version="v1"
+    )
+
+
+# Teste para validar que o cache remove o usuário menos utilizado recentemente ao
+# atingir o tamanho máximo e contabiliza acertos, falhas e remoções.
+def test_user_cache_evicts_least_recently_used():
+    cache = UserCache(maxsize=2, ttl=60)
+    cache.set(identity("a"))
+    cache.set(identity("b"))
+    assert cache.get("a") is not None
+    cache.set(identity("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats() == {
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "expirations": 0,
+        "invalidations": 0,
+        "size": 2,
+    }
+
+
+# Teste para validar que os usuários expiram após o TTL e podem ser invalidados.
+def test_user_cache_expires_and_invalidates():
+    cache = UserCache(maxsize=10, ttl=0)
+    cache.set(identity("a"))
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+    cache = UserCache(maxsize=10, ttl=60)
+    cache.set(identity("a"))
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+# Teste para validar que o payload do token expira no 'exp' do token e que tokens
+# de resetar a senha nunca são armazenados.
+def test_token_cache_expires_at_token_exp():
+    cache = TokenCache(maxsize=10)
+    cache.set("valid", {"sub": "a", "exp": time() + 60})
+    cache.set("expired", {"sub": "a", "exp": time() - 1})
+    cache.set("reset", {"sub": "a", "exp": time() + 60, "scope": "pwd_reset"})
+
+    assert cache.get("valid")["sub"] == "a"
+    assert cache.get("expired") is None
+    assert cache.get("reset") is None
+    assert cache.stats()["size"] == 1
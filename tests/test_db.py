@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import create_engine
+
+from dundie_api.db import TimedQueuePool, pool_status
+
+
+# Teste para validar que o pool registra as conexões em uso e as esperas que atingem
+# o tempo limite.
+def test_timed_pool_reports_checkouts_and_timeouts(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    with engine.connect():
+        assert pool_status(engine.pool)["checked_out"] == 1
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+
+    status = pool_status(engine.pool)
+    assert status["checked_out"] == 0
+    assert status["idle"] == 1
+    assert status["waits"] == 1
+    assert status["timeouts"] == 1
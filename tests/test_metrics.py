@@ -0,0 +1,103 @@
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+
+from prometheus_client import CollectorRegistry
+from redis.exceptions import ConnectionError
+
+from dundie_api.metrics import QueueCollector, route_template
+
+
+class FakeRegistry:
+    def __init__(self, job_ids: list[str]):
+        self.job_ids = job_ids
+
+    @property
+    def count(self) -> int:
+        return len(self.job_ids)
+
+    def get_job_ids(self, start: int = 0, end: int = -1, cleanup: bool = True):
+        return self.job_ids[start:] if end == -1 else self.job_ids[start : end + 1]
+
+
+def fake_job(enqueued: datetime, wait: float = 0, run: float = 0):
+    return SimpleNamespace(
+        enqueued_at=enqueued,
+        started_at=enqueued + timedelta(seconds=wait),
+        ended_at=enqueued + timedelta(seconds=wait + run),
+    )
+
+
+def fake_queue(waiting: list, finished: dict):
+    return SimpleNamespace(
+        name="default",
+        count=len(waiting),
+        connection=None,
+        get_jobs=lambda offset, length: waiting[offset : offset + length],
+        started_job_registry=FakeRegistry(["s1"]),
+        finished_job_registry=FakeRegistry(list(finished)),
+        failed_job_registry=FakeRegistry([]),
+        deferred_job_registry=FakeRegistry([]),
+        scheduled_job_registry=FakeRegistry([]),
+        job_class=SimpleNamespace(
+            fetch_many=lambda ids, connection: [finished.get(id) for id in ids]
+        ),
+    )
+
+
+def collect(collector: QueueCollector) -> CollectorRegistry:
+    registry = CollectorRegistry()
+    registry.register(collector)
+    return registry
+
+
+# Teste para validar que a profundidade da fila, os jobs por estado e a latência média
+# dos últimos jobs concluídos são coletados do RQ.
+def test_queue_collector_reports_depth_and_latency(monkeypatch):
+    now = datetime.now(UTC)
+    finished = {
+        "old": fake_job(now, wait=100, run=100),
+        "a": fake_job(now, wait=1, run=2),
+        "b": fake_job(now, wait=3, run=4),
+    }
+    waiting = [fake_job(now - timedelta(seconds=30)), fake_job(now)]
+    monkeypatch.setattr("dundie_api.queue.queue", fake_queue(waiting, finished))
+
+    registry = collect(QueueCollector(sample_size=2))
+    labels = {"queue": "default"}
+
+    assert registry.get_sample_value("dundie_rq_up") == 1
+    assert registry.get_sample_value("dundie_rq_queue_depth", labels) == 2
+    assert registry.get_sample_value("dundie_rq_jobs", labels | {"state": "started"})
+    assert (
+        registry.get_sample_value("dundie_rq_jobs", labels | {"state": "finished"}) == 3
+    )
+    assert registry.get_sample_value("dundie_rq_oldest_job_age_seconds", labels) >= 30
+    # Apenas os dois últimos jobs concluídos entram na média.
+    latency = "dundie_rq_recent_job_latency_seconds"
+    assert registry.get_sample_value(latency, labels | {"phase": "wait"}) == 2
+    assert registry.get_sample_value(latency, labels | {"phase": "run"}) == 3
+
+
+# Teste para validar que, com o Redis indisponível, apenas 'dundie_rq_up' é exposto.
+def test_queue_collector_without_redis(monkeypatch):
+    class UnavailableQueue:
+        name = "default"
+
+        @property
+        def count(self):
+            raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr("dundie_api.queue.queue", UnavailableQueue())
+
+    registry = collect(QueueCollector(sample_size=10))
+    assert registry.get_sample_value("dundie_rq_up") == 0
+    assert (
+        registry.get_sample_value("dundie_rq_queue_depth", {"queue": "default"}) is None
+    )
+
+
+# Teste para validar que as requisições sem rota correspondente não usam o caminho.
+def test_route_template_of_unmatched_requests():
+    route = SimpleNamespace(path="/user/{username}/")
+    assert route_template({"route": route, "path": "/user/jim/"}) == route.path
+    assert route_template({"path": "/wp-admin/"}) == "unmatched"
@@ -0,0 +1,134 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlmodel import Session, delete, insert, select, text
+
+from dundie_api.db import engine
+from dundie_api.models import Transaction, User
+from dundie_api.routes.transaction import TRANSACTION_ORDERING, _transactions_query
+from dundie_api.tasks.transaction import compute_balance
+
+# Quantidade de usuários e de transações por usuário criados para os testes, o
+# suficiente para que o planejador do banco de dados prefira os índices.
+SEED_USERS = 50
+SEED_TRANSACTIONS_PER_USER = 1_000
+
+
+# Fixture que popula o banco com um volume grande de transações antes dos testes deste
+# módulo e remove todos os registros criados ao final.
+@pytest.fixture(scope="module")
+def seeded_users():
+    now = datetime.now(timezone.utc)
+    with Session(engine) as session:
+        users = [
+            User(
+                name=f"plan-user-{index}",
+                username=f"plan-user-{index}",
+                email=f"plan-user-{index}@dm.com",
+                dept="sales",
+                currency="USD",
+                password="x",
+            )
+            for index in range(SEED_USERS)
+        ]
+        session.add_all(users)
+        session.commit()
+        ids = [user.id for user in users]
+
+        session.execute(
+            insert(Transaction),
+            [
+                {
+                    "user_id": ids[index % SEED_USERS],
+                    "from_id": ids[(index + 1) % SEED_USERS],
+                    "value": 1,
+                    "date": now - timedelta(seconds=index),
+                }
+                for index in range(SEED_USERS * SEED_TRANSACTIONS_PER_USER)
+            ],
+        )
+        session.commit()
+
+        # Atualiza as estatísticas das tabelas usadas pelo planejador.
+        session.execute(text("ANALYZE"))
+        session.commit()
+
+        yield users
+
+        session.execute(delete(Transaction).where(Transaction.user_id.in_(ids)))  # type: ignore
+        session.execute(delete(User).where(User.id.in_(ids)))  # type: ignore
+        session.commit()
+
+
+# Função que retorna o plano de execução de uma query, tanto no PostgreSQL quanto
+# no SQLite (usado apenas localmente).
+def explain(session: Session, query) -> str:
+    dialect = session.get_bind().dialect
+    sql = query.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    if dialect.name == "postgresql":
+        return "\n".join(row[0] for row in session.execute(text(f"EXPLAIN {sql}")))
+    rows = session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+    return "\n".join(row[-1] for row in rows)
+
+
+# Função que garante que a tabela não é lida por completo no plano de execução.
+def assert_index_scan(plan: str, table: str = "transaction"):
+    assert not re.search(rf"Seq Scan on \"?{table}\b", plan), plan
+    assert not re.search(rf"\bSCAN \"?{table}\"?$", plan, re.MULTILINE), plan
+    assert re.search(r"Index|USING (INDEX|INTEGER PRIMARY KEY)", plan), plan
+
+
+def test_list_transactions_filtered_by_user_uses_index(seeded_users):
+    admin = User(id=0, dept="management")
+    query = _transactions_query(admin, user=seeded_users[3].username)
+    with Session(engine) as session:
+        assert_index_scan(explain(session, query))
+
+
+def test_list_transactions_filtered_by_from_user_uses_index(seeded_users):
+    admin = User(id=0, dept="management")
+    query = _transactions_query(admin, from_user=seeded_users[3].username)
+    with Session(engine) as session:
+        assert_index_scan(explain(session, query))
+
+
+def test_list_transactions_visibility_filter_uses_index(seeded_users):
+    query = _transactions_query(seeded_users[3])
+    with Session(engine) as session:
+        assert_index_scan(explain(session, query))
+
+
+# A ordenação de uma página profunda deve percorrer o índice na ordem desejada, em vez
+# de ordenar todas as transações.
+@pytest.mark.parametrize("order_by", [*TRANSACTION_ORDERING, "-date", "-value"])
+def test_list_transactions_sorted_page_skips_full_sort(seeded_users, order_by):
+    admin = User(id=0, dept="management")
+    columns = TRANSACTION_ORDERING[order_by.removeprefix("-")]
+    descending = order_by.startswith("-")
+    query = _transactions_query(admin).order_by(
+        *[column.desc() if descending else column.asc() for column in columns]
+    )
+    with Session(engine) as session:
+        plan = explain(session, query.offset(10_000).limit(50))
+        assert "TEMP B-TREE" not in plan, plan
+        assert not re.search(r"^\s*(->\s*)?Sort\b", plan, re.MULTILINE), plan
+
+
+def test_websocket_new_transactions_poll_uses_index(seeded_users):
+    with Session(engine) as session:
+        last = session.scalar(select(Transaction.id).order_by(Transaction.id.desc()))  # type: ignore
+        query = select(Transaction).where(Transaction.id > last - 10).order_by("id")  # type: ignore
+        assert_index_scan(explain(session, query))
+
+
+def test_compute_balance_uses_index(seeded_users):
+    user_id = seeded_users[3].id
+    total = (
+        select(Transaction.value).where(Transaction.user_id == user_id),
+        select(Transaction.value).where(Transaction.from_id == user_id),
+    )
+    with Session(engine) as session:
+        for query in total:
+            assert_index_scan(explain(session, query))
+        assert compute_balance(session, user_id) == 0
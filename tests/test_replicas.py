@@ -0,0 +1,76 @@
+from time import monotonic, sleep
+
+from fastapi import Response
+
+from dundie_api.db import build_async_engine, build_engine
+from dundie_api.replicas import WRITE_COOKIE, Replica, ReplicaRouter
+
+
+def replica(uri: str) -> Replica:
+    return Replica(build_engine(uri), build_async_engine(uri))
+
+
+def replica_router(*replicas: Replica) -> ReplicaRouter:
+    return ReplicaRouter(
+        list(replicas), sticky_seconds=60, max_lag=5, check_interval=60
+    )
+
+
+# Teste para validar que as leituras são distribuídas em rodízio entre as réplicas e
+# que, após uma escrita, as leituras do mesmo cliente vão para o primário, inclusive
+# em outro worker (outra instância do roteador).
+def test_reads_round_robin_and_stick_to_primary_after_write(tmp_path):
+    first = replica(f"sqlite:///{tmp_path / 'first.db'}")
+    second = replica(f"sqlite:///{tmp_path / 'second.db'}")
+    router = replica_router(first, second)
+    router.check_replicas()
+
+    assert [router.pick() for _ in range(4)] == [first, second] * 2
+
+    response = Response()
+    router.mark_write(response)
+    marker = (
+        response.headers["set-cookie"].split(";")[0].removeprefix(f"{WRITE_COOKIE}=")
+    )
+    assert router.pick(marker) is None
+    assert replica_router(first, second).pick(marker) is None
+    assert router.pick(None) is not None
+
+    # Marcas alteradas pelo cliente ou expiradas são ignoradas.
+    until, _, signature = marker.rpartition(".")
+    assert router.pick(f"{float(until) + 60}.{signature}") is not None
+    assert router.pick("garbage") is not None
+    router.sticky_seconds = -1
+    assert router.pick(router.write_marker()) is not None
+
+
+# Teste para validar que réplicas fora do ar ou atrasadas são ignoradas e que, sem
+# nenhuma réplica saudável, as leituras vão para o primário.
+def test_unhealthy_replicas_fall_back_to_primary(tmp_path):
+    down = replica(f"sqlite:///{tmp_path / 'missing' / 'down.db'}")
+    lagging = replica(f"sqlite:///{tmp_path / 'lagging.db'}")
+    healthy = replica(f"sqlite:///{tmp_path / 'healthy.db'}")
+    router = replica_router(down, lagging, healthy)
+
+    router.check_replicas()
+    assert not down.healthy
+    lagging.healthy, lagging.lag = False, 30.0
+    assert {router.pick() for _ in range(3)} == {healthy}
+
+    router = replica_router(down)
+    assert router.pick() is None
+
+
+# Teste para validar que a escolha da réplica não acessa o banco de dados: antes da
+# primeira verificação, feita em segundo plano, as leituras vão para o primário.
+def test_replicas_are_checked_in_the_background(tmp_path):
+    first = replica(f"sqlite:///{tmp_path / 'first.db'}")
+    router = replica_router(first)
+
+    assert not first.healthy
+    router.pick()
+    deadline = monotonic() + 5
+    while first.checked_at is None and monotonic() < deadline:
+        sleep(0.01)
+    router.stop()
+    assert router.pick() is first